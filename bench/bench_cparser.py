@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark of parsing chat frames.
+
+Compare cparser.parse_comment with the minidom parser,
+and ChatStreamParser with decoding and parsing each frame.
+Frames are generated like the comment server,
+or read from a log saved by --save-log.
+
+    python3 bench/bench_cparser.py [LOGFILE]
+"""
+
+from typing import (List, Optional)
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nicomodule.live import (cparser, cserver)  # noqa: E402
+
+
+def load_frames(argv: List[str], count: int=100000) -> List[str]:
+    """Read frames from a log, or generate them.
+    """
+    if len(argv) > 1:
+        with open(argv[1], "r") as logopen:
+            frames = [ln.rstrip("\n") for ln in logopen
+                      if ln.startswith("<chat")]
+        # Repeat to the count.
+        return (frames * (count // max(len(frames), 1) + 1))[:count]
+
+    conf = cserver.StreamConfig()
+    rand = random.Random(0)
+    return [cserver.gen_chat(num, conf, rand).decode("utf-8")
+            for num in range(1, count + 1)]
+
+
+def measure(name: str,
+            func,
+            items: list,
+            count: Optional[int]=None,
+            repeat: int=3) -> float:
+    """Best time of the repeats.
+    """
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print("{0:<14} {1:>8.3f}s {2:>8.2f} us/frame".format(
+        name, elapsed, elapsed / (count or len(items)) * 1e6))
+    return elapsed
+
+
+def _main() -> None:
+    frames = load_frames(sys.argv)
+    mismatch = sum(1 for _ in frames
+                   if cparser.parse_comment(_) != cparser._parse_dom(_))
+    print("{0} frames, {1} mismatches".format(len(frames), mismatch))
+
+    dom = measure("minidom", cparser._parse_dom, frames)
+    fast = measure("parse_comment", cparser.parse_comment, frames)
+    print("speedup: {0:.1f}x".format(dom / fast))
+
+    # The stream as received, in 4096 bytes reads.
+    stream = b"\x00".join(f.encode("utf-8") for f in frames) + b"\x00"
+    reads = [stream[idx:idx + 4096] for idx in range(0, len(stream), 4096)]
+
+    def per_frame(rawdata: bytes) -> None:
+        for rawdatum in rawdata.split(b"\x00"):
+            if rawdatum:
+                cparser.parse_comment(rawdatum.decode("utf-8", "ignore"))
+
+    def incremental(rawdata: bytes) -> None:
+        parser.feed(rawdata)
+
+    parser = cparser.ChatStreamParser()
+    measure("decode+parse", per_frame, reads, len(frames))
+    measure("stream parser", incremental, reads, len(frames))
+
+
+if __name__ == "__main__":
+    _main()
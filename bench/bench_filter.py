@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark of the comment filter by the number of rules.
+
+Compare RuleMatcher with searching the regexes one by one.
+Rules are generated like filter/mute-re-comment.txt,
+mostly literal words and ^ anchored commands.
+Then MatchFilter with and without the verdict cache on a flood,
+and the startup with and without the compiled cache.
+
+    python3 bench/bench_filter.py [RULES ...]
+"""
+
+from typing import (List, Pattern, Set)
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nicomodule.common import genfilter  # noqa: E402
+from nicomodule.live import cserver  # noqa: E402
+
+
+def gen_rules(count: int, rand: random.Random) -> Set[Pattern]:
+    """Literal 60%, anchored 30% and other regexes 10%.
+    """
+    words = set()
+    while len(words) < count:
+        word = "".join(rand.choice("abcdefghijklmnopqrstuvwxyz")
+                       for _ in range(rand.randint(4, 10)))
+        kind = rand.random()
+        if kind < 0.6:
+            words.add(word)
+        elif kind < 0.9:
+            words.add("^/{0} [0-9]+$".format(word))
+        else:
+            words.add("{0}[0-9]{{2,}}".format(word[:3]))
+    return genfilter.gen_reg_set(words)
+
+
+def measure(name: str, func, texts: List[str], repeat: int=3) -> float:
+    """Best time of the repeats, per text.
+    """
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return elapsed / len(texts)
+
+
+def _main() -> None:
+    counts = [int(_) for _ in sys.argv[1:]] or [10, 100, 1000, 5000]
+    rand = random.Random(0)
+    conf = cserver.StreamConfig()
+    texts = [re.sub(r"<[^>]+>", "",
+                    cserver.gen_chat(num, conf, rand).decode("utf-8"))
+             for num in range(1, 2001)]
+
+    print("{0:>6} {1:>12} {2:>12} {3:>8}".format(
+        "rules", "any() us", "matcher us", "speedup"))
+    for count in counts:
+        regexes = gen_rules(count, rand)
+        # Some texts hit the rules.
+        samples = [regex.pattern for regex in list(regexes)[:200]
+                   if genfilter.literal_word(regex.pattern) is not None]
+        cases = texts + [text + sample for text, sample in
+                         zip(texts, samples)]
+        matcher = genfilter.RuleMatcher(regexes)
+
+        def naive(text: str) -> bool:
+            return any(_.search(text) for _ in regexes)
+
+        mismatch = sum(1 for _ in cases
+                       if naive(_) != (matcher.search(_) is not None))
+        old = measure("any()", naive, cases)
+        new = measure("matcher", matcher.search, cases)
+        print("{0:>6} {1:>12.2f} {2:>12.2f} {3:>7.1f}x{4}".format(
+            count, old * 1e6, new * 1e6, old / new,
+            " ({0} mismatches)".format(mismatch) if mismatch else ""))
+
+    # 90% of the comments are copies of a few texts.
+    flood = [rand.choice(("ｗｗｗｗ", "8888888", "/hb ifseetno 12"))
+             if rand.random() < 0.9 else text for text in texts]
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as rulefile:
+        rulefile.write("\n".join(regex.pattern for regex in regexes))
+        rulefile.flush()
+        for cachesize in (0, 4096):
+            mutefilter = genfilter.MatchFilter(rulefile.name,
+                                               cachesize=cachesize)
+            elapsed = measure("flood", mutefilter.ismatch, flood)
+            print("flood, cache {0:>4}: {1:>8.2f} us ({2})".format(
+                cachesize, elapsed * 1e6, mutefilter.cache))
+
+        cachefile = rulefile.name + ".cache"
+        try:
+            for label in ("cold", "warm"):
+                # Not to reuse the patterns compiled in this process.
+                re.purge()
+                start = time.perf_counter()
+                genfilter.compile_rules(rulefile.name, cachefile)
+                print("startup, {0}: {1:>8.3f} s".format(
+                    label, time.perf_counter() - start))
+        finally:
+            if os.path.exists(cachefile):
+                os.remove(cachefile)
+
+
+if __name__ == "__main__":
+    _main()
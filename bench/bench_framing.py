@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Microbenchmark of framing the comment stream.
+
+Compare the former split/concatenate framing with FrameBuffer.
+Objects and bytes allocated by the framing are counted per comment.
+
+    python3 bench/bench_framing.py
+"""
+
+from typing import (Iterator, List, Tuple)
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nicomodule.live.niconnect import FrameBuffer  # noqa: E402
+
+
+def gen_stream(count: int, size: int) -> bytes:
+    """Generate chat frames splitted with null string.
+    """
+    frames = []
+    for num in range(count):
+        head = '<chat thread="1" no="{0}" date="1500000000" user_id="u{0}">'
+        text = "コメント" * (size // 12)
+        frames.append((head.format(num) + text + "</chat>").encode("utf-8"))
+    return b"\x00".join(frames) + b"\x00"
+
+
+def chunks(stream: bytes, step: int) -> Iterator[bytes]:
+    """Slice the stream like socket.recv.
+    """
+    for idx in range(0, len(stream), step):
+        yield stream[idx:idx + step]
+
+
+def frame_split(stream: bytes, step: int) -> Tuple[int, int, int]:
+    """The former MsgSocket.recv_comments framing.
+    """
+    frames = allocs = copied = 0
+    partstr = None
+    for rawdata in chunks(stream, step):
+        # recv result, the list and each splitted piece.
+        pieces = rawdata.split(b"\x00")
+        allocs += 2 + len(pieces)
+        copied += len(rawdata) * 2
+        for rawdatum in pieces:
+            if partstr:
+                rawdatum = partstr + rawdatum
+                partstr = None
+                allocs += 1
+                copied += len(rawdatum)
+            if rawdatum.endswith(b"</chat>"):
+                frames += 1
+            else:
+                partstr = rawdatum
+    return (frames, allocs, copied)
+
+
+def frame_buffer(stream: bytes, step: int) -> Tuple[int, int, int]:
+    """Framing with FrameBuffer.
+    """
+    frames = allocs = copied = 0
+    framebuf = FrameBuffer()
+    source = memoryview(stream)
+    idx = 0
+    while idx < len(stream):
+        # The reserved memoryview, recv_into writes to it directly.
+        space = framebuf.reserve()
+        allocs += 1
+        size = min(step, len(space), len(stream) - idx)
+        space[:size] = source[idx:idx + size]
+        framebuf.commit(size)
+        copied += size
+        idx += size
+        for frame in framebuf.frames():
+            frames += 1
+            allocs += 1
+            copied += len(frame)
+    return (frames, allocs, copied)
+
+
+def measure(name: str, func, stream: bytes, step: int) -> List[float]:
+    start = time.perf_counter()
+    frames, allocs, copied = func(stream, step)
+    elapsed = time.perf_counter() - start
+    print("  {0:<12} {1:>8.3f} us/comment {2:>6.2f} allocs/comment "
+          "{3:>8.1f} bytes copied/comment".format(
+              name,
+              elapsed / frames * 1e6,
+              allocs / frames,
+              copied / frames))
+    return [elapsed, allocs, copied]
+
+
+def _main() -> None:
+    cases = [
+        ("backlog: 100B frames, 4096B reads", 100000, 100, 4096),
+        ("busy: 300B frames, 1460B reads", 100000, 300, 1460),
+        ("fragmented: 2KB frames, 64B reads", 20000, 2048, 64)
+    ]
+    for title, count, size, step in cases:
+        stream = gen_stream(count, size)
+        print(title)
+        measure("split", frame_split, stream, step)
+        measure("FrameBuffer", frame_buffer, stream, step)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Throughput of ncv-py.py against the local comment server.
+
+Run the viewer in a temporary directory, discard its output,
+and print how fast it drained the stream.
+
+    python3 bench/bench_viewer.py [--count N] [--fragment N] [-- OPTIONS]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from nicomodule.live import cserver  # noqa: E402
+
+
+def _main() -> None:
+    argParser = argparse.ArgumentParser(description=__doc__)
+    argParser.add_argument("--count", default=20000, type=int)
+    argParser.add_argument("--rate", default=0.0, type=float)
+    argParser.add_argument("--burst", default=1, type=int)
+    argParser.add_argument("--fragment", default=0, type=int)
+    # ID users are looked up over the network.
+    argParser.add_argument("--anonymous", default=1.0, type=float)
+    argParser.add_argument("options", nargs="*",
+                           help="options passed to ncv-py.py")
+    parsedArgs = argParser.parse_args()
+
+    conf = cserver.StreamConfig(count=parsedArgs.count,
+                                rate=parsedArgs.rate,
+                                burst=parsedArgs.burst,
+                                fragment=parsedArgs.fragment,
+                                anonymous=parsedArgs.anonymous)
+    with cserver.CommentServer(conf) as server, \
+            tempfile.TemporaryDirectory() as workdir:
+        addr, port = server.address
+        xmlfile = os.path.join(workdir, "getplayerstatus.xml")
+        with open(xmlfile, "w") as xmlopen:
+            xmlopen.write(cserver.gen_player_status(addr, port, conf.thread))
+
+        viewer = [sys.executable, os.path.join(ROOT, "ncv-py.py"),
+                  xmlfile, "--limit", "1000"] + parsedArgs.options
+        subprocess.run(viewer, cwd=workdir, check=True,
+                       stdout=subprocess.DEVNULL)
+        print(server.wait_report(timeout=10))
+
+
+if __name__ == "__main__":
+    _main()
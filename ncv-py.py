@@ -2,31 +2,64 @@
 # -*- coding: utf-8 -*-
 """Niconico comment viewer using nicomodule."""
 
+from typing import (Dict, List, Optional, Tuple, Union)
 import argparse
+import asyncio
 import os
+import signal
 import sys
 
 from nicomodule.common import (genfilter,
+                               nickname,
                                nicoid,
-                               nickname)
+                               ratelimit)
 from nicomodule.live import (cparser,
                              niconnect,
                              pstat)
 from nicomodule.app import cview
+from nicomodule.app.deftypes import NameMap
+
+
+class Room():
+    """A program to watch.
+
+    Attributes:
+        liveid: Content id given by the argument.
+        plystat: The program's player status.
+        logfile: Path to the comment log, or None.
+        prefix: Strings put before each comment.
+        flood: Flood detector of the room, or None.
+    """
+    def __init__(self,
+                 liveid: str,
+                 plystat: pstat.LivePlayerStatus,
+                 logfile: Optional[str],
+                 prefix: str,
+                 flood: Optional[genfilter.FloodFilter]=None) -> None:
+        self.liveid = liveid  # type: str
+        self.plystat = plystat  # type: pstat.LivePlayerStatus
+        self.logfile = logfile  # type: Optional[str]
+        self.prefix = prefix  # type: str
+        self.flood = flood  # type: Optional[genfilter.FloodFilter]
 
 
 def _main() -> None:
     conf = cview.Config()
+    for endpoint, (rate, burst) in conf.rateLimits.items():
+        ratelimit.get_limiter().configure(endpoint, rate, burst)
 
     cview.mk_dir(conf.cookieDir)
     cview.mk_dir(conf.filterDir)
-    nickname.touch_json(conf.nickNameId)
-    nickname.touch_json(conf.nickNameAnon)
-    nameMapId = cview.load_json(conf.nickNameId)
-    nameMapAnon = cview.load_json(conf.nickNameAnon)
+    # Nickname maps shared by all rooms, keyed by anonymity.
+    nameMaps = cview.open_name_maps(conf)  # type: Dict[str, NameMap]
+    # Usernames are retrieved without stopping the display.
+    nameResolver = cview.start_name_resolver(nameMaps["0"], conf)
 
     parsedArgs = parse_args(conf)
 
+    if parsedArgs.profile_filter is True:
+        conf.filterProfile = True
+
     # If narrow option is explicited or configured, True.
     if conf.narrow is True:
         pass
@@ -45,7 +78,11 @@ def _main() -> None:
     """
     if parsedArgs.use_filter is True:
         try:
-            cmtFilter = (genfilter.MatchFilter(conf.muteReCmt))
+            cmtFilter = (genfilter.MatchFilter(conf.muteReCmt,
+                                               conf.filterCache,
+                                               conf.filterNormalize,
+                                               conf.filterProfile,
+                                               conf.filterCompiled))
             conf.use_cmt_filter = True
         # Disable comment filtering if any errors occurred.
         except IOError as err:
@@ -57,7 +94,11 @@ def _main() -> None:
     elif parsedArgs.use_filter is False:
         if conf.use_cmt_filter is True:
             try:
-                cmtFilter = (genfilter.MatchFilter(conf.muteReCmt))
+                cmtFilter = (genfilter.MatchFilter(conf.muteReCmt,
+                                                   conf.filterCache,
+                                                   conf.filterNormalize,
+                                                   conf.filterProfile,
+                                                   conf.filterCompiled))
             # Disable comment filtering if any errors occurred.
             except IOError as err:
                 print("[ERR] {0}: comment filter disabled."
@@ -68,52 +109,19 @@ def _main() -> None:
         elif conf.use_cmt_filter is False:
             cmtFilter = None
 
-    if os.path.basename(parsedArgs.url) != "getplayerstatus.xml":
-        # Check if liveId is valid format.
-        liveId = parsedArgs.url
-        try:
-            liveId = nicoid.grep_lv(liveId)
-        except ValueError as err:
-            try:
-                liveId = nicoid.grep_co(liveId)
-            except ValueError as err:
-                cview.error_exit(err, parsedArgs.url)
+    # Muted users are checked before the comment filter.
+    userFilter = None  # type: Optional[genfilter.UserFilter]
+    if cmtFilter is not None:
+        userFilter = genfilter.UserFilter(conf.muteUser)
 
-        # If cookie does't exist, try to login.
-        if not os.path.exists(parsedArgs.cookie):
-            cview.login_nico(parsedArgs.cookie)
-        userSession = cview.pull_usersession(parsedArgs.cookie)
-
-        statusXml = pstat.get_live_player_status(userSession, liveId)
-        plyStat = pstat.LivePlayerStatus(statusXml)
-    elif os.path.basename(parsedArgs.url) == "getplayerstatus.xml":
-        """
-        Use local getplayerstatus.xml file.
-        This can retrieved by:
-
-        javascript:(function () {
-            const host = '//live.nicovideo.jp/api/getplayerstatus?v=';
-            const liveId = window.location.pathname.split('/').reverse()[0];
-            const url = host + liveId;
-            window.open(url, '_blank');
-        })()
-
-        on live page.
-        """
+    urls = list(parsedArgs.url)
+    if parsedArgs.rooms:
         try:
-            with open(parsedArgs.url, "r") as xmlopen:
-                statusXml = xmlopen.read()
-            plyStat = pstat.LivePlayerStatus(statusXml)
-            liveId = plyStat.lvid
-        # xml.parsers.expat.ExpatError,
-        # FileNotFoundError, etc...
-        except Exception as err:
-            cview.error_exit(err, parsedArgs.url)
-
-    # Check program status: ended/deleted/comingsoon.
-    if plyStat.errcode:
-        sys.exit("[INFO] program: {0} {1}"
-                 .format(liveId, plyStat.errcode))
+            urls.extend(read_rooms(parsedArgs.rooms))
+        except IOError as err:
+            cview.error_exit(err, parsedArgs.rooms)
+    # Watching a single room keeps the original output.
+    isMulti = len(urls) > 1
 
     # Check if logLimit is valid format.
     if parsedArgs.limit >= 0 and parsedArgs.limit <= 1000:
@@ -123,85 +131,463 @@ def _main() -> None:
     elif parsedArgs.limit > 1000:
         logLimit = 1000
 
-    # If --save-log is true, define logFile and write program data.
-    if parsedArgs.save_log is True:
-        cview.mk_dir(conf.logDir)
-        cview.mk_dir(os.path.join(conf.logDir,
-                                  plyStat.community + ""))
-
-        logFile = os.path.join(conf.logDir,
-                               plyStat.community,
-                               plyStat.lvid + ".txt")
-        cview.write_file(
-            "# {0} : {1}".format(
-                plyStat.lvid,
-                plyStat.title),
-            logFile)
-        cview.write_file(
-            "# {0} / {1}".format(
-                plyStat.owner,
-                plyStat.community),
-            logFile)
-    else:
-        logFile = None
+    userSession = None
+    statusCache = pstat.StatusCache(conf.statusCache, conf.statusTTL)
+    liveIds = {url: grep_live_id(url) for url in urls
+               if os.path.basename(url) != "getplayerstatus.xml"}
+    statuses = {}  # type: Dict[str, Union[pstat.LivePlayerStatus, str]]
+    # Warm restarts skip login and the requests.
+    for liveId in liveIds.values():
+        plyStat = statusCache.get(liveId)
+        if plyStat is not None:
+            statuses[liveId] = plyStat
+    missed = [_ for _ in liveIds.values() if _ not in statuses]
+    if missed:
+        # If cookie does't exist, try to login.
+        if not os.path.exists(parsedArgs.cookie):
+            cview.login_nico(parsedArgs.cookie)
+        userSession = cview.pull_usersession(parsedArgs.cookie)
+        # Resolve community/channel ids concurrently.
+        statuses.update(pstat.resolve_statuses(userSession,
+                                               missed,
+                                               cache=statusCache))
+
+    rooms = []  # type: List[Room]
+    for url in urls:
+        if os.path.basename(url) != "getplayerstatus.xml":
+            liveId = liveIds[url]
+            resolved = statuses[liveId]
+            # Not on air, or the request failed.
+            if isinstance(resolved, str):
+                if resolved.startswith("error:"):
+                    message = "[ERR] {0} {1}"
+                else:
+                    message = "[INFO] program: {0} {1}"
+                message = message.format(liveId, resolved)
+                if not isMulti:
+                    sys.exit(message)
+                print(message, file=sys.stderr)
+                continue
+            plyStat = resolved
+        elif os.path.basename(url) == "getplayerstatus.xml":
+            liveId, plyStat = load_status(url)
+
+        # Check program status: ended/deleted/comingsoon.
+        if plyStat.errcode:
+            message = ("[INFO] program: {0} {1}"
+                       .format(liveId, plyStat.errcode))
+            if not isMulti:
+                sys.exit(message)
+            print(message, file=sys.stderr)
+            continue
+
+        # If --save-log is true, define logFile and write program data.
+        if parsedArgs.save_log is True:
+            logFile = open_log(plyStat, conf)
+        else:
+            logFile = None
+
+        if isMulti:
+            prefix = "[{0}] ".format(liveId)
+        else:
+            prefix = ""
+        # Raids are counted by room.
+        if conf.use_cmt_filter is True:
+            flood = genfilter.FloodFilter(conf.floodWindow,
+                                          conf.floodTexts,
+                                          conf.floodUser,
+                                          conf.floodMute,
+                                          conf.floodKeys)
+        else:
+            flood = None
+        rooms.append(Room(liveId, plyStat, logFile, prefix, flood))
+
+    if not rooms:
+        sys.exit("[INFO] no program to watch.")
 
-    # Connect socket to comment-server.
-    # socket.close() is called by __exit__.
-    with niconnect.MsgSocket() as msgSock:
-        msgSock.connect(
-            plyStat.addr,
-            plyStat.port,
-            plyStat.thread,
-            log=logLimit)
+    try:
+        asyncio.run(watch_rooms(rooms, logLimit, conf, nameMaps,
+                                nameResolver, cmtFilter, userFilter,
+                                statusCache))
+    finally:
+        nameResolver.close()
+        cview.close_name_maps(nameMaps, conf)
+        if cmtFilter is not None and cmtFilter.profile is not None:
+            print_profile(cmtFilter)
 
-        for comment in msgSock.recv_comments():
-            if logFile:
-                cview.write_file(comment, logFile)
 
-            parsed = cparser.parse_comment(comment)
+def print_profile(cmtFilter: genfilter.MatchFilter) -> None:
+    """Print the profile of the filter rules.
 
-            if parsed["tag"] == "thread":
-                continue
+    Arguments:
+        cmtFilter: The comment filter profiling.
 
-            # ID users
-            if parsed["anonymity"] == "0":
-                toReload = cview.name_handle(parsed,
-                                             conf,
-                                             nameMapId)
-                if toReload is True:
-                    nameMapId = cview.load_json(
-                        conf.nickNameId)
-            # 184(anonymous) users
-            elif parsed["anonymity"] == "1":
-                toReload = cview.name_handle(parsed,
-                                             conf,
-                                             nameMapAnon)
-                if toReload is True:
-                    nameMapAnon = cview.load_json(
-                        conf.nickNameAnon)
-
-            # Break when "/disconnect" is sent by admin/broadcaster.
-            # Assign before mute.
-            isDisconnected = all([parsed["content"] == "/disconnect",
-                                  int(parsed["premium"]) > 1])
-
-            if conf.use_cmt_filter and cmtFilter:
-                souldMute = cmtFilter.ismatch(parsed["content"])
-                if souldMute and isDisconnected:
-                    break
-                elif souldMute:
-                    continue
-
-            if conf.narrow is False:
-                cview.show_comment(parsed,
-                                   plyStat.start,
-                                   conf.nameLength)
-            elif conf.narrow is True:
-                cview.narrow_comment(parsed, conf.nameLength)
-            if isDisconnected:
-                break
+    Returns:
+        None
+    """
+    print("[INFO] filter profile: {0}\n{1}"
+          .format(cmtFilter.filepath, cmtFilter.profile.report()),
+          file=sys.stderr, flush=True)
+
+
+def grep_live_id(url: str) -> str:
+    """Get the content id of a live/community URL.
+
+    Arguments:
+        url: live/community URL.
 
-    print("Program ended.")
+    Returns:
+        The content id.
+    """
+    # Check if liveId is valid format.
+    liveId = url
+    try:
+        liveId = nicoid.grep_lv(liveId)
+    except ValueError as err:
+        try:
+            liveId = nicoid.grep_co(liveId)
+        except ValueError as err:
+            cview.error_exit(err, url)
+    return liveId
+
+
+def load_status(xmlfile: str) -> Tuple[str, pstat.LivePlayerStatus]:
+    """Load the player status from a local file.
+
+    Use local getplayerstatus.xml file.
+    This can retrieved by:
+
+    javascript:(function () {
+        const host = '//live.nicovideo.jp/api/getplayerstatus?v=';
+        const liveId = window.location.pathname.split('/').reverse()[0];
+        const url = host + liveId;
+        window.open(url, '_blank');
+    })()
+
+    on live page.
+
+    Arguments:
+        xmlfile: Path to getplayerstatus.xml.
+
+    Returns:
+        A tuple of the content id and its player status.
+    """
+    try:
+        with open(xmlfile, "r") as xmlopen:
+            statusXml = xmlopen.read()
+        plyStat = pstat.LivePlayerStatus(statusXml)
+        liveId = plyStat.lvid
+    # xml.parsers.expat.ExpatError,
+    # FileNotFoundError, etc...
+    except Exception as err:
+        cview.error_exit(err, xmlfile)
+
+    return (liveId, plyStat)
+
+
+def open_log(plyStat: pstat.LivePlayerStatus, conf: cview.Config) -> str:
+    """Define the log file and write program data.
+
+    Arguments:
+        plyStat: The program's player status.
+        conf: The configuration instance.
+
+    Returns:
+        Path to the log file.
+    """
+    cview.mk_dir(conf.logDir)
+    cview.mk_dir(os.path.join(conf.logDir,
+                              plyStat.community + ""))
+
+    logFile = os.path.join(conf.logDir,
+                           plyStat.community,
+                           plyStat.lvid + ".txt")
+    cview.write_file(
+        "# {0} : {1}".format(
+            plyStat.lvid,
+            plyStat.title),
+        logFile)
+    cview.write_file(
+        "# {0} / {1}".format(
+            plyStat.owner,
+            plyStat.community),
+        logFile)
+    return logFile
+
+
+def read_rooms(roomfile: str) -> List[str]:
+    """Read live/community URLs from a file.
+
+    One URL per line, #lines and blank lines are ignored.
+
+    Arguments:
+        roomfile: Path to the room list file.
+
+    Returns:
+        List of URLs.
+    """
+    with open(roomfile, "r") as fopen:
+        lines = [ln.strip() for ln in fopen]
+    return [ln for ln in lines if ln and not ln.startswith("#")]
+
+
+async def watch_rooms(rooms: List[Room],
+                      logLimit: int,
+                      conf: cview.Config,
+                      nameMaps: Dict[str, NameMap],
+                      nameResolver: nickname.NameResolver,
+                      cmtFilter: Optional[genfilter.MatchFilter],
+                      userFilter: Optional[genfilter.UserFilter],
+                      statusCache: pstat.StatusCache) -> None:
+    """Watch all rooms on one event loop.
+
+    The filter files are watched meanwhile, to reload the rules.
+    The filter profile is printed on SIGUSR1, from the loop
+    not to interrupt writing comments.
+
+    Arguments:
+        rooms: Rooms to watch.
+        logLimit: Number of past comment.
+        conf: The configuration instance.
+        nameMaps: Nickname maps keyed by anonymity.
+        nameResolver: Retrieves usernames of ID users.
+        cmtFilter: The comment filter, or None.
+        userFilter: The muted users, or None.
+        statusCache: The player status cache to invalidate.
+
+    Returns:
+        None
+    """
+    if cmtFilter is not None:
+        watcher = asyncio.ensure_future(
+            watch_filter(cmtFilter, userFilter, conf.reloadInterval))
+    profiling = (cmtFilter is not None and cmtFilter.profile is not None
+                 and hasattr(signal, "SIGUSR1"))
+    if profiling:
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGUSR1, print_profile, cmtFilter)
+    try:
+        await asyncio.gather(*(watch_room(room, logLimit, conf, nameMaps,
+                                          nameResolver, cmtFilter,
+                                          userFilter, statusCache)
+                               for room in rooms))
+    finally:
+        if profiling:
+            loop.remove_signal_handler(signal.SIGUSR1)
+        if cmtFilter is not None:
+            watcher.cancel()
+
+
+async def watch_filter(cmtFilter: genfilter.MatchFilter,
+                       userFilter: Optional[genfilter.UserFilter],
+                       interval: float) -> None:
+    """Reload the filters when their files are changed.
+
+    The rules are compiled on a thread,
+    and swapped on the loop between comments.
+    Muted users are only read into sets, reloaded on the loop.
+
+    Arguments:
+        cmtFilter: The comment filter.
+        userFilter: The muted users, or None.
+        interval: Seconds between checking the files.
+
+    Returns:
+        None
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(interval)
+        if userFilter is not None and userFilter.changed():
+            print("[INFO] {0}: reloaded {1} rules."
+                  .format(userFilter.filepath, userFilter.reload()),
+                  file=sys.stderr)
+        if not cmtFilter.changed():
+            continue
+        matcher = await loop.run_in_executor(None, cmtFilter.compile)
+        cmtFilter.swap_rules(matcher)
+        print("[INFO] {0}: reloaded {1} rules."
+              .format(cmtFilter.filepath, len(matcher)),
+              file=sys.stderr)
+
+
+async def watch_room(room: Room,
+                     logLimit: int,
+                     conf: cview.Config,
+                     nameMaps: Dict[str, NameMap],
+                     nameResolver: nickname.NameResolver,
+                     cmtFilter: Optional[genfilter.MatchFilter],
+                     userFilter: Optional[genfilter.UserFilter],
+                     statusCache: pstat.StatusCache) -> None:
+    """Connect to the comment server and show comments of a room.
+
+    The cached player status is dropped when the connection fails
+    or the program ends.
+
+    Arguments:
+        room: The room to watch.
+        logLimit: Number of past comment.
+        conf: The configuration instance.
+        nameMaps: Nickname maps keyed by anonymity.
+        nameResolver: Retrieves usernames of ID users.
+        cmtFilter: The comment filter, or None.
+        userFilter: The muted users, or None.
+        statusCache: The player status cache to invalidate.
+
+    Returns:
+        None
+    """
+    plyStat = room.plystat
+
+    def notify(attempt: int, delay: float) -> None:
+        statusCache.invalidate(room.liveid)
+        print("[INFO] {0}connection lost, reconnecting in {1}s ({2})"
+              .format(room.prefix, delay, attempt),
+              file=sys.stderr)
+
+    # Connect socket to comment-server.
+    # Reconnect and resume from the last comment when it is lost.
+    msgSock = niconnect.AsyncReconnectingMsgSocket(
+        plyStat.addr,
+        plyStat.port,
+        plyStat.thread,
+        log=logLimit,
+        notify=notify)
+    try:
+        # Keep the raw frames only for the log.
+        async for batch in msgSock.recv_batches(keepraw=bool(room.logfile)):
+            if handle_batch(batch, room, conf,
+                            nameMaps, nameResolver, cmtFilter,
+                            userFilter):
+                break
+    except OSError as err:
+        print("[ERR] {0}{1}:{2} {3}".format(room.prefix,
+                                             plyStat.addr,
+                                             plyStat.port,
+                                             err.args),
+              file=sys.stderr)
+        statusCache.invalidate(room.liveid)
+        return
+
+    statusCache.invalidate(room.liveid)
+    print(room.prefix + "Program ended.")
+
+
+def handle_batch(batch: List[cparser.Comment],
+                 room: Room,
+                 conf: cview.Config,
+                 nameMaps: Dict[str, NameMap],
+                 nameResolver: nickname.NameResolver,
+                 cmtFilter: Optional[genfilter.MatchFilter],
+                 userFilter: Optional[genfilter.UserFilter]) -> bool:
+    """Log, filter and show comments recieved at once.
+
+    The backlog arrives in a few batches,
+    each batch is logged and printed with one write.
+    Usernames of the whole batch are looked up first,
+    so they are known by the live comments.
+
+    Arguments:
+        batch: The parsed records of chat data.
+        room: The room the comments were sent.
+        conf: The configuration instance.
+        nameMaps: Nickname maps keyed by anonymity.
+        nameResolver: Retrieves usernames of ID users.
+        cmtFilter: The comment filter, or None.
+        userFilter: The muted users, or None.
+
+    Returns:
+        True if "/disconnect" is sent, otherwise False.
+    """
+    if room.logfile:
+        cview.write_file("\n".join(parsed.data for parsed in batch),
+                         room.logfile)
+
+    if len(batch) > 1:
+        cview.prefetch_names(batch, nameMaps["0"], nameResolver)
+
+    lines = []
+    isDisconnected = False
+    for parsed in batch:
+        line, isDisconnected = render_comment(parsed, room, conf,
+                                              nameMaps, nameResolver,
+                                              cmtFilter, userFilter)
+        if line is not None:
+            lines.append(line)
+        if isDisconnected:
+            break
+
+    # A line for each flood ended.
+    if room.flood is not None and batch:
+        latest = max(parsed.date for parsed in batch)
+        lines.extend("{0}[INFO] flood: {1}".format(room.prefix, summary)
+                     for summary in room.flood.expire(latest))
+
+    cview.print_lines(lines)
+    return isDisconnected
+
+
+def render_comment(parsed: cparser.Comment,
+                   room: Room,
+                   conf: cview.Config,
+                   nameMaps: Dict[str, NameMap],
+                   nameResolver: nickname.NameResolver,
+                   cmtFilter: Optional[genfilter.MatchFilter],
+                   userFilter: Optional[genfilter.UserFilter]
+                   ) -> Tuple[Optional[str], bool]:
+    """Assign nickname, filter and format a comment.
+
+    Arguments:
+        parsed: The parsed record of chat data.
+        room: The room the comment was sent.
+        conf: The configuration instance.
+        nameMaps: Nickname maps keyed by anonymity.
+        nameResolver: Retrieves usernames of ID users.
+        cmtFilter: The comment filter, or None.
+        userFilter: The muted users, or None.
+
+    Returns:
+        Tuple of the line to print, None if not shown,
+        and whether "/disconnect" is sent.
+    """
+    if parsed.tag != "chat":
+        return (None, False)
+
+    # Suppress raids before assigning nicknames.
+    # Admin/broadcaster commands are never suppressed.
+    if room.flood is not None and parsed.premium <= 1:
+        if room.flood.ismatch(parsed):
+            return (None, False)
+
+    # ID users
+    if parsed.anonymity is False:
+        cview.name_handle(parsed, conf, nameMaps["0"], nameResolver)
+    # 184(anonymous) users
+    elif parsed.anonymity is True:
+        cview.name_handle(parsed, conf, nameMaps["1"])
+
+    # Break when "/disconnect" is sent by admin/broadcaster.
+    # Assign before mute.
+    isDisconnected = all([parsed.content == "/disconnect",
+                          parsed.premium > 1])
+
+    # Muted users cost a few set lookups, before any regex.
+    if conf.use_cmt_filter and userFilter and userFilter.ismatch(parsed):
+        return (None, isDisconnected)
+
+    if conf.use_cmt_filter and cmtFilter:
+        souldMute = cmtFilter.ismatch(parsed.content)
+        if souldMute:
+            return (None, isDisconnected)
+
+    if conf.narrow is False:
+        line = cview.format_comment(parsed,
+                                    room.plystat.start,
+                                    conf.nameLength,
+                                    room.prefix)
+    else:
+        line = cview.format_narrow(parsed, conf.nameLength, room.prefix)
+    return (line, isDisconnected)
 
 
 def parse_args(conf: cview.Config) -> argparse.Namespace:
@@ -212,10 +598,16 @@ def parse_args(conf: cview.Config) -> argparse.Namespace:
     # Nicolive url.
     #   lv[0-9]+ / co[0-9]+
     #   live/community page URL
+    # Multiple urls are watched at once.
     argParser.add_argument(
         "url",
         help="live/community URL",
-        metavar="lv[XXXX]/co[XXXX]")
+        metavar="lv[XXXX]/co[XXXX]",
+        nargs="*")
+    # File listing urls to watch.
+    argParser.add_argument(
+        "-r", "--rooms",
+        help="file listing live/community URLs to watch")
     # Logged in cookie.
     argParser.add_argument(
         "-c", "--cookie",
@@ -239,12 +631,20 @@ def parse_args(conf: cview.Config) -> argparse.Namespace:
         "-f", "--use-filter",
         help="use mute filter",
         action="store_true")
+    # Record hits and time of each filter rule.
+    argParser.add_argument(
+        "--profile-filter",
+        help="report hits and time of each filter rule at exit/SIGUSR1",
+        action="store_true")
     # Display in narrow mode.
     argParser.add_argument(
         "-n", "--narrow",
         help="narrow mode",
         action="store_true")
-    return argParser.parse_args()
+    parsedArgs = argParser.parse_args()
+    if not parsedArgs.url and not parsedArgs.rooms:
+        argParser.error("live/community URL or --rooms is required")
+    return parsedArgs
 
 
 if __name__ == "__main__":
@@ -4,17 +4,22 @@
 Load from the parent directory.
 """
 
-from typing import (Tuple, Dict, cast)
+from typing import (Tuple, Dict, List, Optional, Union, cast)
 import json
 import os
 import re
+import sqlite3
 import sys
+import time
 import unicodedata
 
 from nicomodule.common import (nicookie,
                                nickname,
-                               nauth)
-from .deftypes import NameProp
+                               namestore,
+                               nauth,
+                               ratelimit)
+from nicomodule.live.cparser import Comment
+from .deftypes import (NameMap, NameProp)
 
 
 class Config():
@@ -25,16 +30,65 @@ class Config():
         self.cookieFile = os.path.join(
             self.cookieDir,
             "cookie.txt")  # type: str
+        self.statusCache = os.path.join(
+            self.cookieDir,
+            "playerstatus.json")  # type: str
+        self.statusTTL = 120.0  # type: float
         self.muteReCmt = os.path.join(
             self.filterDir,
             "mute-re-comment.txt")  # type: str
+        # Muted users, see genfilter.UserFilter.
+        self.muteUser = os.path.join(
+            self.filterDir,
+            "mute-user.txt")  # type: str
         self.nickNameId = os.path.join(
             self.filterDir,
             "nickname-id.txt")  # type: str
         self.nickNameAnon = os.path.join(
             self.filterDir,
             "nickname-anon.txt")  # type: str
+        self.nickNameDb = os.path.join(
+            self.filterDir,
+            "nickname.sqlite3")  # type: str
+        # sqlite or json(nickname-id.txt/nickname-anon.txt).
+        self.nameBackend = "sqlite"  # type: str
+        # Seconds between writing new nicknames.
+        self.nameFlush = 5.0  # type: float
+        # Seconds between checking the filter/nickname changes.
+        self.reloadInterval = 1.0  # type: float
+        # Threads retrieving usernames, and uids to queue at most.
+        # The queue takes the whole backlog(1000 comments).
+        self.nameWorkers = 2  # type: int
+        self.nameQueue = 1000  # type: int
+        # Retrieved usernames and failed lookups, apart from nicknames.
+        self.nameCache = os.path.join(
+            self.filterDir,
+            "namecache.json")  # type: str
+        self.nameCacheTTL = 7 * 86400.0  # type: float
+        self.nameMissTTL = 3600.0  # type: float
+        self.nameCacheSize = 10000  # type: int
+        # Requests per second and burst by endpoint.
+        self.rateLimits = dict(
+            ratelimit.BUDGETS)  # type: Dict[str, Tuple[float, int]]
         self.use_cmt_filter = False  # type: bool
+        # Verdicts of the comment filter to cache by text.
+        self.filterCache = 4096  # type: int
+        # Filter NFKC normalized comments, like ｗｗｗ as www.
+        self.filterNormalize = False  # type: bool
+        # Record hits and time of each filter rule, slow.
+        self.filterProfile = False  # type: bool
+        # Compiled comment filter, used while the rules are not changed.
+        self.filterCompiled = os.path.join(
+            self.filterDir,
+            "mute-re-comment.cache")  # type: Optional[str]
+        # Mute the same text posted floodTexts times in floodWindow seconds,
+        # or a user posted floodUser times, until floodMute seconds after
+        # the last one. Texts and users to count are up to floodKeys each.
+        self.floodWindow = 10.0  # type: float
+        self.floodTexts = 10  # type: int
+        self.floodUser = 8  # type: int
+        self.floodMute = 60.0  # type: float
+        self.floodKeys = 10000  # type: int
         self.logLimit = 20  # type: int
         self.nameLength = 12  # type: int
         self.narrow = False  # type: bool
@@ -116,113 +170,107 @@ def mk_dir(newdir: str) -> None:
         error_exit(err, newdir)
 
 
-def name_handle(parsed: Dict[str, str],
+def name_handle(parsed: Comment,
                 conf: Config,
-                namemap: Dict[str, NameProp]) -> bool:
+                namemap: NameMap,
+                resolver: Optional[nickname.NameResolver]=None) -> bool:
     """Nickname handling.
 
     Check if nickname needs registered,
-    namemap needs reloaded.
+    and register it to namemap in place.
 
     Arguments:
-        parsed: A parsed dict of a chat data.
+        parsed: A parsed Comment of a chat data.
         conf: The configuration instance.
-        namemap: The generated nickname list from a json.
+        namemap: The nickname map of the store.
+        resolver: Retrieve unknown usernames in the background,
+                  retrieve them here if None.
 
     Returns:
-        A boolean value "whether to reload the namemap".
+        A boolean value "whether the namemap was updated".
     """
-    reload = False
-
-    if should_register(parsed["content"], parsed["id"], namemap):
-        registname = re.search(r"[@＠](.+)$", parsed["content"]).group(1)
-        try:
-            if parsed["anonymity"] == "0":
-                nickname.register_name(
-                    parsed["id"],
-                    registname,
-                    int(parsed["time"]),
-                    conf.nickNameId)
-                # Reload namemap.
-                namemap = load_json(
-                    conf.nickNameId)
-            elif parsed["anonymity"] == "1":
-                nickname.register_name(
-                    parsed["id"],
-                    registname,
-                    int(parsed["time"]),
-                    conf.nickNameAnon)
-                # Reload namemap.
-                namemap = load_json(
-                    conf.nickNameAnon)
-            reload = True
-        except json.JSONDecodeError as err:
-            error_exit(err,
-                       conf.nickNameId)
-        except IsADirectoryError as err:
-            error_exit(err,
-                       conf.nickNameId)
-        except PermissionError as err:
-            error_exit(err,
-                       conf.nickNameId)
-        except IOError as err:
-            error_exit(err,
-                       conf.nickNameId)
-    else:
-        pass
-
-    parsed["nickname"], isnew = assign_nickname(
-        parsed["id"],
-        parsed["anonymity"],
-        namemap)
-
-    if isnew is True:
-        reload = True
-        if parsed["anonymity"] == "0":
-            nickname.register_name(parsed["id"],
-                                   parsed["nickname"],
-                                   int(parsed["time"]),
-                                   conf.nickNameId)
-        elif parsed["anonymity"] == "1":
-            nickname.register_name(parsed["id"],
-                                   parsed["nickname"],
-                                   int(parsed["time"]),
-                                   conf.nickNameAnon)
-    elif isnew is False:
-        pass
-
-    return reload
-
+    updated = False
 
-def show_comment(parsed: Dict[str, str],
+    try:
+        if should_register(parsed.content, parsed.user_id, namemap):
+            registname = re.search(r"[@＠](.+)$", parsed.content).group(1)
+            namemap[parsed.user_id] = {
+                "name": registname,
+                "time": parsed.date,
+                "fixed": 0
+            }
+            updated = True
+
+        parsed.nickname, isnew = assign_nickname(
+            parsed.user_id,
+            parsed.anonymity,
+            namemap,
+            resolver)
+
+        if isnew is True:
+            namemap[parsed.user_id] = {
+                "name": parsed.nickname,
+                "time": parsed.date,
+                "fixed": 0
+            }
+            updated = True
+    except sqlite3.Error as err:
+        error_exit(err, conf.nickNameDb)
+
+    return updated
+
+
+def show_comment(parsed: Comment,
                  starttime: int,
-                 width: int) -> None:
+                 width: int,
+                 prefix: str="") -> None:
     """Print a comment data by formatting.
 
     Print a comments with some additional info.
 
     Arguments:
-        parsed: The parsed dict of a chat data.
+        parsed: The parsed Comment of a chat data.
         starttime: Tha UnixTime program starts.
         width: The width of displaying name on console.
+        prefix: Strings put before the comment, like room name.
 
     Returns:
         None
     """
+    print(format_comment(parsed, starttime, width, prefix), flush=True)
+
+
+def format_comment(parsed: Comment,
+                   starttime: int,
+                   width: int,
+                   prefix: str="") -> str:
+    """Format a comment data.
+
+    The line printed by show_comment.
+
+    Arguments:
+        parsed: The parsed Comment of a chat data.
+        starttime: Tha UnixTime program starts.
+        width: The width of displaying name on console.
+        prefix: Strings put before the comment, like room name.
+
+    Returns:
+        The colored line.
+    """
     # Premium member
-    if parsed["premium"] == "1":
+    if parsed.premium == 1:
         pmark = "P"
         color = "default"
     # Administrator
-    elif parsed["premium"] == "2":
+    elif parsed.premium == 2:
         pmark = "A"
         color = "darkpurple"
     # Owner
-    elif parsed["premium"] == "3":
+    elif parsed.premium == 3:
         pmark = "O"
         color = "sky"
     # BSP
-    elif parsed["premium"] == "7":
+    elif parsed.premium == 7:
         pmark = "B"
         color = "blue"
     else:
@@ -230,54 +278,74 @@ def show_comment(parsed: Dict[str, str],
         color = "default"
 
     # Truncate display name to configured length.
-    name, wchar = trunc_name(parsed["nickname"], width)
+    name, wchar = trunc_name(parsed.nickname, width)
     namearea = "[{2: ^" + str(width - wchar) + "}]"
     commenttime = calc_rel_time(
-        int(parsed["time"]),
+        parsed.date,
         starttime)
-    fullcmt = (("{0}:{1}" + namearea + " {3} [{4}]")
+    fullcmt = ((prefix + "{0}:{1}" + namearea + " {3} [{4}]")
                .format(parsed["no"],
                        pmark,
                        name,
-                       parsed["content"],
+                       parsed.content,
                        commenttime))
 
-    print_color(fullcmt, color)
+    return paint(fullcmt, color)
 
 
-def narrow_comment(parsed: Dict[str, str],
-                   width: int) -> None:
+def narrow_comment(parsed: Comment,
+                   width: int,
+                   prefix: str="") -> None:
     """Print a comment data by narrow formatting.
 
     Print a comments with some additional info.
     Adapted for narrow display.
 
     Arguments:
-        parsed: The parsed dict of a chat data.
+        parsed: The parsed Comment of a chat data.
         width: The width of displaying name on console.
+        prefix: Strings put before the comment, like room name.
 
     Returns:
         None
     """
+    print(format_narrow(parsed, width, prefix), flush=True)
+
+
+def format_narrow(parsed: Comment,
+                  width: int,
+                  prefix: str="") -> str:
+    """Format a comment data for narrow display.
+
+    The lines printed by narrow_comment.
+
+    Arguments:
+        parsed: The parsed Comment of a chat data.
+        width: The width of displaying name on console.
+        prefix: Strings put before the comment, like room name.
+
+    Returns:
+        The colored lines.
+    """
     # Premium member
-    if parsed["premium"] == "1":
+    if parsed.premium == 1:
         color = "default"
     # Administrator
-    elif parsed["premium"] == "2":
+    elif parsed.premium == 2:
         color = "darkpurple"
     # Owner
-    elif parsed["premium"] == "3":
+    elif parsed.premium == 3:
         color = "sky"
     # BSP
-    elif parsed["premium"] == "7":
+    elif parsed.premium == 7:
         color = "blue"
     else:
         color = "default"
 
     width = int(width * 2 / 3)
-    wchar = trunc_name(parsed["nickname"], width)[1]
+    wchar = trunc_name(parsed.nickname, width)[1]
     namearea = "[{0: ^" + str(width - wchar) + "}]"
-    nname = trunc_name(parsed["nickname"], width)[0]
+    nname = trunc_name(parsed.nickname, width)[0]
     # Which is better,
     # substrings re.sub([letter count], ...)
     # or
@@ -294,13 +362,155 @@ def narrow_comment(parsed: Dict[str, str],
     ncontent = re.sub(r"(?P<m>.{,16})",
                       r"{0}\g<m>{1}".format(" " * 11,
                                             os.linesep),
-                      parsed["content"])
+                      parsed.content)
     ncontent = re.sub(r"(?:^[\s]{11}|\n$)", "", ncontent)
-    fullcmt = ((namearea + " {1}")
+    fullcmt = ((prefix + namearea + " {1}")
                .format(nname,
                        ncontent))
 
-    print_color(fullcmt, color)
+    return paint(fullcmt, color)
+
+
+def open_name_maps(conf: Config) -> Dict[str, namestore.NameMap]:
+    """Load the nickname maps.
+
+    The maps are kept in memory and flushed on a timer,
+    to the sqlite store, or the json files if configured.
+    Changes by others, editing the json files or importing to the store,
+    are merged on the timer.
+    Until imported once, the json files are imported to the store,
+    after that only the entries edited in them are.
+
+    Arguments:
+        conf: The configuration instance.
+
+    Returns:
+        Dict of the started NameMap keyed by anonymity("0"/"1").
+    """
+    jsonpaths = {"0": conf.nickNameId, "1": conf.nickNameAnon}
+    if conf.nameBackend != "json":
+        try:
+            store = namestore.NicknameStore(conf.nickNameDb)
+            migrated = store.migrated
+        except sqlite3.Error as err:
+            error_exit(err, conf.nickNameDb)
+
+    namemaps = {}
+    for anonymity, kind in (("0", "id"), ("1", "anon")):
+        jsonpath = jsonpaths[anonymity]
+        try:
+            if conf.nameBackend == "json":
+                backend = namestore.JSONNameFile(jsonpath)
+            else:
+                if not migrated and os.path.exists(jsonpath):
+                    store.import_json(kind, jsonpath)
+                backend = store.view(kind, jsonpath)
+            namemaps[anonymity] = namestore.NameMap(backend)
+        except json.JSONDecodeError as err:
+            error_exit(err, jsonpath)
+        except sqlite3.Error as err:
+            error_exit(err, conf.nickNameDb)
+        except IOError as err:
+            error_exit(err, jsonpath)
+
+    if conf.nameBackend != "json" and not migrated:
+        store.mark_migrated()
+    for namemap in namemaps.values():
+        namemap.start(conf.nameFlush, conf.reloadInterval)
+    return namemaps
+
+
+def start_name_resolver(namemap: NameMap,
+                        conf: Config) -> nickname.NameResolver:
+    """Start retrieving usernames in the background.
+
+    Retrieved names are registered to namemap
+    unless the user has registered one meanwhile.
+    Lookups are cached to conf.nameCache, unknown users as well.
+
+    Arguments:
+        namemap: The nickname map of ID users.
+        conf: The configuration instance.
+
+    Returns:
+        NameResolver to pass to name_handle, close it before the map.
+    """
+    def register(uid: str, name: str) -> None:
+        if uid not in namemap:
+            namemap[uid] = {
+                "name": name,
+                "time": int(time.time()),
+                "fixed": 0
+            }
+
+    cache = nickname.NameCache(conf.nameCache,
+                               ttl=conf.nameCacheTTL,
+                               negttl=conf.nameMissTTL,
+                               maxsize=conf.nameCacheSize)
+    # Saved with the nicknames.
+    cache.start(conf.nameFlush)
+    return nickname.NameResolver(register,
+                                 workers=conf.nameWorkers,
+                                 maxpending=conf.nameQueue,
+                                 cache=cache)
+
+
+def prefetch_names(comments: List[Comment],
+                   namemap: NameMap,
+                   resolver: nickname.NameResolver) -> int:
+    """Queue the lookups of the unknown ID users at once.
+
+    Used for the comments recieved together like the backlog,
+    the latest commenters are queued first,
+    as they are likely to comment again.
+
+    Arguments:
+        comments: Parsed Comments, oldest first.
+        namemap: The nickname map of ID users.
+        resolver: The resolver to queue the lookups.
+
+    Returns:
+        Number of the uids queued.
+    """
+    uids = []
+    for parsed in reversed(comments):
+        if (parsed.tag == "chat" and parsed.anonymity is False
+                and parsed.user_id not in namemap):
+            uids.append(parsed.user_id)
+
+    return sum(resolver.request(uid) for uid in dict.fromkeys(uids))
+
+
+def close_name_maps(namemaps: Dict[str, namestore.NameMap],
+                    conf: Config) -> None:
+    """Flush and close the nickname maps.
+
+    The store shared by the maps is closed after all of them flushed.
+
+    Arguments:
+        namemaps: Maps made by open_name_maps.
+        conf: The configuration instance.
+
+    Returns:
+        None
+    """
+    stores = []  # type: List[namestore.NicknameStore]
+    for namemap in namemaps.values():
+        backend = namemap.backend
+        if (isinstance(backend, namestore.NameView)
+                and backend.store not in stores):
+            stores.append(backend.store)
+    try:
+        for namemap in namemaps.values():
+            try:
+                namemap.close()
+            except sqlite3.Error as err:
+                error_exit(err, conf.nickNameDb)
+            except IOError as err:
+                error_exit(err, conf.nickNameDb)
+    finally:
+        for store in stores:
+            store.close()
 
 
 def load_json(filepath: str) -> Dict[str, NameProp]:
@@ -329,7 +539,7 @@ def load_json(filepath: str) -> Dict[str, NameProp]:
     return namemap
 
 
-def should_register(text: str, uid: str, namemap: Dict[str, NameProp]) -> bool:
+def should_register(text: str, uid: str, namemap: NameMap) -> bool:
     """Check if the name should be registered.
 
     If text contains "@|＠", treat after it as a new nickname.
@@ -364,18 +574,23 @@ def should_register(text: str, uid: str, namemap: Dict[str, NameProp]) -> bool:
 
 
 def assign_nickname(uid: str,
-                    isanon: str,
-                    namemap: Dict[str, NameProp]) -> Tuple[str, bool]:
+                    isanon: Union[bool, str],
+                    namemap: NameMap,
+                    resolver: Optional[nickname.NameResolver]=None
+                    ) -> Tuple[str, bool]:
     """Assign the nickanme to userID.
 
     Assign the nickname to the userID if already registered.
     If not registered and it is not an anonymous comment,
     try to retrieve its user's niconico username.
+    With the resolver, the userID is shown until it is retrieved.
 
     Arguments:
         uid: A userID to assign the nickname.
-        isanon: Whether the user is anonymous.
+        isanon: Whether the user is anonymous,
+                the former "0"/"1" strings are accepted too.
         namemap: A nickname dict using for assigning the name.
+        resolver: Queue the retrieval to it instead of waiting.
 
     Returns:
         A tuple of the nickname and a boolean value
@@ -389,12 +604,15 @@ def assign_nickname(uid: str,
         pass
 
     # Retrieve username if not anon comment.
-    if isanon == "0":
+    if isanon is False or isanon == "0":
+        if resolver is not None:
+            resolver.request(uid)
+            return (uid, False)
         try:
             return (nickname.retrieve_name(uid), True)
         except IOError:
             return (uid, False)
-    elif isanon == "1":
+    elif isanon is True or isanon == "1":
         return (uid, False)
 
     return (uid, False)
@@ -479,6 +697,20 @@ def print_color(text: str, color: str) -> None:
     Returns:
         None
     """
+    print(paint(text, color), flush=True)
+
+
+def paint(text: str, color: str) -> str:
+    """Color strings with escape sequence.
+
+    Arguments:
+        text: A text to color.
+        color: The color of the text.
+
+    Returns:
+        The text surrounded by escape sequence,
+        as it is if the color is unknown.
+    """
     color = color.lower()
     colordict = {
         "red": "31",
@@ -492,12 +724,28 @@ def print_color(text: str, color: str) -> None:
         "sky": "96"
     }
     if color not in colordict.keys():
-        print(text, flush=True)
-        return
+        return text
 
-    print("\033[{0}m{1}\033[0m".format(
+    return "\033[{0}m{1}\033[0m".format(
         colordict[color],
-        text), flush=True)
+        text)
+
+
+def print_lines(lines: List[str]) -> None:
+    """Print lines at once.
+
+    Write the whole lines with one write and flush,
+    instead of printing each line.
+
+    Arguments:
+        lines: Lines to print.
+
+    Returns:
+        None
+    """
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
 
 
 def calc_rel_time(acttime: int, basetime: int) -> str:
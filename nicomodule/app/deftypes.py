@@ -3,7 +3,8 @@
 """Types for type hints."""
 
 
-from typing import (Dict, Union)
+from typing import (Dict, MutableMapping, Union)
 
 
 NameProp = Dict[str, Union[str, int]]
+NameMap = MutableMapping[str, NameProp]
@@ -3,5 +3,10 @@ from . import nicoid
 from . import genfilter
 from . import nickname
 from . import nauth
+from . import nhttp
+from . import namestore
+from . import ratelimit
+from . import atomicfile
 
-__all__ = ["nicookie", "nicoid", "genfilter", "nickname", "nauth"]
+__all__ = ["nicookie", "nicoid", "genfilter", "nickname", "nauth",
+           "nhttp", "namestore", "ratelimit", "atomicfile"]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Replace a file atomically."""
+
+from typing import (IO, Iterator)
+import contextlib
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def replace(path: str) -> Iterator[IO[str]]:
+    """Write a temporary file and replace path with it.
+
+    Readers see the old or the new content, never a part of it.
+    The content is on the disk before replacing,
+    so a crash doesn't leave an empty file.
+    The mode of the file is kept, new files follow the umask.
+    Nothing is replaced if the block raises.
+
+        with atomicfile.replace(path) as fopen:
+            json.dump(data, fopen)
+
+    Arguments:
+        path: Path to the file to replace.
+
+    Returns:
+        Text file object to write.
+
+    Raises:
+        OSError: Failed to write.
+    """
+    dirpath = os.path.dirname(path) or "."
+    fd, tmppath = tempfile.mkstemp(dir=dirpath, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as tmpopen:
+            yield tmpopen
+            tmpopen.flush()
+            os.fsync(tmpopen.fileno())
+        os.chmod(tmppath, _file_mode(path))
+        os.replace(tmppath, path)
+    except BaseException:
+        try:
+            os.remove(tmppath)
+        except OSError:
+            pass
+        raise
+    _sync_dir(dirpath)
+
+
+def _file_mode(path: str) -> int:
+    """The mode of the file, or the default of new files.
+    """
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except OSError:
+        pass
+    # The umask can only be read by setting it.
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _sync_dir(dirpath: str) -> None:
+    """Persist the rename, not supported on some platforms.
+    """
+    try:
+        fd = os.open(dirpath, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
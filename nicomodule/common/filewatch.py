@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Detect changes of a file by its stat."""
+
+from typing import (Optional, Tuple)
+import os
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    """The mtime, size and inode of a file.
+
+    Arguments:
+        path: Path to the file.
+
+    Returns:
+        Tuple of them, None if the file doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class FileStamp():
+    """The last seen stamp of a file.
+
+    Checking costs one stat, cheap enough to poll every second.
+    Files replaced by editors are detected by the inode.
+
+    Attributes:
+        path: Path to the file.
+        __stamp: The stamp when last seen.
+    """
+    def __init__(self, path: str) -> None:
+        """Constructor, the current file is seen.
+
+        Arguments:
+            path: Path to the file.
+
+        Returns:
+            None
+        """
+        self.path = path  # type: str
+        self.__stamp = file_stamp(path)
+
+    def changed(self) -> bool:
+        """Check if the file was changed since last seen.
+
+        The changed file is seen by this check.
+        A missing file is not a change, like while an editor saves it.
+
+        Arguments:
+            None
+
+        Returns:
+            True if changed.
+        """
+        stamp = file_stamp(self.path)
+        if stamp is None or stamp == self.__stamp:
+            return False
+        self.__stamp = stamp
+        return True
+
+    def update(self) -> None:
+        """See the current file, like after writing it.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        self.__stamp = file_stamp(self.path)
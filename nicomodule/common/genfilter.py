@@ -2,10 +2,33 @@
 # -*- coding: utf-8 -*-
 """Generate regex filtering dict."""
 
-from typing import (Pattern, Iterable, Set)
+from typing import (Any, Dict, Iterable, List, Optional, Pattern, Set,
+                    Tuple, Union)
+import collections
+import hashlib
+import io
+import json
 import os
 import re
 import sre_constants
+import sys
+import time
+import unicodedata
+
+from . import atomicfile
+from .filewatch import FileStamp
+
+
+# Characters making a pattern not literal.
+_SPECIAL = frozenset(".^$*+?{}[]\\|()")
+_QUANTIFIER = frozenset("*+?{")
+# Length of the prefix index keys.
+_PREFIXKEY = 4
+# Changed when the compiled cache format changes.
+_CACHEFORMAT = 1
+# Ignored by the flood detection, spaces, symbols and repeats.
+_NONWORD = re.compile(r"[\W_]+")
+_REPEAT = re.compile(r"(.)\1+")
 
 
 class MatchFilter():
@@ -13,32 +36,66 @@ class MatchFilter():
 
     Compiles filter words regex,
     use it to filtering check.
+    The regexes are checked at once by RuleMatcher,
+    the verdicts are cached by the text for repeated comments.
+    When the file is changed, compile in the background
+    and swap_rules between comments, or reload.
 
     Attributes:
-        __regexset Compiled mute regex set.
+        filepath: Regex words list text file.
+        cachefile: Compiled rules cache, or None.
+        cache: VerdictCache, cleared when the rules change.
+        normalize: Whether the text is NFKC normalized before checking.
+        profile: RuleProfile if profiling, otherwise None.
+        __stamp: FileStamp of filepath.
+        __regexset Compiled mute regex set, compiled when used.
+        __matcher RuleMatcher of the rules.
     """
 
-    def __init__(self, filepath: str) -> None:
+    def __init__(self,
+                 filepath: str,
+                 cachesize: int=4096,
+                 normalize: bool=False,
+                 profile: bool=False,
+                 cachefile: Optional[str]=None) -> None:
         """Constructor.
 
         Set Compiled regex words to own property.
 
         Arguments:
             filepath: Regex words list text file.
+            cachesize: Number of the verdicts to cache, 0 to disable.
+            normalize: Check NFKC normalized text,
+                       like ｗｗｗ as www.
+            profile: Record hits and time of each rule.
+                     Every rule is searched one by one on every text,
+                     the cache is not used. Slow, for tuning the rules.
+            cachefile: Load the compiled rules from it
+                       if the file is not changed, otherwise save them.
 
         Returns:
             None
         """
-        words = gen_word_set(filepath)
-        self.__regexset = gen_reg_set(words)  # type: Set[Pattern]
+        self.filepath = filepath  # type: str
+        self.cachefile = cachefile  # type: Optional[str]
+        self.cache = VerdictCache(cachesize)  # type: VerdictCache
+        self.normalize = normalize  # type: bool
+        self.profile = None  # type: Optional[RuleProfile]
+        if profile:
+            self.profile = RuleProfile()
+        # Seen before reading, not to miss the changes while reading.
+        self.__stamp = FileStamp(filepath)
+        self.swap_rules(self.compile())
 
     @property
     def word_set(self) -> Set[str]:
-        words = {regex.pattern for regex in self.__regexset}
+        words = set(self.__matcher.rules)
         return words
 
     @property
     def re_set(self) -> Set[Pattern]:
+        if self.__regexset is None:
+            self.__regexset = {re.compile(_) for _ in self.__matcher.rules}
         return self.__regexset
 
     def ismatch(self, text: str) -> bool:
@@ -52,7 +109,936 @@ class MatchFilter():
         Returns:
             If matches in even one, True. If not, False.
         """
-        return any(_.search(text) for _ in self.__regexset)
+        return self.match_rule(text) is not None
+
+    def match_rule(self, text: str) -> Optional[str]:
+        """Find the rule text matches.
+
+        Arguments:
+            text: strings to check with regex set.
+
+        Returns:
+            The pattern of a matched rule, None if not matched.
+        """
+        if self.normalize:
+            text = unicodedata.normalize("NFKC", text)
+        if self.profile is not None:
+            self.profile.measure(self.re_set, text)
+            return self.__matcher.search(text)
+        rule = self.cache.get(text)
+        if rule is _UNCACHED:
+            rule = self.__matcher.search(text)
+            self.cache.put(text, rule)
+        return rule
+
+    def changed(self) -> bool:
+        """Check if the file was changed since last checked.
+
+        Arguments:
+            None
+
+        Returns:
+            True if changed.
+        """
+        return self.__stamp.changed()
+
+    def compile(self) -> "RuleMatcher":
+        """Read and compile the file, for swap_rules.
+
+        Takes time for many rules, call it out of the comment loop.
+
+        Arguments:
+            None
+
+        Returns:
+            RuleMatcher of the rules.
+        """
+        return compile_rules(self.filepath, self.cachefile)
+
+    def reload(self) -> int:
+        """Read the file and replace the rules.
+
+        Arguments:
+            None
+
+        Returns:
+            Number of the rules.
+        """
+        matcher = self.compile()
+        self.swap_rules(matcher)
+        return len(matcher)
+
+    def swap_rules(self, matcher: "RuleMatcher") -> None:
+        """Replace the rules, drop the cached verdicts.
+
+        Arguments:
+            matcher: Rules made by compile.
+
+        Returns:
+            None
+        """
+        self.__matcher = matcher
+        self.__regexset = None  # type: Optional[Set[Pattern]]
+        self.cache.clear()
+        if self.profile is not None:
+            self.profile.retain(self.re_set)
+
+
+class UserFilter():
+    """Mute comments by the user, not by the text.
+
+    Rules are kept in sets, a comment costs a few lookups
+    however many users are muted. Check it before MatchFilter.
+    The file has a rule per line, comment/blank lines are ignored:
+        a user ID
+        premium:<class>     0: free, 1: premium, 3: owner etc.
+        anonymity:<0|1>     1: 184(anonymous) comments
+        locale:<locale>     like en-us
+        score:<score>       NG score of the value or lower
+
+    Attributes:
+        filepath: User rules text file.
+        rejected: Lines not understood.
+        __stamp: FileStamp of filepath.
+        __ids: Muted user IDs.
+        __premiums: Muted premium classes.
+        __anonymities: Muted anonymities.
+        __locales: Muted locales.
+        __score: Muted score threshold, or None.
+    """
+    def __init__(self, filepath: str) -> None:
+        """Constructor.
+
+        Arguments:
+            filepath: User rules text file, no rules if missing.
+
+        Returns:
+            None
+        """
+        self.filepath = filepath  # type: str
+        self.__stamp = FileStamp(filepath)
+        self.reload()
+
+    def __len__(self) -> int:
+        return sum((len(self.__ids),
+                    len(self.__premiums),
+                    len(self.__anonymities),
+                    len(self.__locales),
+                    self.__score is not None))
+
+    def ismatch(self, comment: Any) -> bool:
+        """Check if the comment is posted by a muted user.
+
+        Arguments:
+            comment: Comment record, with user_id, premium,
+                     anonymity, locale and score.
+
+        Returns:
+            Boolean, True if matched.
+        """
+        return (comment.user_id in self.__ids
+                or comment.premium in self.__premiums
+                or comment.anonymity in self.__anonymities
+                or comment.locale in self.__locales
+                or (self.__score is not None
+                    and comment.score <= self.__score))
+
+    def changed(self) -> bool:
+        """Check if the file was changed since last checked.
+
+        Arguments:
+            None
+
+        Returns:
+            True if changed.
+        """
+        return self.__stamp.changed()
+
+    def reload(self) -> int:
+        """Read the file and replace the rules.
+
+        Cheap enough to call between comments.
+
+        Arguments:
+            None
+
+        Returns:
+            Number of the rules.
+        """
+        try:
+            with open(self.filepath, "r") as fopen:
+                lines = read_words(fopen)
+        except IOError:
+            lines = set()
+
+        ids = set()  # type: Set[str]
+        premiums = set()  # type: Set[int]
+        anonymities = set()  # type: Set[bool]
+        locales = set()  # type: Set[str]
+        scores = []  # type: List[int]
+        rejected = []  # type: List[str]
+        for line in sorted(lines):
+            key, sep, value = line.partition(":")
+            if not sep:
+                ids.add(sys.intern(line))
+                continue
+            value = value.strip()
+            try:
+                if key == "premium":
+                    premiums.add(int(value))
+                elif key == "anonymity" and value in ("0", "1"):
+                    anonymities.add(value == "1")
+                elif key == "locale" and value:
+                    locales.add(value)
+                elif key == "score":
+                    scores.append(int(value))
+                else:
+                    rejected.append(line)
+            except ValueError:
+                rejected.append(line)
+
+        self.rejected = rejected  # type: List[str]
+        self.__ids = ids
+        self.__premiums = premiums
+        self.__anonymities = anonymities
+        self.__locales = locales
+        # The highest threshold mutes the others too.
+        self.__score = max(scores) if scores else None  # type: Optional[int]
+        return len(self)
+
+
+class FloodFilter():
+    """Suppress floods of the same text or from a user.
+
+    Comments are counted over a sliding window by their dates,
+    the nearly same texts from anyone and the comments of each user.
+    Crossing a limit mutes the text or the user
+    until mutetime seconds after its last comment,
+    then expire tells how many comments were suppressed.
+    Memory is bounded, maxkeys texts and users are kept
+    with the dates of their last comments up to the limit,
+    and maxkeys mutes with a short label of the text or the user.
+
+    Attributes:
+        window: Seconds to count the comments in.
+        textlimit: Comments of a text to mute it.
+        userlimit: Comments of a user to mute the user.
+        mutetime: Seconds to mute after the last comment.
+        maxkeys: Texts and users to count at most, each.
+        minlength: Shorter texts like "ｗｗｗ" are not counted.
+        suppressed: Number of the comments suppressed.
+        __texts: Dates of the last comments by the text hash.
+        __users: Dates of the last comments by the user.
+        __muted: [until, count, label] by (kind, key),
+                 the least recently suppressed first.
+        __ended: Summaries of the mutes dropped before expired.
+    """
+    def __init__(self,
+                 window: float=10.0,
+                 textlimit: int=10,
+                 userlimit: int=8,
+                 mutetime: float=60.0,
+                 maxkeys: int=10000,
+                 minlength: int=8) -> None:
+        """Constructor.
+
+        Arguments:
+            window: Seconds to count the comments in.
+            textlimit: Comments of a text to mute it, 0 not to.
+            userlimit: Comments of a user to mute the user, 0 not to.
+            mutetime: Seconds to mute after the last comment.
+            maxkeys: Texts and users to count at most, each.
+            minlength: Normalized length of the texts to count.
+
+        Returns:
+            None
+        """
+        self.window = window  # type: float
+        self.textlimit = textlimit  # type: int
+        self.userlimit = userlimit  # type: int
+        self.mutetime = mutetime  # type: float
+        self.maxkeys = maxkeys  # type: int
+        self.minlength = minlength  # type: int
+        self.suppressed = 0  # type: int
+        self.__texts = collections.OrderedDict()  # type: Dict
+        self.__users = collections.OrderedDict()  # type: Dict
+        self.__muted = collections.OrderedDict(
+        )  # type: Dict[Tuple[str, Any], List[Any]]
+        self.__ended = []  # type: List[str]
+
+    def ismatch(self, comment: Any) -> bool:
+        """Count the comment, check if it is suppressed.
+
+        Arguments:
+            comment: Comment record, with date, user_id and content.
+
+        Returns:
+            Boolean, True if flooding or muted.
+        """
+        text = normalize_flood(comment.content)
+        keys = [("user", comment.user_id)]
+        if len(text) >= self.minlength:
+            keys.insert(0, ("text", hash(text)))
+
+        for key in keys:
+            muted = self.__muted.get(key)
+            if muted is not None and comment.date <= muted[0]:
+                # Keep muted while it goes on.
+                muted[0] = comment.date + self.mutetime
+                muted[1] += 1
+                self.__muted.move_to_end(key)
+                self.suppressed += 1
+                return True
+
+        for kind, key in keys:
+            if kind == "text":
+                flooded = self.__count(self.__texts, key,
+                                       comment.date, self.textlimit)
+                label = comment.content
+            else:
+                flooded = self.__count(self.__users, key,
+                                       comment.date, self.userlimit)
+                label = key
+            if flooded:
+                self.__mute((kind, key), comment.date, label)
+                self.suppressed += 1
+                return True
+        return False
+
+    def expire(self, date: float) -> List[str]:
+        """Unmute the floods ended by the date.
+
+        Arguments:
+            date: UnixTime of the latest comment.
+
+        Returns:
+            Summary lines of the unmuted, like
+            '12 suppressed (user: 1234)'.
+        """
+        lines = self.__ended
+        self.__ended = []
+        for key, muted in list(self.__muted.items()):
+            if muted[0] < date:
+                del self.__muted[key]
+                lines.append(self.__summary(key, muted))
+        return lines
+
+    def __mute(self, key: Tuple[str, Any], date: float, label: str) -> None:
+        """Start muting, drop the least recent mute over maxkeys.
+        """
+        ended = self.__muted.pop(key, None)
+        if ended is not None:
+            self.__ended.append(self.__summary(key, ended))
+        if len(label) > 20:
+            label = label[:20] + "..."
+        self.__muted[key] = [date + self.mutetime, 1, label]
+        if len(self.__muted) > self.maxkeys:
+            self.__ended.append(self.__summary(
+                *self.__muted.popitem(last=False)))
+
+    def __summary(self, key: Tuple[str, Any], muted: List[Any]) -> str:
+        return "{0} suppressed ({1}: {2})".format(muted[1], key[0], muted[2])
+
+    def __count(self,
+                table: Dict[Any, collections.deque],
+                key: Any,
+                date: float,
+                limit: int) -> bool:
+        """Add the date, check if limit comments are in the window.
+        """
+        if limit <= 0:
+            return False
+        dates = table.get(key)
+        if dates is None:
+            dates = collections.deque(maxlen=limit)
+            table[key] = dates
+            if len(table) > self.maxkeys:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        dates.append(date)
+        return len(dates) == limit and date - dates[0] < self.window
+
+
+class RuleStats():
+    """Counters of a rule.
+
+    Attributes:
+        checks: Number of the texts searched.
+        hits: Number of the texts matched.
+        elapsed: Total seconds searching.
+    """
+    __slots__ = ("checks", "hits", "elapsed")
+
+    def __init__(self) -> None:
+        self.checks = 0  # type: int
+        self.hits = 0  # type: int
+        self.elapsed = 0.0  # type: float
+
+
+class RuleProfile():
+    """Hits and search time of each rule.
+
+    Attributes:
+        texts: Number of the checked texts.
+        stats: RuleStats by pattern.
+    """
+    def __init__(self) -> None:
+        self.texts = 0  # type: int
+        self.stats = {}  # type: Dict[str, RuleStats]
+
+    def measure(self, regexes: Iterable[Pattern], text: str) -> None:
+        """Search text by every rule and record it.
+
+        Arguments:
+            regexes: Compiled rules.
+            text: The checked text.
+
+        Returns:
+            None
+        """
+        self.texts += 1
+        clock = time.perf_counter
+        for regex in regexes:
+            stats = self.stats.get(regex.pattern)
+            if stats is None:
+                stats = self.stats[regex.pattern] = RuleStats()
+            start = clock()
+            found = regex.search(text)
+            stats.elapsed += clock() - start
+            stats.checks += 1
+            if found is not None:
+                stats.hits += 1
+
+    def retain(self, regexes: Iterable[Pattern]) -> None:
+        """Drop the counters of the rules removed by reloading.
+
+        Arguments:
+            regexes: The current rules.
+
+        Returns:
+            None
+        """
+        patterns = {regex.pattern for regex in regexes}
+        self.stats = {pattern: stats for pattern, stats
+                      in self.stats.items() if pattern in patterns}
+
+    def report(self, limit: int=20) -> str:
+        """Rank the rules by time and by hits, list the unmatched ones.
+
+        Arguments:
+            limit: Number of the rules to rank.
+
+        Returns:
+            The report text.
+        """
+        items = list(self.stats.items())
+        total = sum(stats.elapsed for _, stats in items)
+        lines = ["{0} texts, {1} rules, {2:.1f}ms searching."
+                 .format(self.texts, len(items), total * 1e3)]
+
+        def rank(title: str, key) -> None:
+            lines.append(title)
+            lines.append("{0:>10} {1:>8} {2:>8}  rule"
+                         .format("total ms", "avg us", "hits"))
+            for pattern, stats in sorted(items, key=key)[:limit]:
+                lines.append("{0:>10.2f} {1:>8.2f} {2:>8}  {3}".format(
+                    stats.elapsed * 1e3,
+                    stats.elapsed / max(stats.checks, 1) * 1e6,
+                    stats.hits,
+                    pattern))
+
+        rank("By time:", lambda _: (-_[1].elapsed, _[0]))
+        rank("By hits:", lambda _: (-_[1].hits, _[0]))
+        unmatched = sorted(pattern for pattern, stats in items
+                           if stats.hits == 0)
+        lines.append("Never matched: {0} rules".format(len(unmatched)))
+        lines.extend("  " + pattern for pattern in unmatched)
+        return "\n".join(lines)
+
+
+def compile_rules(filepath: str,
+                  cachefile: Optional[str]=None) -> "RuleMatcher":
+    """Read and compile the rules of a file.
+
+    With cachefile, the compiled rules are saved by the hash
+    of the file content, and loaded while it is not changed.
+
+    Arguments:
+        filepath: Regex words list text file.
+        cachefile: Path to the compiled rules cache.
+
+    Returns:
+        RuleMatcher of the rules.
+    """
+    try:
+        with open(filepath, "r") as fopen:
+            text = fopen.read()
+    except IOError:
+        text = ""
+    digest = hashlib.sha256(
+        text.encode("utf-8", "surrogateescape")).hexdigest()
+
+    if cachefile is not None:
+        state = _load_compiled(cachefile, digest)
+        # Broken caches are compiled again and replaced.
+        try:
+            if state is not None:
+                return RuleMatcher.from_state(state)
+        except (AttributeError, KeyError, TypeError, ValueError, re.error):
+            pass
+
+    matcher = RuleMatcher(read_words(io.StringIO(text)))
+    if cachefile is not None:
+        _save_compiled(cachefile, digest, matcher.state())
+    return matcher
+
+
+def _cache_key(digest: str) -> Dict[str, Any]:
+    """Identify the rules and the regex syntax.
+    """
+    return {
+        "format": _CACHEFORMAT,
+        "python": "{0}.{1}".format(*sys.version_info[:2]),
+        "digest": digest
+    }
+
+
+def _load_compiled(cachefile: str, digest: str) -> Optional[Dict[str, Any]]:
+    """The cached state of RuleMatcher, None if not usable.
+    """
+    try:
+        with open(cachefile, "r") as cacheopen:
+            cached = json.load(cacheopen)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("key") != _cache_key(
+            digest):
+        return None
+    return cached.get("matcher")
+
+
+def _save_compiled(cachefile: str,
+                   digest: str,
+                   state: Dict[str, Any]) -> None:
+    """Replace the cache atomically.
+    """
+    # Caching is optional, ignore the failure.
+    try:
+        with atomicfile.replace(cachefile) as cacheopen:
+            json.dump({"key": _cache_key(digest), "matcher": state},
+                      cacheopen, ensure_ascii=False)
+    except IOError:
+        pass
+
+
+# Returned by VerdictCache.get if not cached.
+_UNCACHED = object()
+
+
+class VerdictCache():
+    """LRU cache of the matched rules by text.
+
+    Floods and copy-pasted comments are checked by a dict lookup.
+
+    Attributes:
+        maxsize: Number of the verdicts to keep, 0 to disable.
+        hits: Number of the texts found.
+        misses: Number of the texts not found.
+        __verdicts: The matched rule or None by text, oldest first.
+    """
+    def __init__(self, maxsize: int=4096) -> None:
+        """Constructor.
+
+        Arguments:
+            maxsize: Number of the verdicts to keep, 0 to disable.
+
+        Returns:
+            None
+        """
+        self.maxsize = maxsize  # type: int
+        self.hits = 0  # type: int
+        self.misses = 0  # type: int
+        self.__verdicts = collections.OrderedDict()  # type: Dict
+
+    def __len__(self) -> int:
+        return len(self.__verdicts)
+
+    def __str__(self) -> str:
+        return ("{0} verdicts, {1} hits, {2} misses, hit rate {3:.1%}"
+                .format(len(self), self.hits, self.misses, self.hitrate))
+
+    @property
+    def hitrate(self) -> float:
+        """Ratio of the hits in the lookups.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, text: str) -> object:
+        """Get the cached verdict.
+
+        Arguments:
+            text: The checked text.
+
+        Returns:
+            The matched rule or None, _UNCACHED if not cached.
+        """
+        rule = self.__verdicts.get(text, _UNCACHED)
+        if rule is _UNCACHED:
+            self.misses += 1
+            return rule
+        self.hits += 1
+        self.__verdicts.move_to_end(text)
+        return rule
+
+    def put(self, text: str, rule: Optional[str]) -> None:
+        """Cache a verdict.
+
+        Arguments:
+            text: The checked text.
+            rule: The matched rule, None if not matched.
+
+        Returns:
+            None
+        """
+        if self.maxsize <= 0:
+            return
+        self.__verdicts[text] = rule
+        if len(self.__verdicts) > self.maxsize:
+            self.__verdicts.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop the verdicts, like the rules changed.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        self.__verdicts.clear()
+
+
+class RuleMatcher():
+    """Check many regexes in a single pass.
+
+    Rules are divided by their form:
+        literal words
+            -> one trie regex
+        ^ anchored with a literal prefix
+            -> index by the prefix, only the candidates are matched
+        others
+            -> one alternation, the rule is found after it matched
+        backreferences, flags etc. not combinable
+            -> searched one by one
+    so the cost per text doesn't grow with the literal/prefix rules.
+    Named groups per rule are not used, they make sre much slower.
+    The division is saved by state() and restored by from_state(),
+    then the rules are compiled only when they are candidates.
+
+    Attributes:
+        rejected: Rules not compiled as regex.
+        __literals: Trie regex of the literal rules, or None.
+        __wordrule: The rule of each literal word.
+        __prefixes: Rules by the key length and the prefix key.
+        __combined: Alternation of the other rules, or None.
+        __others: The rules of __combined in order.
+        __standalone: Rules not combinable.
+        __compiled: The rules compiled when used.
+    """
+    def __init__(self, rules: Iterable[Union[str, Pattern]]=()) -> None:
+        """Constructor.
+
+        Literal rules are not compiled, the others are.
+
+        Arguments:
+            rules: Rules, patterns or compiled.
+
+        Returns:
+            None
+        """
+        self.rejected = []  # type: List[str]
+        self.__wordrule = {}  # type: Dict[str, str]
+        self.__prefixes = {}  # type: Dict[int, Dict[str, List[str]]]
+        self.__others = []  # type: List[str]
+        self.__standalone = []  # type: List[str]
+        self.__compiled = {}  # type: Dict[str, Pattern]
+
+        compiled = {getattr(_, "pattern", _): _ for _ in rules}
+        # Sorted to be the same on every run.
+        for pattern in sorted(compiled):
+            word = literal_word(pattern)
+            if word is not None and isinstance(compiled[pattern], str):
+                self.__wordrule.setdefault(word, pattern)
+                continue
+            try:
+                regex = self.__regex(compiled[pattern])
+            except sre_constants.error:
+                self.rejected.append(pattern)
+                continue
+            if regex.flags & ~re.UNICODE:
+                self.__standalone.append(pattern)
+            elif word is not None:
+                self.__wordrule.setdefault(word, pattern)
+            elif literal_prefix(pattern):
+                key = literal_prefix(pattern)[:_PREFIXKEY]
+                (self.__prefixes.setdefault(len(key), {})
+                 .setdefault(key, []).append(pattern))
+            # Backreferences change their numbers when combined,
+            # group names may conflict.
+            elif _UNCOMBINABLE.search(pattern):
+                self.__standalone.append(pattern)
+            else:
+                self.__others.append(pattern)
+
+        trie = trie_regex(self.__wordrule) if self.__wordrule else None
+        combined = None
+        if self.__others:
+            combined = "|".join("(?:{0})".format(_) for _ in self.__others)
+        self.__build(trie, combined)
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "RuleMatcher":
+        """Restore the matcher saved by state().
+
+        Arguments:
+            state: Dict made by state().
+
+        Returns:
+            RuleMatcher instance.
+        """
+        matcher = cls()
+        matcher.rejected = list(state["rejected"])
+        matcher.__wordrule = dict(state["words"])
+        matcher.__prefixes = {int(length): index for length, index
+                              in state["prefixes"].items()}
+        matcher.__others = list(state["others"])
+        matcher.__standalone = list(state["standalone"])
+        matcher.__build(state["trie"], state["combined"])
+        return matcher
+
+    def state(self) -> Dict[str, Any]:
+        """The division of the rules, for from_state.
+
+        Arguments:
+            None
+
+        Returns:
+            Dict to save as json.
+        """
+        return {
+            "rejected": self.rejected,
+            "words": self.__wordrule,
+            "trie": getattr(self.__literals, "pattern", None),
+            "prefixes": {str(length): index for length, index
+                         in self.__prefixes.items()},
+            "others": self.__others,
+            "combined": getattr(self.__combined, "pattern", None),
+            "standalone": self.__standalone
+        }
+
+    def __build(self, trie: Optional[str], combined: Optional[str]) -> None:
+        """Compile the joined patterns.
+        """
+        self.__literals = None  # type: Optional[Pattern]
+        if trie is not None:
+            self.__literals = re.compile(trie)
+        self.__combined = None  # type: Optional[Pattern]
+        if combined is not None:
+            self.__combined = re.compile(combined)
+        # Longer keys first.
+        self.__prefixlist = sorted(self.__prefixes.items(), reverse=True)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    @property
+    def rules(self) -> List[str]:
+        """Patterns of the valid rules.
+        """
+        rules = list(self.__wordrule.values())
+        for index in self.__prefixes.values():
+            for patterns in index.values():
+                rules.extend(patterns)
+        return rules + self.__others + self.__standalone
+
+    def search(self, text: str) -> Optional[str]:
+        """Find the rule text matches.
+
+        Arguments:
+            text: Strings to check.
+
+        Returns:
+            The pattern of a matched rule, None if not matched.
+        """
+        if self.__literals is not None:
+            found = self.__literals.search(text)
+            if found is not None:
+                return self.__wordrule[found.group()]
+
+        for length, index in self.__prefixlist:
+            for pattern in index.get(text[:length], ()):
+                if self.__regex(pattern).match(text):
+                    return pattern
+
+        if self.__combined is not None:
+            found = self.__combined.search(text)
+            if found is not None:
+                # The first alternative matching there.
+                for pattern in self.__others:
+                    if self.__regex(pattern).match(text, found.start()):
+                        return pattern
+
+        for pattern in self.__standalone:
+            if self.__regex(pattern).search(text):
+                return pattern
+        return None
+
+    def __regex(self, rule: Union[str, Pattern]) -> Pattern:
+        """Compile a rule once.
+        """
+        pattern = getattr(rule, "pattern", rule)
+        regex = self.__compiled.get(pattern)
+        if regex is None:
+            regex = rule if not isinstance(rule, str) else re.compile(rule)
+            self.__compiled[pattern] = regex
+        return regex
+
+
+_UNCOMBINABLE = re.compile(r"\\[1-9]|\(\?P[<=]")
+
+
+def literal_word(pattern: str) -> Optional[str]:
+    """The text a pattern matches if it is literal.
+
+        "abc"   -> "abc"
+        "a\\.b"  -> "a.b"
+        "a.b"   -> None
+
+    Arguments:
+        pattern: Regex pattern.
+
+    Returns:
+        The literal text, None if it is not literal.
+    """
+    chars = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            # \d, \n etc.
+            if char.isalnum():
+                return None
+            chars.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in _SPECIAL:
+            return None
+        else:
+            chars.append(char)
+    if escaped:
+        return None
+    return "".join(chars)
+
+
+def literal_prefix(pattern: str) -> str:
+    """The literal prefix of a ^ anchored pattern.
+
+        "^/vote stop$"     -> "/vote stop"
+        "^/crpanel (?:a|b)" -> "/crpanel "
+        "^ab?c"            -> "a"
+        "^a|b"             -> ""
+
+    Arguments:
+        pattern: Regex pattern.
+
+    Returns:
+        Text every match starts with, "" if none.
+    """
+    if not pattern.startswith("^") or _toplevel_bar(pattern):
+        return ""
+    chars = []
+    escaped = False
+    for char in pattern[1:]:
+        if escaped:
+            if char.isalnum():
+                break
+            chars.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in _QUANTIFIER:
+            # The last character may be repeated or omitted.
+            chars = chars[:-1]
+            break
+        elif char in _SPECIAL:
+            break
+        else:
+            chars.append(char)
+    return "".join(chars)
+
+
+def _toplevel_bar(pattern: str) -> bool:
+    """Whether the pattern has | out of groups and sets.
+    """
+    depth = 0
+    inset = False
+    escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif inset:
+            if char == "]":
+                inset = False
+        elif char == "[":
+            inset = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+    return False
+
+
+def trie_regex(words: Iterable[str]) -> str:
+    """Regex matching any of the words, built as a trie.
+
+    Words having a shorter word as the prefix are dropped,
+    the shorter one matches first.
+
+        ["abc", "abd", "b"] -> "(?:ab[cd]|b)"
+
+    Arguments:
+        words: Literal words.
+
+    Returns:
+        Regex pattern, the match is one of the words.
+    """
+    trie = {}  # type: dict
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def walk(node: dict) -> str:
+        # Matched a word.
+        if "" in node:
+            return ""
+        alts = [re.escape(char) + walk(node[char]) for char in sorted(node)]
+        if len(alts) == 1:
+            return alts[0]
+        # Single characters to a set.
+        singles = [alt for alt in alts if len(alt) == 1]
+        if len(singles) == len(alts):
+            return "[" + "".join(singles) + "]"
+        return "(?:" + "|".join(alts) + ")"
+
+    return walk(trie)
 
 
 def gen_reg_set(words: Iterable[str]) -> Set[Pattern]:
@@ -83,7 +1069,7 @@ def gen_word_set(txtfile: str) -> Set[str]:
     """
     try:
         with open(txtfile, "r") as fopen:
-            wordset = {ln.strip() for ln in fopen if not ignore(ln)}
+            wordset = read_words(fopen)
     except FileNotFoundError:
         return set()
     except IOError:
@@ -92,6 +1078,22 @@ def gen_word_set(txtfile: str) -> Set[str]:
     return wordset
 
 
+def read_words(lines: Iterable[str]) -> Set[str]:
+    """Strings set from lines, except comment/blank lines.
+    """
+    return {ln.strip() for ln in lines if not ignore(ln)}
+
+
+def normalize_flood(text: str) -> str:
+    """Reduce nearly same texts to the same.
+
+    NFKC normalized and case folded,
+    spaces/symbols are removed and repeated characters are squeezed.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _REPEAT.sub(r"\1", _NONWORD.sub("", text))
+
+
 def ignore(line: str) -> bool:
     """Ignore comment/blank lines.
     """
@@ -107,5 +1109,5 @@ if __name__ == "__main__":
     mutefilter = MatchFilter(sys.argv[1])
 
     for arg in sys.argv[2:]:
-        result = mutefilter.ismatch(arg)
-        print("{0}\t{1}".format(result, arg))
+        rule = mutefilter.match_rule(arg)
+        print("{0}\t{1}\t{2}".format(rule is not None, arg, rule or ""))
@@ -0,0 +1,646 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""SQLite store of nicknames."""
+
+from typing import (Dict, Iterator, List, Optional, Set, Tuple, Union)
+import collections
+import collections.abc
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from . import atomicfile
+from .filewatch import FileStamp
+
+
+NameProp = Dict[str, Union[str, int]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nickname (
+    kind TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    time INTEGER NOT NULL DEFAULT 0,
+    fixed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, uid)
+) WITHOUT ROWID
+"""
+
+
+def _main() -> None:
+    if len(sys.argv) != 5 or sys.argv[1] not in ("import", "export"):
+        _show_usage()
+        exit(1)
+    command, dbpath, kind, jsonpath = sys.argv[1:]
+    with NicknameStore(dbpath) as store:
+        if command == "import":
+            count = store.import_json(kind, jsonpath)
+        else:
+            count = store.export_json(kind, jsonpath)
+    print("{0}ed {1} names.".format(command, count))
+
+
+def _show_usage() -> None:
+    print("Usage: {} import|export nickname.sqlite3 id|anon nickname.txt"
+          .format(__file__), file=sys.stderr)
+
+
+class NicknameStore():
+    """Nicknames stored in sqlite3.
+
+    Each nickname is a row indexed by the kind(id/anon) and the uid,
+    so a lookup and a registration don't touch the other names.
+    Thread safe, share an instance.
+    Use with context to call close surely.
+
+    Attributes:
+        __conn: Connection to the database.
+        __lock: Lock of __conn.
+    """
+    def __init__(self, dbpath: str) -> None:
+        """Constructor.
+
+        Arguments:
+            dbpath: Path to the database file, created if not exists.
+
+        Returns:
+            None
+        """
+        self.__conn = sqlite3.connect(dbpath, check_same_thread=False)
+        self.__lock = threading.Lock()
+        with self.__lock, self.__conn:
+            # Commit without waiting for the disk on each registration.
+            self.__conn.execute("PRAGMA journal_mode=WAL")
+            self.__conn.execute("PRAGMA synchronous=NORMAL")
+            self.__conn.execute(_SCHEMA)
+
+    @property
+    def migrated(self) -> bool:
+        """Whether the json files were imported.
+        """
+        with self.__lock:
+            version = self.__conn.execute("PRAGMA user_version").fetchone()
+        return version[0] >= 1
+
+    @property
+    def data_version(self) -> int:
+        """Changed when the other connections commit.
+        """
+        with self.__lock:
+            return self.__conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def mark_migrated(self) -> None:
+        """Record that the json files were imported.
+        """
+        with self.__lock, self.__conn:
+            self.__conn.execute("PRAGMA user_version = 1")
+
+    def get(self, kind: str, uid: str) -> Optional[NameProp]:
+        """Get the nickname property.
+
+        Arguments:
+            kind: id or anon.
+            uid: The commented user id.
+
+        Returns:
+            Dict like {"name": name, "time": time, "fixed": 0},
+            None if not registered.
+        """
+        with self.__lock:
+            row = self.__conn.execute(
+                "SELECT name, time, fixed FROM nickname "
+                "WHERE kind = ? AND uid = ?", (kind, uid)).fetchone()
+        if row is None:
+            return None
+        return {"name": row[0], "time": row[1], "fixed": row[2]}
+
+    def put(self, kind: str, uid: str, prop: NameProp) -> None:
+        """Register the nickname property.
+
+        Arguments:
+            kind: id or anon.
+            uid: The commented user id.
+            prop: Dict like {"name": name, "time": time, "fixed": 0}.
+
+        Returns:
+            None
+        """
+        self.put_many(kind, [(uid, prop)])
+
+    def put_many(self,
+                 kind: str,
+                 props: List[Tuple[str, NameProp]]) -> None:
+        """Register the nickname properties in one transaction.
+
+        Arguments:
+            kind: id or anon.
+            props: Tuples of the uid and the property.
+
+        Returns:
+            None
+        """
+        rows = [(kind, uid, prop["name"], prop.get("time", 0),
+                 prop.get("fixed", 0)) for uid, prop in props]
+        with self.__lock, self.__conn:
+            self.__conn.executemany(
+                "INSERT OR REPLACE INTO nickname "
+                "(kind, uid, name, time, fixed) VALUES (?, ?, ?, ?, ?)",
+                rows)
+
+    def delete(self, kind: str, uid: str) -> bool:
+        """Unregister the nickname.
+
+        Arguments:
+            kind: id or anon.
+            uid: The commented user id.
+
+        Returns:
+            True if it was registered.
+        """
+        with self.__lock, self.__conn:
+            cursor = self.__conn.execute(
+                "DELETE FROM nickname WHERE kind = ? AND uid = ?",
+                (kind, uid))
+        return cursor.rowcount > 0
+
+    def items(self, kind: str) -> List[Tuple[str, NameProp]]:
+        """All nickname properties of the kind.
+
+        Arguments:
+            kind: id or anon.
+
+        Returns:
+            Tuples of the uid and the property, by registered time.
+        """
+        with self.__lock:
+            rows = self.__conn.execute(
+                "SELECT uid, name, time, fixed FROM nickname "
+                "WHERE kind = ? ORDER BY time, uid", (kind,)).fetchall()
+        return [(row[0], {"name": row[1], "time": row[2], "fixed": row[3]})
+                for row in rows]
+
+    def count(self, kind: str) -> int:
+        """Number of the nicknames of the kind.
+        """
+        with self.__lock:
+            return self.__conn.execute(
+                "SELECT COUNT(*) FROM nickname WHERE kind = ?",
+                (kind,)).fetchone()[0]
+
+    def view(self, kind: str, jsonpath: Optional[str]=None) -> "NameView":
+        """Dict-like view of the kind.
+
+        Arguments:
+            kind: id or anon.
+            jsonpath: Json file to import the edits from.
+
+        Returns:
+            NameView of the kind.
+        """
+        return NameView(self, kind, jsonpath)
+
+    def import_json(self, kind: str, jsonpath: str) -> int:
+        """Import a nickname json file.
+
+        The format is the one register_name writes,
+        {id: {"name": name, "time": time, "fixed": 0}}.
+
+        Arguments:
+            kind: id or anon.
+            jsonpath: Path to the json file.
+
+        Returns:
+            Number of imported names.
+        """
+        with open(jsonpath, "r") as jsonf:
+            namedict = json.load(jsonf)
+        props = [(uid, prop) for uid, prop in namedict.items()
+                 if _isprop(prop)]
+        self.put_many(kind, props)
+        return len(props)
+
+    def export_json(self, kind: str, jsonpath: str) -> int:
+        """Export the names to a json file for compatibility.
+
+        Arguments:
+            kind: id or anon.
+            jsonpath: Path to the json file.
+
+        Returns:
+            Number of exported names.
+        """
+        props = self.items(kind)
+        with open(jsonpath, "w") as jsonf:
+            json.dump(collections.OrderedDict(props),
+                      jsonf,
+                      ensure_ascii=False,
+                      separators=(", ", ": "))
+        return len(props)
+
+    def close(self) -> None:
+        """Close the database.
+
+        This is also called by with context(__exit__).
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        with self.__lock:
+            self.__conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, extype, exvalue, traceback) -> None:
+        self.close()
+
+
+def read_names(jsonpath: str) -> Dict[str, NameProp]:
+    """Valid names in a nickname json file, empty if not exists.
+    """
+    if not os.path.exists(jsonpath):
+        return {}
+    with open(jsonpath, "r") as jsonf:
+        namedict = json.load(jsonf)
+    if not isinstance(namedict, dict):
+        raise ValueError("not a nickname file: {0}".format(jsonpath))
+    return {uid: prop for uid, prop in namedict.items() if _isprop(prop)}
+
+
+def _isprop(prop: object) -> bool:
+    return isinstance(prop, dict) and "name" in prop
+
+
+class NameView(collections.abc.MutableMapping):
+    """Nicknames of a kind as a dict.
+
+    Used in place of the dict loaded from the json file,
+    namemap[uid]["name"], uid in namemap and
+    namemap[uid] = prop work as before.
+    With jsonpath, the entries edited in the json file
+    are imported by load, so the file is still editable.
+
+    Attributes:
+        store: The nickname store.
+        kind: id or anon.
+        jsonpath: Json file to import the edits from, or None.
+        __version: data_version of the store when loaded.
+        __stamp: FileStamp of jsonpath.
+        __seen: The json file content when last read.
+        __edited: Whether the json file was changed since last read.
+    """
+    def __init__(self,
+                 store: NicknameStore,
+                 kind: str,
+                 jsonpath: Optional[str]=None) -> None:
+        """Constructor.
+
+        Arguments:
+            store: The nickname store.
+            kind: id or anon.
+            jsonpath: Json file to import the edits from.
+                      The current content is not imported.
+
+        Returns:
+            None
+        """
+        self.store = store  # type: NicknameStore
+        self.kind = kind  # type: str
+        self.jsonpath = jsonpath  # type: Optional[str]
+        self.__version = None  # type: Optional[int]
+        self.__stamp = None  # type: Optional[FileStamp]
+        self.__seen = {}  # type: Dict[str, NameProp]
+        self.__edited = False
+        if jsonpath is not None:
+            self.__stamp = FileStamp(jsonpath)
+            try:
+                self.__seen = read_names(jsonpath)
+            except (IOError, ValueError):
+                pass
+
+    def __getitem__(self, uid: str) -> NameProp:
+        prop = self.store.get(self.kind, uid)
+        if prop is None:
+            raise KeyError(uid)
+        return prop
+
+    def __setitem__(self, uid: str, prop: NameProp) -> None:
+        self.store.put(self.kind, uid, prop)
+
+    def __delitem__(self, uid: str) -> None:
+        if not self.store.delete(self.kind, uid):
+            raise KeyError(uid)
+
+    def __contains__(self, uid: object) -> bool:
+        return (isinstance(uid, str)
+                and self.store.get(self.kind, uid) is not None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([uid for uid, _ in self.store.items(self.kind)])
+
+    def __len__(self) -> int:
+        return self.store.count(self.kind)
+
+    # Only the changed names are needed to write.
+    full = False
+
+    def load(self) -> Dict[str, NameProp]:
+        """All names of the kind, as the backend of NameMap.
+
+        The edits of the json file are imported before.
+        """
+        if self.__edited:
+            self.import_edits()
+        self.__version = self.store.data_version
+        return dict(self.store.items(self.kind))
+
+    def changed(self) -> bool:
+        """Whether the other connections wrote after load,
+        like namestore import, or the json file was edited.
+        """
+        if self.__stamp is not None and self.__stamp.changed():
+            self.__edited = True
+        return self.__edited or self.store.data_version != self.__version
+
+    def import_edits(self) -> int:
+        """Import the entries changed in the json file since last read.
+
+        The others are kept, the file lacks the names registered
+        after the migration to the store.
+        Deleting from the file doesn't delete from the store.
+
+        Arguments:
+            None
+
+        Returns:
+            Number of the imported names.
+        """
+        names = read_names(self.jsonpath) if self.jsonpath else {}
+        props = [(uid, prop) for uid, prop in names.items()
+                 if prop != self.__seen.get(uid)]
+        self.store.put_many(self.kind, props)
+        self.__seen = names
+        self.__edited = False
+        return len(props)
+
+    def write(self, names: Dict[str, NameProp], dirty: List[str]) -> None:
+        """Write the changed names in one transaction.
+
+        Arguments:
+            names: The changed names.
+            dirty: Changed uids, deleted if not in names.
+
+        Returns:
+            None
+        """
+        self.store.put_many(self.kind, [(uid, names[uid]) for uid in dirty
+                                        if uid in names])
+        for uid in dirty:
+            if uid not in names:
+                self.store.delete(self.kind, uid)
+
+    def close(self) -> None:
+        # The store is shared by the views, closed by its owner.
+        pass
+
+
+class JSONNameFile():
+    """Nickname json file, as the backend of NameMap.
+
+    The format is the one register_name writes.
+
+    Attributes:
+        path: Path to the json file.
+        __stamp: FileStamp of path, after loaded or written.
+    """
+    # All names are needed to rewrite the file.
+    full = True
+
+    def __init__(self, path: str) -> None:
+        self.path = path  # type: str
+        self.__stamp = FileStamp(path)
+
+    def load(self) -> Dict[str, NameProp]:
+        """All names in the file, empty if not exists.
+        """
+        self.__stamp.update()
+        if not os.path.exists(self.path):
+            return {}
+        decoder = json.JSONDecoder(
+            object_pairs_hook=collections.OrderedDict)
+        with open(self.path, "r") as jsonf:
+            return decoder.decode(jsonf.read())
+
+    def write(self, names: Dict[str, NameProp], dirty: List[str]) -> None:
+        """Replace the file with all names atomically.
+
+        Arguments:
+            names: All names.
+            dirty: Changed uids, not used.
+
+        Returns:
+            None
+        """
+        with atomicfile.replace(self.path) as jsonf:
+            json.dump(names,
+                      jsonf,
+                      ensure_ascii=False,
+                      separators=(", ", ": "))
+        self.__stamp.update()
+
+    def changed(self) -> bool:
+        """Whether the file was edited after load or write.
+        """
+        return self.__stamp.changed()
+
+    def close(self) -> None:
+        pass
+
+
+class NameMap(collections.abc.MutableMapping):
+    """In-memory nickname map with write-behind.
+
+    All names are loaded once and the map is the source of truth,
+    updated in place without reloading.
+    Changed names are written to the backend in batches,
+    by flush() on the timer of start() and at close().
+    A crash loses at most the changes of one interval.
+    Changes by others, like editing the file, are merged by reload()
+    on the timer too.
+    Thread safe.
+
+    Attributes:
+        flushes: Number of writes to the backend.
+        reloads: Number of merged changes of the backend.
+        __backend: NameView or JSONNameFile.
+        __names: All names.
+        __dirty: Uids changed after the last flush.
+        __lock: Lock of __names and __dirty.
+        __flushlock: Lock to write one batch at a time.
+        __stop: Set to stop the timer.
+        __timer: The flushing thread, None if not started.
+    """
+    def __init__(self, backend: Union[NameView, JSONNameFile]) -> None:
+        """Constructor.
+
+        Arguments:
+            backend: Where the names are loaded from and written to.
+
+        Returns:
+            None
+        """
+        self.flushes = 0  # type: int
+        self.reloads = 0  # type: int
+        self.__backend = backend
+        self.__names = backend.load()
+        self.__dirty = set()  # type: Set[str]
+        self.__lock = threading.Lock()
+        self.__flushlock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__timer = None  # type: Optional[threading.Thread]
+
+    def __getitem__(self, uid: str) -> NameProp:
+        return self.__names[uid]
+
+    def __setitem__(self, uid: str, prop: NameProp) -> None:
+        with self.__lock:
+            self.__names[uid] = prop
+            self.__dirty.add(uid)
+
+    def __delitem__(self, uid: str) -> None:
+        with self.__lock:
+            del self.__names[uid]
+            self.__dirty.add(uid)
+
+    def __contains__(self, uid: object) -> bool:
+        return uid in self.__names
+
+    def __iter__(self) -> Iterator[str]:
+        with self.__lock:
+            return iter(list(self.__names))
+
+    def __len__(self) -> int:
+        return len(self.__names)
+
+    @property
+    def backend(self) -> Union[NameView, JSONNameFile]:
+        return self.__backend
+
+    @property
+    def dirty(self) -> int:
+        """Number of the names waiting to be written.
+        """
+        return len(self.__dirty)
+
+    def flush(self) -> None:
+        """Write the changed names to the backend.
+
+        The map is not locked while writing,
+        the changes are kept if writing failed.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        with self.__flushlock:
+            with self.__lock:
+                if not self.__dirty:
+                    return
+                dirty = self.__dirty
+                self.__dirty = set()
+                if self.__backend.full:
+                    names = dict(self.__names)
+                else:
+                    names = {uid: self.__names[uid] for uid in dirty
+                             if uid in self.__names}
+            try:
+                self.__backend.write(names, list(dirty))
+            except BaseException:
+                with self.__lock:
+                    self.__dirty |= dirty
+                raise
+            self.flushes += 1
+
+    def reload(self) -> bool:
+        """Merge the changes of the backend by others.
+
+        All names are loaded again and swapped at once,
+        the names not flushed yet are kept.
+
+        Arguments:
+            None
+
+        Returns:
+            True if the backend was changed.
+        """
+        with self.__flushlock:
+            if not self.__backend.changed():
+                return False
+            names = self.__backend.load()
+            with self.__lock:
+                for uid in self.__dirty:
+                    if uid in self.__names:
+                        names[uid] = self.__names[uid]
+                    else:
+                        names.pop(uid, None)
+                self.__names = names
+            self.reloads += 1
+            return True
+
+    def start(self, interval: float=5.0, watch: float=1.0) -> None:
+        """Flush and reload on a timer thread.
+
+        Arguments:
+            interval: Seconds between flushes.
+            watch: Seconds between checking the changes by others.
+
+        Returns:
+            None
+        """
+        def run() -> None:
+            flushed = time.monotonic()
+            while not self.__stop.wait(min(watch, interval)):
+                try:
+                    self.reload()
+                    if time.monotonic() - flushed >= interval:
+                        flushed = time.monotonic()
+                        self.flush()
+                # Retry on the next interval.
+                except (IOError, ValueError, sqlite3.Error) as err:
+                    print("[ERR] nickname flush: {0}".format(err),
+                          file=sys.stderr)
+
+        self.__timer = threading.Thread(target=run, daemon=True)
+        self.__timer.start()
+
+    def close(self) -> None:
+        """Stop the timer, flush and close the backend.
+
+        A NicknameStore shared by the views is not closed,
+        close it after all the maps.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        self.__stop.set()
+        if self.__timer is not None:
+            self.__timer.join()
+        try:
+            self.flush()
+        finally:
+            self.__backend.close()
+
+
+if __name__ == "__main__":
+    _main()
@@ -4,13 +4,13 @@
 
 from getpass import getpass
 from typing import Dict
-from urllib.parse import urlencode
-from urllib.request import (build_opener, HTTPCookieProcessor)
 import http.cookiejar
 import os
 import re
 import sys
 
+from . import nhttp
+
 
 def _main() -> None:
     cookieDir = os.path.join("cookie", "")
@@ -89,11 +89,8 @@ def save_cookie(url: str, data: Dict[str, str], cookie: str) -> None:
         Retry when it failed.
     """
     lwp = http.cookiejar.LWPCookieJar()
-    httpopener = build_opener(HTTPCookieProcessor(lwp))
-    encdata = urlencode(data).encode("utf-8")
-
-    with httpopener.open(url, encdata):
-        lwp.save(cookie)
+    nhttp.get_client().post(url, data, cookiejar=lwp)
+    lwp.save(cookie)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Shared HTTP client with persistent connections."""
+
+from typing import (Deque, Dict, Optional, Tuple)
+from urllib.parse import (urlencode, urljoin, urlsplit)
+import collections
+import http.client
+import http.cookiejar
+import io
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+# Methods safe to send again on failure.
+_IDEMPOTENT = ("GET", "HEAD")
+# Server errors worth retrying.
+_RETRY_STATUS = (502, 503, 504)
+_REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+_client = None  # type: Optional[HTTPClient]
+_clientlock = threading.Lock()
+
+
+def get_client() -> "HTTPClient":
+    """Get the client shared in the process.
+
+    Arguments:
+        None
+
+    Returns:
+        HTTPClient instance.
+    """
+    global _client
+    with _clientlock:
+        if _client is None:
+            _client = HTTPClient()
+        return _client
+
+
+class Response():
+    """Received response, read to the end.
+
+    Attributes:
+        url: The requested url, after redirects.
+        status: HTTP status code.
+        reason: HTTP reason phrase.
+        headers: Response headers.
+        body: Response body.
+    """
+    def __init__(self,
+                 url: str,
+                 status: int,
+                 reason: str,
+                 headers: http.client.HTTPMessage,
+                 body: bytes) -> None:
+        self.url = url  # type: str
+        self.status = status  # type: int
+        self.reason = reason  # type: str
+        self.headers = headers  # type: http.client.HTTPMessage
+        self.body = body  # type: bytes
+
+    def info(self) -> http.client.HTTPMessage:
+        """Headers, for http.cookiejar.
+        """
+        return self.headers
+
+    def text(self, encoding: str="utf-8") -> str:
+        """Decoded body.
+        """
+        return self.body.decode(encoding)
+
+
+class HTTPStats():
+    """Counters of the client.
+
+    Attributes:
+        requests: Number of sent requests, including retries.
+        connects: Number of opened connections.
+        reused: Number of requests on a kept-alive connection.
+        retries: Number of retried requests.
+        errors: Number of requests failed in the end.
+        sent: Bytes of sent bodies.
+        received: Bytes of received bodies.
+        latency: Total seconds waiting for the responses.
+        maxlatency: The longest seconds waiting for a response.
+    """
+    def __init__(self) -> None:
+        self.requests = 0  # type: int
+        self.connects = 0  # type: int
+        self.reused = 0  # type: int
+        self.retries = 0  # type: int
+        self.errors = 0  # type: int
+        self.sent = 0  # type: int
+        self.received = 0  # type: int
+        self.latency = 0.0  # type: float
+        self.maxlatency = 0.0  # type: float
+
+    def __str__(self) -> str:
+        average = self.latency / self.requests if self.requests else 0.0
+        return ("{0} requests ({1} connects, {2} reused, {3} retries, "
+                "{4} errors), {5} bytes sent, {6} bytes received, "
+                "latency avg {7:.3f}s max {8:.3f}s"
+                .format(self.requests, self.connects, self.reused,
+                        self.retries, self.errors, self.sent,
+                        self.received, average, self.maxlatency))
+
+
+class HTTPClient():
+    """HTTP client keeping connections per host.
+
+    Connections are kept alive and reused by the later requests
+    to the same host, so DNS, TCP and TLS handshakes are not repeated.
+    Thread safe, a connection is used by one request at a time.
+    Status 400 or above raises urllib.error.HTTPError like urlopen.
+
+    Attributes:
+        stats: Counters of the requests.
+        __timeout: Seconds to wait for connecting and each receive.
+        __retries: Times to retry the idempotent requests.
+        __backoff: Seconds to wait before the first retry.
+        __poolsize: Number of idle connections to keep per host.
+        __pool: Idle connections by the scheme, host and port.
+        __lock: Lock of __pool and stats.
+        __sslcontext: SSL context for https.
+    """
+    def __init__(self,
+                 timeout: float=10.0,
+                 retries: int=2,
+                 backoff: float=0.5,
+                 poolsize: int=4) -> None:
+        """Constructor.
+
+        Arguments:
+            timeout: Seconds to wait for connecting and each receive.
+            retries: Times to retry GET/HEAD on connection errors
+                     and 502/503/504.
+            backoff: Seconds to wait before the first retry, doubled.
+            poolsize: Number of idle connections to keep per host.
+
+        Returns:
+            None
+        """
+        self.stats = HTTPStats()  # type: HTTPStats
+        self.__timeout = timeout
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__poolsize = poolsize
+        self.__pool = {}  # type: Dict[Tuple[str, str, int], Deque]
+        self.__lock = threading.Lock()
+        self.__sslcontext = ssl.create_default_context()
+
+    def get(self,
+            url: str,
+            headers: Optional[Dict[str, str]]=None,
+            cookiejar: Optional[http.cookiejar.CookieJar]=None) -> Response:
+        """Send GET request.
+
+        Arguments:
+            url: The url to request.
+            headers: Additional request headers.
+            cookiejar: Send cookies in it, and store received ones.
+
+        Returns:
+            Response read to the end.
+        """
+        return self.request("GET", url, None, headers, cookiejar)
+
+    def post(self,
+             url: str,
+             data: Dict[str, str],
+             headers: Optional[Dict[str, str]]=None,
+             cookiejar: Optional[http.cookiejar.CookieJar]=None) -> Response:
+        """Send POST request of the form data.
+
+        Arguments:
+            url: The url to request.
+            data: Form data to urlencode.
+            headers: Additional request headers.
+            cookiejar: Send cookies in it, and store received ones.
+
+        Returns:
+            Response read to the end.
+        """
+        formheaders = {
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        formheaders.update(headers or {})
+        body = urlencode(data).encode("utf-8")
+        return self.request("POST", url, body, formheaders, cookiejar)
+
+    def request(self,
+                method: str,
+                url: str,
+                body: Optional[bytes]=None,
+                headers: Optional[Dict[str, str]]=None,
+                cookiejar: Optional[http.cookiejar.CookieJar]=None,
+                redirects: int=5) -> Response:
+        """Send a request, follow redirects.
+
+        Arguments:
+            method: HTTP method.
+            url: The url to request.
+            body: Request body.
+            headers: Additional request headers.
+            cookiejar: Send cookies in it, and store received ones.
+            redirects: Number of redirects to follow.
+
+        Returns:
+            Response read to the end.
+        """
+        headers = dict(headers or {})
+        for _ in range(redirects + 1):
+            req = urllib.request.Request(url, headers=headers, method=method)
+            if cookiejar is not None:
+                cookiejar.add_cookie_header(req)
+            resp = self.__send(method, url, body, dict(req.header_items()))
+            if cookiejar is not None:
+                cookiejar.extract_cookies(resp, req)
+
+            location = resp.headers.get("Location")
+            if resp.status not in _REDIRECT_STATUS or location is None:
+                break
+            url = urljoin(url, location)
+            # Like browsers, resend as GET except 307/308.
+            if resp.status not in (307, 308) and method != "HEAD":
+                method = "GET"
+                body = None
+                headers.pop("Content-Type", None)
+
+        if resp.status >= 400:
+            raise urllib.error.HTTPError(resp.url, resp.status, resp.reason,
+                                         resp.headers, io.BytesIO(resp.body))
+        return resp
+
+    def close(self) -> None:
+        """Close the idle connections.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        with self.__lock:
+            pools = list(self.__pool.values())
+            self.__pool.clear()
+        for pool in pools:
+            for conn in pool:
+                conn.close()
+
+    def __send(self,
+               method: str,
+               url: str,
+               body: Optional[bytes],
+               headers: Dict[str, str]) -> Response:
+        """Send a request with the retry policy.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise urllib.error.URLError("unknown url type: {}".format(url))
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname or "", port)
+        proxy = find_proxy(scheme, key[1])
+        # Absolute url is sent to http proxies.
+        if proxy is not None and scheme == "http":
+            target = url
+        else:
+            target = parts.path or "/"
+            if parts.query:
+                target += "?" + parts.query
+
+        attempt = 0
+        while True:
+            conn, reused = self.__acquire(key, proxy)
+            start = time.perf_counter()
+            sent = False
+            try:
+                conn.request(method, target, body, headers)
+                sent = True
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException) as err:
+                conn.close()
+                self.__count(start, body, None)
+                # The server may have closed the kept-alive connection.
+                # Once sent, others than GET/HEAD may have been done.
+                if reused and (method in _IDEMPOTENT or not sent):
+                    continue
+                attempt += 1
+                if method not in _IDEMPOTENT or attempt > self.__retries:
+                    with self.__lock:
+                        self.stats.errors += 1
+                    if isinstance(err, OSError):
+                        raise
+                    raise urllib.error.URLError(err)
+                self.__wait(attempt)
+                continue
+
+            self.__count(start, body, data)
+            if resp.will_close:
+                conn.close()
+            else:
+                self.__release(key, conn)
+
+            if (resp.status in _RETRY_STATUS and method in _IDEMPOTENT
+                    and attempt < self.__retries):
+                attempt += 1
+                self.__wait(attempt)
+                continue
+            return Response(url, resp.status, resp.reason, resp.headers, data)
+
+    def __acquire(self,
+                  key: Tuple[str, str, int],
+                  proxy: Optional[str]) -> tuple:
+        """Get an idle connection, or open a new one.
+
+        Returns:
+            Tuple of the connection and whether it is reused.
+        """
+        with self.__lock:
+            pool = self.__pool.get(key)
+            if pool:
+                self.stats.reused += 1
+                return (pool.pop(), True)
+            self.stats.connects += 1
+
+        scheme, host, port = key
+        if proxy is not None:
+            proxyparts = urlsplit(proxy)
+            proxyhost = proxyparts.hostname
+            proxyport = proxyparts.port or 8080
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(
+                    proxyhost, proxyport, timeout=self.__timeout,
+                    context=self.__sslcontext)
+                conn.set_tunnel(host, port)
+            else:
+                conn = http.client.HTTPConnection(
+                    proxyhost, proxyport, timeout=self.__timeout)
+        elif scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self.__timeout,
+                context=self.__sslcontext)
+        else:
+            conn = http.client.HTTPConnection(
+                host, port, timeout=self.__timeout)
+        return (conn, False)
+
+    def __release(self,
+                  key: Tuple[str, str, int],
+                  conn: http.client.HTTPConnection) -> None:
+        """Return the connection to the pool.
+        """
+        with self.__lock:
+            pool = self.__pool.setdefault(key, collections.deque())
+            if len(pool) < self.__poolsize:
+                pool.append(conn)
+                return
+        conn.close()
+
+    def __count(self,
+                start: float,
+                body: Optional[bytes],
+                data: Optional[bytes]) -> None:
+        """Update the counters of a request.
+        """
+        elapsed = time.perf_counter() - start
+        with self.__lock:
+            self.stats.requests += 1
+            self.stats.sent += len(body) if body else 0
+            self.stats.received += len(data) if data else 0
+            self.stats.latency += elapsed
+            self.stats.maxlatency = max(self.stats.maxlatency, elapsed)
+
+    def __wait(self, attempt: int) -> None:
+        with self.__lock:
+            self.stats.retries += 1
+        time.sleep(self.__backoff * 2 ** (attempt - 1))
+
+
+def find_proxy(scheme: str, host: str) -> Optional[str]:
+    """The proxy of the environment variables like urlopen.
+
+    Arguments:
+        scheme: http or https.
+        host: The host to connect.
+
+    Returns:
+        The proxy url, None if not used.
+    """
+    if urllib.request.proxy_bypass(host):
+        return None
+    return urllib.request.getproxies().get(scheme)
@@ -2,14 +2,21 @@
 # -*- coding: utf-8 -*-
 """Retrieve, register, assign the nickname."""
 
-from time import sleep
+from typing import (Callable, Dict, List, Optional, Set, Tuple)
+from concurrent import futures
 from xml.dom import minidom
 import collections
 import json
 import os.path
 import re
+import sys
+import threading
+import time
 import urllib.error
-import urllib.request
+
+from . import (atomicfile,
+               nhttp,
+               ratelimit)
 
 
 def register_name(uid: str,
@@ -86,18 +93,352 @@ def retrieve_name(uid: str) -> str:
         The retrieved username if it succeeded,
         otherwise The userID if it failed.
     """
-    # Not to send Excessive requests.
-    sleep(1)
+    try:
+        return fetch_name(uid)
+    except urllib.error.HTTPError:
+        return uid
+    except LookupError:
+        return uid
+
+
+def fetch_name(uid: str) -> str:
+    """Retrieve username, raise if failed.
+
+    Same as retrieve_name, but the failure is not hidden.
+
+    Arguments:
+        uid: The UserID to retrieve its name.
+
+    Returns:
+        The retrieved username.
+
+    Raises:
+        urllib.error.HTTPError: The user was not found.
+        LookupError: The name was not in the iframe page.
+        IOError: Other network errors.
+    """
     try:
         return retr_name_seiga(uid)
     # some users are 404
     except urllib.error.HTTPError:
         try:
             return retr_name_iframe(uid)
-        except urllib.error.HTTPError:
-            return uid
         except AttributeError:
-            return uid
+            raise LookupError(uid)
+
+
+class NameCache():
+    """On-disk cache of username lookups.
+
+    Remember retrieved names and unknown users by uid,
+    so a user who can't be retrieved costs one lookup per negttl,
+    not one per comment. Network errors are not remembered.
+    Kept apart from the registered nicknames, least recently used
+    entries are dropped over maxsize.
+    Thread safe.
+
+    Attributes:
+        ttl: Seconds to keep the retrieved names.
+        negttl: Seconds to keep the failures.
+        maxsize: Number of the entries to keep.
+        __cachefile: Path to the json file.
+        __entries: [name or None, saved time] by uid, oldest first.
+        __edits: Number of the changes of __entries.
+        __saved: __edits when last saved.
+        __lock: Lock of __entries.
+        __stop: Set to stop the timer.
+        __timer: The saving thread, None if not started.
+    """
+    def __init__(self,
+                 cachefile: str,
+                 ttl: float=7 * 86400.0,
+                 negttl: float=3600.0,
+                 maxsize: int=10000) -> None:
+        """Constructor.
+
+        Arguments:
+            cachefile: Path to the json file.
+            ttl: Seconds to keep the retrieved names.
+            negttl: Seconds to keep the failures.
+            maxsize: Number of the entries to keep.
+
+        Returns:
+            None
+        """
+        self.ttl = ttl  # type: float
+        self.negttl = negttl  # type: float
+        self.maxsize = maxsize  # type: int
+        self.__cachefile = cachefile
+        self.__entries = self.__load()
+        self.__edits = 0
+        self.__saved = 0
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__timer = None  # type: Optional[threading.Thread]
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def start(self, interval: float=5.0) -> None:
+        """Save on a timer thread, not to lose the cache by a crash.
+
+        Arguments:
+            interval: Seconds between saves.
+
+        Returns:
+            None
+        """
+        def run() -> None:
+            while not self.__stop.wait(interval):
+                self.save()
+
+        self.__timer = threading.Thread(target=run, daemon=True)
+        self.__timer.start()
+
+    def close(self) -> None:
+        """Stop the timer and save.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        self.__stop.set()
+        if self.__timer is not None:
+            self.__timer.join()
+        self.save()
+
+    def get(self, uid: str) -> Tuple[bool, Optional[str]]:
+        """Get the cached lookup.
+
+        Arguments:
+            uid: A user id.
+
+        Returns:
+            Tuple of whether it is cached and the name,
+            the name is None if the lookup failed.
+        """
+        with self.__lock:
+            entry = self.__entries.get(uid)
+            if entry is None:
+                return (False, None)
+            if self.__expired(entry, time.time()):
+                del self.__entries[uid]
+                self.__edits += 1
+                return (False, None)
+            self.__entries.move_to_end(uid)
+            return (True, entry[0])
+
+    def put(self, uid: str, name: Optional[str]) -> None:
+        """Cache the result of a lookup.
+
+        Arguments:
+            uid: A user id.
+            name: The retrieved name, None if failed.
+
+        Returns:
+            None
+        """
+        with self.__lock:
+            self.__entries[uid] = [name, time.time()]
+            self.__entries.move_to_end(uid)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+            self.__edits += 1
+
+    def save(self) -> None:
+        """Write the unexpired entries if changed.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        with self.__lock:
+            if self.__edits == self.__saved:
+                return
+            edits = self.__edits
+            now = time.time()
+            entries = collections.OrderedDict(
+                (uid, entry) for uid, entry in self.__entries.items()
+                if not self.__expired(entry, now))
+
+        # Caching is optional, retried by the next save.
+        try:
+            with atomicfile.replace(self.__cachefile) as cacheopen:
+                json.dump(entries, cacheopen, ensure_ascii=False)
+        except IOError:
+            return
+        # Changes while writing are saved next time.
+        with self.__lock:
+            self.__saved = edits
+
+    def __expired(self, entry: List, now: float) -> bool:
+        ttl = self.ttl if entry[0] is not None else self.negttl
+        return now - entry[1] > ttl
+
+    def __load(self) -> Dict[str, List]:
+        entries = collections.OrderedDict()  # type: Dict[str, List]
+        try:
+            with open(self.__cachefile, "r") as cacheopen:
+                loaded = json.load(
+                    cacheopen, object_pairs_hook=collections.OrderedDict)
+        except (IOError, ValueError):
+            return entries
+        if not isinstance(loaded, dict):
+            return entries
+        for uid, entry in loaded.items():
+            if isinstance(entry, list) and len(entry) == 2:
+                entries[uid] = entry
+        return entries
+
+
+class NameResolver():
+    """Retrieve usernames on worker threads.
+
+    Lookups are queued to a bounded pool instead of blocking the caller,
+    the requests to the same uid are merged while it is pending.
+    The requests are limited by the shared ratelimit budgets.
+    With the cache, cached names are passed at once
+    and the users failed recently are not retrieved.
+
+    Attributes:
+        resolved: Number of the names passed to the callback.
+        dropped: Number of the requests dropped by the full queue.
+        cached: Number of the requests answered by the cache.
+        __callback: Called with the uid and the name,
+                    on a worker thread unless cached.
+        __resolve: Function retrieving a name, raise if failed.
+        __cache: NameCache, or None.
+        __maxpending: Number of the uids to queue at most.
+        __pending: Uids queued or being retrieved.
+        __lock: Lock of __pending.
+        __closed: Set to skip the queued lookups.
+        __executor: The worker pool.
+    """
+    def __init__(self,
+                 callback: Callable[[str, str], None],
+                 workers: int=2,
+                 maxpending: int=256,
+                 resolve: Optional[Callable[[str], str]]=None,
+                 cache: Optional[NameCache]=None) -> None:
+        """Constructor.
+
+        Arguments:
+            callback: Called with the uid and the retrieved name.
+            workers: Number of concurrent lookups.
+            maxpending: Number of the uids to queue at most.
+            resolve: Function retrieving a name, raise if failed.
+                     fetch_name by default.
+            cache: Cache of the lookups, closed at close.
+
+        Returns:
+            None
+        """
+        self.resolved = 0  # type: int
+        self.dropped = 0  # type: int
+        self.cached = 0  # type: int
+        self.__callback = callback
+        self.__resolve = resolve or fetch_name
+        self.__cache = cache
+        self.__maxpending = maxpending
+        self.__pending = set()  # type: Set[str]
+        self.__lock = threading.Lock()
+        self.__closed = threading.Event()
+        self.__executor = futures.ThreadPoolExecutor(max_workers=workers)
+
+    @property
+    def pending(self) -> int:
+        """Number of the uids queued or being retrieved.
+        """
+        return len(self.__pending)
+
+    def request(self, uid: str) -> bool:
+        """Queue a lookup of the uid.
+
+        Arguments:
+            uid: A user id to retrieve its name.
+
+        Returns:
+            True if queued or already pending,
+            False if answered by the cache, or the queue is full or closed.
+        """
+        if self.__cache is not None:
+            iscached, name = self.__cache.get(uid)
+            if iscached:
+                self.cached += 1
+                if name is not None:
+                    self.__deliver(uid, name)
+                return False
+
+        with self.__lock:
+            if uid in self.__pending:
+                return True
+            if (self.__closed.is_set()
+                    or len(self.__pending) >= self.__maxpending):
+                self.dropped += 1
+                return False
+            self.__pending.add(uid)
+        self.__executor.submit(self.__run, uid)
+        return True
+
+    def close(self) -> None:
+        """Skip the queued lookups and wait for the running ones.
+
+        The cache is saved after that.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        self.__closed.set()
+        self.__executor.shutdown(wait=True)
+        if self.__cache is not None:
+            self.__cache.close()
+
+    def __run(self, uid: str) -> None:
+        """Retrieve a name and pass it to the callback.
+        """
+        try:
+            if self.__closed.is_set():
+                return
+            try:
+                name = self.__resolve(uid)
+            # No such user,
+            # not retrieved again until the failure expires.
+            except urllib.error.HTTPError as err:
+                if err.code == 404 and self.__cache is not None:
+                    self.__cache.put(uid, None)
+                return
+            except LookupError:
+                if self.__cache is not None:
+                    self.__cache.put(uid, None)
+                return
+            # IOError, xml.parsers.expat.ExpatError, etc...
+            # Retried by the next comment.
+            except Exception:
+                return
+            if self.__cache is not None:
+                self.__cache.put(uid, name)
+            self.__deliver(uid, name)
+        finally:
+            with self.__lock:
+                self.__pending.discard(uid)
+
+    def __deliver(self, uid: str, name: str) -> None:
+        """Pass a name to the callback.
+        """
+        try:
+            self.__callback(uid, name)
+        except Exception as err:
+            print("[ERR] nickname {0}: {1}".format(uid, err),
+                  file=sys.stderr)
+            return
+        self.resolved += 1
 
 
 def retr_name_seiga(uid: str) -> str:
@@ -112,10 +453,11 @@ def retr_name_seiga(uid: str) -> str:
     Returns:
         Retrieved username.
     """
+    # Not to send Excessive requests.
+    ratelimit.acquire("seiga")
     url = "http://seiga.nicovideo.jp/api/user/info?id={0}".format(uid)
-    req = urllib.request.Request(url)
-    with urllib.request.urlopen(req) as resp:
-        pstr = minidom.parseString(resp.read().decode("utf-8"))
+    resp = nhttp.get_client().get(url)
+    pstr = minidom.parseString(resp.text())
     nicknametag = pstr.getElementsByTagName("nickname")[0]
     return nicknametag.firstChild.data
 
@@ -137,10 +479,10 @@ def retr_name_iframe(uid: str) -> str:
         ElementTree causes a ParseError.
         lxml.html is not a stadard library.
     """
+    ratelimit.acquire("thumb_user")
     url = "http://ext.nicovideo.jp/thumb_user/{0}".format(uid)
-    req = urllib.request.Request(url)
     regex = (r'<p class="TXT12"><a href="'
              r'http://www.nicovideo.jp/user/' + uid + r'"'
              r' target="_blank"><strong>(.+)</strong></a></p>')
-    with urllib.request.urlopen(req) as resp:
-        return re.search(regex, resp.read().decode("utf-8")).group(1)
+    resp = nhttp.get_client().get(url)
+    return re.search(regex, resp.text()).group(1)
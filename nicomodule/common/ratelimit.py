@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Token bucket rate limiter of the requests to niconico."""
+
+from typing import (Dict, Optional, Tuple)
+import threading
+import time
+
+
+# Requests per second and burst by endpoint.
+BUDGETS = {
+    # seiga.nicovideo.jp/api/user/info
+    "seiga": (2.0, 4),
+    # ext.nicovideo.jp/thumb_user
+    "thumb_user": (1.0, 2),
+    # live.nicovideo.jp/api/getplayerstatus
+    "getplayerstatus": (10.0, 10)
+}  # type: Dict[str, Tuple[float, int]]
+# Budget of the endpoints not listed.
+DEFAULT_BUDGET = (1.0, 1)  # type: Tuple[float, int]
+
+_limiter = None  # type: Optional[Limiter]
+_limiterlock = threading.Lock()
+
+
+def get_limiter() -> "Limiter":
+    """Get the limiter shared in the process.
+
+    Arguments:
+        None
+
+    Returns:
+        Limiter instance with BUDGETS.
+    """
+    global _limiter
+    with _limiterlock:
+        if _limiter is None:
+            _limiter = Limiter()
+        return _limiter
+
+
+def acquire(endpoint: str) -> float:
+    """Wait for a request to the endpoint with the shared limiter.
+
+    Arguments:
+        endpoint: Name of the endpoint, like seiga.
+
+    Returns:
+        Seconds waited.
+    """
+    return get_limiter().acquire(endpoint)
+
+
+class BucketStats():
+    """Counters of a bucket.
+
+    Attributes:
+        acquired: Number of the requests let through.
+        waited: Number of the requests had to wait.
+        waiting: Number of the requests waiting now.
+        waittime: Total seconds waited.
+        maxwait: The longest seconds waited.
+    """
+    def __init__(self) -> None:
+        self.acquired = 0  # type: int
+        self.waited = 0  # type: int
+        self.waiting = 0  # type: int
+        self.waittime = 0.0  # type: float
+        self.maxwait = 0.0  # type: float
+
+    def __str__(self) -> str:
+        average = self.waittime / self.acquired if self.acquired else 0.0
+        return ("{0} requests ({1} waited, {2} waiting), "
+                "wait avg {3:.3f}s max {4:.3f}s"
+                .format(self.acquired, self.waited, self.waiting,
+                        average, self.maxwait))
+
+
+class TokenBucket():
+    """Token bucket of an endpoint.
+
+    Tokens fill at rate per second up to burst,
+    a request takes one or waits for it.
+    Waiting requests reserve the tokens in order,
+    so concurrent threads are spaced evenly. Thread safe.
+
+    Attributes:
+        rate: Tokens per second, not limited if 0 or less.
+        burst: Tokens to keep at most.
+        stats: Counters of the bucket.
+        __tokens: Current tokens, negative if reserved.
+        __last: The time __tokens was filled.
+        __lock: Lock of the tokens and stats.
+    """
+    def __init__(self, rate: float, burst: int=1) -> None:
+        """Constructor.
+
+        Arguments:
+            rate: Tokens per second, not limited if 0 or less.
+            burst: Tokens to keep at most, starts full.
+
+        Returns:
+            None
+        """
+        self.rate = rate  # type: float
+        self.burst = max(burst, 1)  # type: int
+        self.stats = BucketStats()  # type: BucketStats
+        self.__tokens = float(self.burst)
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, wait until it is filled.
+
+        Arguments:
+            None
+
+        Returns:
+            Seconds waited.
+        """
+        with self.__lock:
+            self.stats.acquired += 1
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            filled = (now - self.__last) * self.rate
+            self.__tokens = min(float(self.burst), self.__tokens + filled)
+            self.__last = now
+            self.__tokens -= 1
+            if self.__tokens >= 0:
+                return 0.0
+            wait = -self.__tokens / self.rate
+            self.stats.waited += 1
+            self.stats.waiting += 1
+            self.stats.waittime += wait
+            self.stats.maxwait = max(self.stats.maxwait, wait)
+
+        time.sleep(wait)
+        with self.__lock:
+            self.stats.waiting -= 1
+        return wait
+
+
+class Limiter():
+    """Token buckets by endpoint.
+
+    Attributes:
+        __budgets: Rate and burst by endpoint.
+        __buckets: Bucket by endpoint, made on the first request.
+        __lock: Lock of __buckets.
+    """
+    def __init__(self,
+                 budgets: Optional[Dict[str, Tuple[float, int]]]=None
+                 ) -> None:
+        """Constructor.
+
+        Arguments:
+            budgets: Rate and burst by endpoint, BUDGETS by default.
+
+        Returns:
+            None
+        """
+        self.__budgets = dict(BUDGETS if budgets is None else budgets)
+        self.__buckets = {}  # type: Dict[str, TokenBucket]
+        self.__lock = threading.Lock()
+
+    def __str__(self) -> str:
+        with self.__lock:
+            buckets = sorted(self.__buckets.items())
+        return "\n".join("{0}: {1}".format(endpoint, bucket.stats)
+                         for endpoint, bucket in buckets)
+
+    def configure(self, endpoint: str, rate: float, burst: int) -> None:
+        """Change the budget of an endpoint.
+
+        Arguments:
+            endpoint: Name of the endpoint, like seiga.
+            rate: Requests per second, not limited if 0 or less.
+            burst: Requests to let through at once.
+
+        Returns:
+            None
+        """
+        with self.__lock:
+            self.__budgets[endpoint] = (rate, burst)
+            # Start over with the new budget.
+            self.__buckets.pop(endpoint, None)
+
+    def bucket(self, endpoint: str) -> TokenBucket:
+        """Get the bucket of an endpoint.
+
+        Arguments:
+            endpoint: Name of the endpoint, like seiga.
+
+        Returns:
+            TokenBucket of the endpoint.
+        """
+        with self.__lock:
+            bucket = self.__buckets.get(endpoint)
+            if bucket is None:
+                rate, burst = self.__budgets.get(endpoint, DEFAULT_BUDGET)
+                bucket = TokenBucket(rate, burst)
+                self.__buckets[endpoint] = bucket
+            return bucket
+
+    def acquire(self, endpoint: str) -> float:
+        """Wait for a request to the endpoint.
+
+        Arguments:
+            endpoint: Name of the endpoint, like seiga.
+
+        Returns:
+            Seconds waited.
+        """
+        return self.bucket(endpoint).acquire()
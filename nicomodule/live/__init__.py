@@ -1,5 +1,6 @@
 from . import niconnect
 from . import pstat
 from . import cparser
+from . import cserver
 
-__all__ = ["pstat", "niconnect", "cparser"]
+__all__ = ["pstat", "niconnect", "cparser", "cserver"]
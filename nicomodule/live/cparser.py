@@ -2,21 +2,480 @@
 # -*- coding: utf-8 -*-
 """Comment displaying format."""
 
-from typing import Dict
+from typing import (Callable, Dict, Iterable, Iterator, List, Mapping,
+                    Optional, Union)
 from xml.dom import minidom
+import operator
+import re
+import sys
 import xml.parsers.expat
 
 
-def parse_comment(dom: str) -> Dict[str, str]:
+# Characters not allowed or normalized by xml parser.
+_ODD = re.compile("[\x00-\x08\x0b-\x1f\ufffe\uffff]")
+_ODD_ATTR = re.compile("[\x00-\x1f\ufffe\uffff]")
+_BADREF = re.compile(r"&(?!(?:lt|gt|amp|quot|apos);)")
+_THREAD = re.compile(r'<thread(?: +[A-Za-z_][A-Za-z0-9_.-]*="[^"<&]*")* */>\Z')
+# Attribute names joined with double quotes, like ' no=" date=" '.
+_KEYS = re.compile(r'(?: +[A-Za-z_][A-Za-z0-9_.-]*=")* *\Z')
+_ENTITY = re.compile(r"&(lt|gt|amp|quot|apos);")
+_ENTITIES = {
+    "lt": "<",
+    "gt": ">",
+    "amp": "&",
+    "quot": '"',
+    "apos": "'"
+}
+# Bytes of a frame at most, longer ones are dropped.
+MAX_FRAME = 65536
+# Attributes to parse, and default values of missing ones.
+# KeyError occurs on official programs without "no".
+# Free members don't have premium key.
+# ID users don't have anonymity key.
+# Owner don't has locale key.
+# If score is 0, dont have score key.
+_FIELDS = ("no", "date", "user_id", "premium", "anonymity", "locale", "score")
+_DEFAULTS = ("-", None, None, "0", "0", "ja-jp", "0")
+# Getters of the fields by the joined keys.
+_getters = {}  # type: Dict[str, Optional[Callable]]
+# Keys of the dict view by tag.
+_VIEWKEYS = {
+    "chat": ("tag", "no", "time", "id", "premium", "anonymity",
+             "locale", "score", "content"),
+    "thread": ("tag",),
+    "partial": ("tag", "data")
+}
+
+
+class Comment(Mapping[str, str]):
+    """Parsed comment data.
+
+    Typed and compact record of a chat tag,
+    numbers are converted once and the userID is interned.
+    It is also read as the former dict of strings,
+    like parsed["time"], parsed["anonymity"] == "0",
+    and parsed["nickname"] can be assigned.
+
+    Attributes:
+        tag: chat, thread or partial.
+        no: Comment number, None on official programs.
+        date: The UnixTime posted.
+        user_id: The commented user id.
+        premium: 0: free, 1: premium, 2: admin, 3: owner, 7: BSP etc.
+        anonymity: Whether it is 184(anonymous) comment.
+        locale: Locale of the user.
+        score: NG score, 0 or negative.
+        content: Comment content.
+        nickname: Display name, None until assigned.
+        data: Dom strings if tag is partial,
+              or the raw frame kept by ChatStreamParser.
+    """
+    __slots__ = ("tag", "no", "date", "user_id", "premium", "anonymity",
+                 "locale", "score", "content", "nickname", "data")
+
+    def __init__(self,
+                 tag: str,
+                 no: Optional[int]=None,
+                 date: int=0,
+                 user_id: str="",
+                 premium: int=0,
+                 anonymity: bool=False,
+                 locale: str="ja-jp",
+                 score: int=0,
+                 content: str="",
+                 data: str="") -> None:
+        self.tag = tag  # type: str
+        self.no = no  # type: Optional[int]
+        self.date = date  # type: int
+        self.user_id = sys.intern(user_id)  # type: str
+        self.premium = premium  # type: int
+        self.anonymity = anonymity  # type: bool
+        self.locale = locale  # type: str
+        self.score = score  # type: int
+        self.content = content  # type: str
+        self.nickname = None  # type: Optional[str]
+        self.data = data  # type: str
+
+    @classmethod
+    def from_strings(cls,
+                     no: str,
+                     date: str,
+                     userid: str,
+                     premium: str,
+                     anonymity: str,
+                     locale: str,
+                     score: str,
+                     content: str) -> "Comment":
+        """Make a chat record from attribute strings.
+        """
+        return cls("chat",
+                   None if no == "-" else int(no),
+                   int(date),
+                   userid,
+                   int(premium),
+                   anonymity != "0",
+                   locale,
+                   int(score),
+                   content)
+
+    @classmethod
+    def from_dict(cls, parsed: Dict[str, str]) -> "Comment":
+        """Make a record from the former dict.
+        """
+        if parsed["tag"] == "chat":
+            return cls.from_strings(parsed["no"],
+                                    parsed["time"],
+                                    parsed["id"],
+                                    parsed["premium"],
+                                    parsed["anonymity"],
+                                    parsed["locale"],
+                                    parsed["score"],
+                                    parsed["content"])
+        return cls(parsed["tag"], data=parsed.get("data", ""))
+
+    def __getitem__(self, key: str) -> str:
+        if key not in self._keys():
+            raise KeyError(key)
+        if key == "tag":
+            return self.tag
+        elif key == "no":
+            return "-" if self.no is None else str(self.no)
+        elif key == "time":
+            return str(self.date)
+        elif key == "id":
+            return self.user_id
+        elif key == "premium":
+            return str(self.premium)
+        elif key == "anonymity":
+            return "1" if self.anonymity else "0"
+        elif key == "score":
+            return str(self.score)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: str) -> None:
+        if key != "nickname":
+            raise KeyError(key)
+        self.nickname = value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def _keys(self) -> tuple:
+        keys = _VIEWKEYS[self.tag]
+        if self.nickname is not None:
+            keys += ("nickname",)
+        return keys
+
+    def __repr__(self) -> str:
+        return "Comment({0!r})".format(dict(self))
+
+
+class ChatStreamParser():
+    """Incremental parser of the comment server stream.
+
+    Feed received bytes as they are, and get chat/thread records
+    as soon as each element closes.
+    Bytes are decoded by expat incrementally,
+    so a multibyte character splitted across receives is not lost,
+    and no string is made per frame.
+    The frames are parsed as children of a synthetic root element.
+    A malformed frame is skipped until the next null string,
+    so is a frame longer than limit, not to grow without bound.
+
+    Attributes:
+        errors: Number of skipped frames.
+        __limit: Bytes of a frame at most.
+        __size: Bytes since the last null string.
+        __keepraw: Whether to keep the raw frame in Comment.data.
+        __parser: The expat parser.
+        __depth: Depth of the current element, 0 between frames.
+        __attrs: Attributes of the current frame.
+        __text: Character data of the current frame.
+        __skip: Whether skipping until the next null string.
+        __raw: Bytes of the current frame if keepraw.
+        __pending: Records waiting for the null string if keepraw.
+        __parsed: Records completed in the current feed.
+    """
+    def __init__(self, keepraw: bool=False, limit: int=MAX_FRAME) -> None:
+        """Constructor.
+
+        Arguments:
+            keepraw: Keep the decoded frame in Comment.data, for logging.
+                     Records are returned when the frame is terminated.
+            limit: Bytes of a frame at most, like FrameBuffer.
+
+        Returns:
+            None
+        """
+        self.errors = 0  # type: int
+        self.__limit = limit
+        self.__size = 0
+        self.__keepraw = keepraw
+        self.__raw = bytearray()
+        self.__pending = []  # type: List[Comment]
+        self.__parsed = []  # type: List[Comment]
+        self.__reset()
+
+    def __reset(self) -> None:
+        """Start a new expat parser with the synthetic root.
+        """
+        parser = xml.parsers.expat.ParserCreate("UTF-8")
+        parser.buffer_text = True
+        parser.StartElementHandler = self.__start
+        parser.EndElementHandler = self.__end
+        parser.CharacterDataHandler = self.__chardata
+        self.__parser = parser
+        self.__depth = -1
+        self.__attrs = {}  # type: Dict[str, str]
+        self.__text = []  # type: List[str]
+        self.__skip = False
+        del self.__raw[:]
+        self.__pending = []
+        # The synthetic root makes the depth 0.
+        parser.Parse(b"<stream>", False)
+
+    def feed(self,
+             data: Union[bytes, bytearray],
+             size: Optional[int]=None) -> List[Comment]:
+        """Parse received bytes.
+
+        Arguments:
+            data: Received bytes, null strings terminate frames.
+            size: Length of the received data,
+                  if data is a reusable buffer.
+
+        Returns:
+            Records of the elements closed in this data.
+        """
+        view = memoryview(data)
+        if size is None:
+            size = len(data)
+        start = 0
+        while start < size:
+            idx = data.find(b"\x00", start, size)
+            end = size if idx < 0 else idx
+            if end > start and not self.__skip:
+                self.__parse(view[start:end])
+            if idx < 0:
+                break
+            self.__terminate()
+            start = idx + 1
+        view.release()
+
+        parsed = self.__parsed
+        self.__parsed = []
+        return parsed
+
+    def __parse(self, segment: memoryview) -> None:
+        """Feed a segment without null string to expat.
+        """
+        self.__size += len(segment)
+        if self.__size > self.__limit:
+            # Too long, or never terminated.
+            self.errors += 1
+            self.__reset()
+            self.__skip = True
+            return
+        if self.__keepraw:
+            self.__raw += segment
+        try:
+            self.__parser.Parse(segment, False)
+        except xml.parsers.expat.ExpatError:
+            self.errors += 1
+            self.__reset()
+            self.__skip = True
+
+    def __terminate(self) -> None:
+        """Handle the null string which terminates a frame.
+        """
+        self.__size = 0
+        if self.__skip:
+            self.__skip = False
+        elif self.__depth != 0:
+            # Truncated frame.
+            self.errors += 1
+            self.__reset()
+        elif self.__keepraw:
+            raw = self.__raw.decode("utf-8", "replace")
+            for parsed in self.__pending:
+                parsed.data = raw
+            self.__parsed.extend(self.__pending)
+            self.__pending = []
+            del self.__raw[:]
+
+    def __start(self, name: str, attrs: Dict[str, str]) -> None:
+        self.__depth += 1
+        if self.__depth == 1:
+            self.__attrs = attrs
+            self.__text = []
+
+    def __chardata(self, data: str) -> None:
+        if self.__depth > 0:
+            self.__text.append(data)
+
+    def __end(self, name: str) -> None:
+        self.__depth -= 1
+        if self.__depth != 0:
+            return
+        if name == "chat":
+            attrs = self.__attrs
+            try:
+                parsed = Comment.from_strings(attrs.get("no", "-"),
+                                              attrs["date"],
+                                              attrs["user_id"],
+                                              attrs.get("premium", "0"),
+                                              attrs.get("anonymity", "0"),
+                                              attrs.get("locale", "ja-jp"),
+                                              attrs.get("score", "0"),
+                                              "".join(self.__text))
+            except (KeyError, ValueError):
+                self.errors += 1
+                return
+        elif name == "thread":
+            parsed = Comment("thread")
+        else:
+            return
+
+        if self.__keepraw:
+            self.__pending.append(parsed)
+        else:
+            self.__parsed.append(parsed)
+
+
+def parse_comment(dom: str) -> Comment:
     """Parse comment tag.
 
-    Parse comment tag to dict.
-    The "tag" attribute of dict indicating data type.
+    Parse comment tag to Comment.
+    The "tag" attribute indicating data type.
         thread -> Initial received data.
         chat -> Chat data.
         partial -> Not the complete dom,
                    so concatinating is needed.
 
+    Well-formed chat/thread tags are parsed without minidom,
+    others fall back to minidom with the same result.
+
+    Arguments:
+        dom: Dom strings of chat data.
+
+    Returns:
+        Comment of parsed comment or other tag.
+    """
+    if dom.startswith("<chat ") and dom.endswith("</chat>"):
+        resp = _parse_chat(dom)
+        if resp is not None:
+            return resp
+    elif _THREAD.match(dom):
+        return Comment("thread")
+    return Comment.from_dict(_parse_dom(dom))
+
+
+def parse_comments(doms: Iterable[str]) -> List[Comment]:
+    """Parse comment tags at once.
+
+    Use for the backlog and the frames of a receive.
+
+    Arguments:
+        doms: Dom strings of chat data.
+
+    Returns:
+        Comments in the same order, see parse_comment.
+    """
+    parse = parse_comment
+    return [parse(dom) for dom in doms]
+
+
+def _parse_chat(dom: str) -> Optional[Comment]:
+    """Parse well-formed chat tag.
+
+    Arguments:
+        dom: Dom strings of chat data.
+
+    Returns:
+        Comment of parsed chat, None if minidom is needed.
+    """
+    end = dom.find(">")
+    attrsrc = dom[5:end]
+    content = dom[end + 1:-7]
+    if "<" in attrsrc or "<" in content or not content:
+        return None
+    if not dom.isprintable():
+        # Whitespaces in attributes are normalized by xml parser.
+        if _ODD_ATTR.search(attrsrc) or _ODD.search(content):
+            return None
+    hasref = "&" in dom
+    if hasref and _BADREF.search(dom):
+        return None
+    if "]]>" in content:
+        return None
+
+    # Splitted to keys(' name=') and values alternately.
+    # ">" in a value makes odd pieces.
+    pieces = attrsrc.split('"')
+    if len(pieces) % 2 == 0:
+        return None
+    keys = '"'.join(pieces[0::2])
+    try:
+        getter = _getters[keys]
+    except KeyError:
+        getter = _gen_getter(keys)
+    if getter is None:
+        return None
+
+    values = pieces[1::2]
+    values.extend(_DEFAULTS)
+    commentno, date, userid, premium, anonymity, locale, score = (
+        getter(values))
+    if hasref:
+        if "&" in attrsrc:
+            commentno, date, userid, premium, anonymity, locale, score = (
+                map(_unescape, (commentno, date, userid, premium,
+                                anonymity, locale, score)))
+        content = _unescape(content)
+
+    return Comment.from_strings(commentno, date, userid, premium,
+                                anonymity, locale, score, content)
+
+
+def _gen_getter(keys: str) -> Optional[Callable]:
+    """Generate the getter of fields for the attribute names.
+
+    Arguments:
+        keys: Attribute names joined with double quotes.
+
+    Returns:
+        itemgetter of the fields from the values followed by _DEFAULTS.
+        None if minidom is needed.
+    """
+    getter = None
+    names = keys.replace('="', " ").split()
+    if _KEYS.match(keys) is not None and len(set(names)) == len(names):
+        if "date" in names and "user_id" in names:
+            indexes = [names.index(field) if field in names
+                       else len(names) + idx
+                       for idx, field in enumerate(_FIELDS)]
+            getter = operator.itemgetter(*indexes)
+
+    if len(_getters) > 1024:
+        _getters.clear()
+    _getters[keys] = getter
+    return getter
+
+
+def _unescape(text: str) -> str:
+    """Replace predefined xml entities.
+    """
+    if "&" not in text:
+        return text
+    return _ENTITY.sub(lambda m: _ENTITIES[m.group(1)], text)
+
+
+def _parse_dom(dom: str) -> Dict[str, str]:
+    """Parse comment tag with minidom.
+
     Arguments:
         dom: Dom strings of chat data.
 
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Local stand-in comment server for throughput testing."""
+
+from typing import (List, Optional, Tuple)
+from xml.sax.saxutils import escape
+import argparse
+import random
+import re
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+
+def _main() -> None:
+    parsedArgs = parse_args()
+    conf = StreamConfig(count=parsedArgs.count,
+                        rate=parsedArgs.rate,
+                        burst=parsedArgs.burst,
+                        backlog=parsedArgs.backlog,
+                        fragment=parsedArgs.fragment,
+                        multibyte=parsedArgs.multibyte,
+                        anonymous=parsedArgs.anonymous,
+                        disconnect=not parsedArgs.no_disconnect,
+                        seed=parsedArgs.seed)
+
+    with CommentServer(conf, parsedArgs.host, parsedArgs.port) as server:
+        addr, port = server.address
+        if parsedArgs.status_xml:
+            with open(parsedArgs.status_xml, "w") as xmlopen:
+                xmlopen.write(gen_player_status(addr, port, conf.thread))
+        print("[INFO] listening on {0}:{1}".format(addr, port),
+              file=sys.stderr)
+        finished = 0
+        while True:
+            finished += 1
+            print(server.wait_report(finished), file=sys.stderr)
+
+
+def parse_args() -> argparse.Namespace:
+    argParser = argparse.ArgumentParser(description=__doc__, add_help=True)
+    argParser.add_argument(
+        "--host",
+        help="address to listen",
+        default="127.0.0.1")
+    argParser.add_argument(
+        "--port",
+        help="port to listen, 0 is any free port",
+        default=0,
+        type=int)
+    argParser.add_argument(
+        "--count",
+        help="number of live comments to send",
+        default=10000,
+        type=int)
+    argParser.add_argument(
+        "--rate",
+        help="comments per second, 0 is as fast as possible",
+        default=0.0,
+        type=float)
+    argParser.add_argument(
+        "--burst",
+        help="comments sent together",
+        default=1,
+        type=int)
+    argParser.add_argument(
+        "--backlog",
+        help="past comments available for res_from",
+        default=1000,
+        type=int)
+    argParser.add_argument(
+        "--fragment",
+        help="split sending data into pieces up to this bytes, 0 is off",
+        default=0,
+        type=int)
+    argParser.add_argument(
+        "--multibyte",
+        help="ratio of comments with japanese/emoji content [0-1]",
+        default=0.5,
+        type=float)
+    argParser.add_argument(
+        "--anonymous",
+        help="ratio of comments by 184 users [0-1]",
+        default=0.7,
+        type=float)
+    argParser.add_argument(
+        "--no-disconnect",
+        help="don't send /disconnect at the end",
+        action="store_true")
+    argParser.add_argument(
+        "--seed",
+        help="random seed of the content",
+        default=0,
+        type=int)
+    argParser.add_argument(
+        "--status-xml",
+        help="write getplayerstatus.xml to connect this server")
+    return argParser.parse_args()
+
+
+class StreamConfig():
+    """Settings of the comment stream.
+
+    Attributes:
+        thread: Thread number.
+        count: Number of live comments sent after the backlog.
+        rate: Comments per second, 0 is as fast as possible.
+        burst: Comments sent together every 1 / rate * burst seconds.
+        backlog: Past comments available for res_from.
+        fragment: Split data into pieces up to this bytes, 0 is off.
+        multibyte: Ratio of comments with japanese/emoji content.
+        anonymous: Ratio of comments by 184 users.
+        disconnect: Whether to send /disconnect at the end.
+        seed: Random seed of the content.
+        start: The time program started.
+    """
+    def __init__(self,
+                 thread: int=1,
+                 count: int=10000,
+                 rate: float=0.0,
+                 burst: int=1,
+                 backlog: int=1000,
+                 fragment: int=0,
+                 multibyte: float=0.5,
+                 anonymous: float=0.7,
+                 disconnect: bool=True,
+                 seed: int=0,
+                 start: int=1500000000) -> None:
+        self.thread = thread  # type: int
+        self.count = count  # type: int
+        self.rate = rate  # type: float
+        self.burst = max(burst, 1)  # type: int
+        self.backlog = backlog  # type: int
+        self.fragment = fragment  # type: int
+        self.multibyte = multibyte  # type: float
+        self.anonymous = anonymous  # type: float
+        self.disconnect = disconnect  # type: bool
+        self.seed = seed  # type: int
+        self.start = start  # type: int
+
+
+class DrainReport():
+    """Result of a connection.
+
+    Attributes:
+        comments: Number of comments sent, including the backlog.
+        nbytes: Number of bytes sent.
+        sent: Seconds to send all comments.
+        drained: Seconds until the client closed the connection.
+    """
+    def __init__(self,
+                 comments: int,
+                 nbytes: int,
+                 sent: float,
+                 drained: float) -> None:
+        self.comments = comments  # type: int
+        self.nbytes = nbytes  # type: int
+        self.sent = sent  # type: float
+        self.drained = drained  # type: float
+
+    @property
+    def rate(self) -> float:
+        """Comments per second the client drained.
+        """
+        if self.drained <= 0:
+            return float("inf")
+        return self.comments / self.drained
+
+    def __str__(self) -> str:
+        return ("[INFO] {0} comments ({1} bytes): sent {2:.3f}s, "
+                "drained {3:.3f}s, {4:.0f} comments/s"
+                .format(self.comments,
+                        self.nbytes,
+                        self.sent,
+                        self.drained,
+                        self.rate))
+
+
+class CommentServer():
+    """Local comment server.
+
+    Speak the thread handshake, then send chat tags
+    splitted with null string like the comment server.
+    Serve in a background thread, use with context to stop surely.
+
+    Attributes:
+        conf: Settings of the comment stream.
+        reports: Drain reports of finished connections.
+        __server: Listening TCP server.
+        __done: Condition notified when a report is added.
+    """
+    def __init__(self,
+                 conf: Optional[StreamConfig]=None,
+                 host: str="127.0.0.1",
+                 port: int=0) -> None:
+        """Constructor.
+
+        Arguments:
+            conf: Settings of the comment stream.
+            host: Address to listen.
+            port: Port to listen, 0 is any free port.
+
+        Returns:
+            None
+        """
+        self.conf = conf or StreamConfig()  # type: StreamConfig
+        self.reports = []  # type: List[DrainReport]
+        self.__done = threading.Condition()
+        self.__server = _TCPServer((host, port), _StreamHandler)
+        self.__server.owner = self
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.__server.server_address[:2]
+
+    def start(self) -> None:
+        """Serve in a background thread.
+        """
+        thread = threading.Thread(target=self.__server.serve_forever,
+                                  daemon=True)
+        thread.start()
+
+    def stop(self) -> None:
+        """Stop serving.
+        """
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def add_report(self, report: DrainReport) -> None:
+        with self.__done:
+            self.reports.append(report)
+            self.__done.notify_all()
+
+    def wait_report(self,
+                    count: int=1,
+                    timeout: Optional[float]=None) -> Optional[DrainReport]:
+        """Wait until the count of connections finished.
+
+        Arguments:
+            count: Number of reports to wait for.
+            timeout: Seconds to wait, None is forever.
+
+        Returns:
+            The latest report, None if timed out.
+        """
+        with self.__done:
+            if not self.__done.wait_for(lambda: len(self.reports) >= count,
+                                        timeout):
+                return None
+            return self.reports[-1]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, extype, exvalue, traceback) -> None:
+        self.stop()
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    owner = None  # type: CommentServer
+
+
+class _StreamHandler(socketserver.BaseRequestHandler):
+    """Send the comment stream to a client.
+    """
+    def handle(self) -> None:
+        owner = self.server.owner  # type: CommentServer
+        conf = owner.conf
+        sock = self.request  # type: socket.socket
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        resfrom = read_thread_tag(sock)
+        if resfrom is None:
+            return
+        rand = random.Random(conf.seed)
+        sender = _Sender(sock, conf.fragment, rand)
+
+        lastres = conf.backlog
+        sender.send(('<thread resultcode="0" thread="{0}" last_res="{1}" '
+                     'ticket="0x0" revision="1" server_time="{2}"/>'
+                     .format(conf.thread, lastres, conf.start))
+                    .encode("utf-8"))
+
+        # Past comments requested by res_from.
+        if resfrom < 0:
+            first = max(lastres + resfrom + 1, 1)
+        else:
+            first = max(resfrom, 1)
+        numbers = list(range(first, lastres + 1))
+
+        begin = time.perf_counter()
+        for num in numbers:
+            sender.send(gen_chat(num, conf, rand))
+        sender.flush()
+
+        interval = conf.burst / conf.rate if conf.rate > 0 else 0.0
+        nextsend = time.perf_counter()
+        live = 0
+        while live < conf.count:
+            for _ in range(min(conf.burst, conf.count - live)):
+                live += 1
+                sender.send(gen_chat(lastres + live, conf, rand))
+            if interval > 0:
+                sender.flush()
+                nextsend += interval
+                delay = nextsend - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+        sent = len(numbers) + live
+        if conf.disconnect:
+            sent += 1
+            sender.send(
+                ('<chat thread="{0}" no="{1}" vpos="0" date="{2}" '
+                 'user_id="900000000" premium="3">/disconnect</chat>'
+                 .format(conf.thread, lastres + live + 1,
+                         conf.start + lastres + live + 1))
+                .encode("utf-8"))
+        sender.flush()
+        sendtime = time.perf_counter() - begin
+
+        # The client closes the connection after reading all.
+        try:
+            while sock.recv(4096):
+                pass
+        except OSError:
+            pass
+        drained = time.perf_counter() - begin
+        owner.add_report(DrainReport(sent, sender.nbytes, sendtime, drained))
+
+
+class _Sender():
+    """Send frames, fragmented if needed.
+    """
+    def __init__(self,
+                 sock: socket.socket,
+                 fragment: int,
+                 rand: random.Random) -> None:
+        self.nbytes = 0
+        self.__sock = sock
+        self.__fragment = fragment
+        self.__rand = rand
+        self.__pending = bytearray()
+
+    def send(self, frame: bytes) -> None:
+        self.__pending += frame
+        self.__pending += b"\x00"
+        if len(self.__pending) >= 4096:
+            self.flush()
+
+    def flush(self) -> None:
+        data = bytes(self.__pending)
+        self.__pending.clear()
+        self.nbytes += len(data)
+        try:
+            if self.__fragment <= 0:
+                self.__sock.sendall(data)
+                return
+            idx = 0
+            while idx < len(data):
+                size = self.__rand.randint(1, self.__fragment)
+                self.__sock.sendall(data[idx:idx + size])
+                idx += size
+        except OSError:
+            pass
+
+
+def read_thread_tag(sock: socket.socket) -> Optional[int]:
+    """Read the thread tag sent by the client.
+
+    Arguments:
+        sock: Connected socket.
+
+    Returns:
+        The res_from value, None if it is invalid.
+    """
+    data = b""
+    sock.settimeout(10)
+    try:
+        while not data.endswith(b"\x00"):
+            chunk = sock.recv(1024)
+            if not chunk:
+                return None
+            data += chunk
+    except OSError:
+        return None
+    finally:
+        sock.settimeout(None)
+
+    match = re.search(rb'res_from="(-?[0-9]+)"', data)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+_WORDS = ("こんばんは", "ｗｗｗ", "8888", "草", "初見", "かわいい",
+          "\U0001F600", "\U0001F389", "\U0001F44D", "ｷﾀ━━━━(ﾟ∀ﾟ)━━━━!!")
+_ASCII = ("hello", "lol", "nice", "gg", "wwww", "<3", "a & b", "\"quote\"")
+
+
+def gen_chat(num: int, conf: StreamConfig, rand: random.Random) -> bytes:
+    """Generate a chat tag.
+
+    Arguments:
+        num: Comment number.
+        conf: Settings of the comment stream.
+        rand: Random generator of the content.
+
+    Returns:
+        Encoded chat tag.
+    """
+    if rand.random() < conf.multibyte:
+        words = _WORDS
+    else:
+        words = _ASCII
+    content = " ".join(rand.choice(words)
+                       for _ in range(rand.randint(1, 4)))
+
+    attrs = ['thread="{0}"'.format(conf.thread),
+             'no="{0}"'.format(num),
+             'vpos="{0}"'.format(num * 100),
+             'date="{0}"'.format(conf.start + num)]
+    if rand.random() < conf.anonymous:
+        attrs.append('mail="184"')
+        attrs.append('user_id="{0:027x}"'.format(rand.getrandbits(100)))
+        attrs.append('anonymity="1"')
+    else:
+        attrs.append('user_id="{0}"'.format(rand.randint(1, 99999999)))
+    if rand.random() < 0.3:
+        attrs.append('premium="1"')
+    if rand.random() < 0.1:
+        attrs.append('score="-{0}"'.format(rand.randint(1, 5000)))
+
+    return ("<chat {0}>{1}</chat>".format(" ".join(attrs), escape(content))
+            .encode("utf-8"))
+
+
+def gen_player_status(addr: str,
+                      port: int,
+                      thread: int,
+                      lvid: str="lv1",
+                      start: int=1500000000) -> str:
+    """Generate getplayerstatus.xml to connect the server.
+
+    Arguments:
+        addr: Server address.
+        port: Server port number.
+        thread: Thread number.
+        lvid: Content id.
+        start: The time program started.
+
+    Returns:
+        Text content of getplayerstatus.xml.
+    """
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<getplayerstatus status="ok" time="{4}">'
+            '<stream><id>{3}</id><title>local</title>'
+            '<start_time>{4}</start_time>'
+            '<default_community>co1</default_community>'
+            '<owner_name>local</owner_name></stream>'
+            '<user><room_seetno>1</room_seetno></user>'
+            '<rtmp><url>rtmp://127.0.0.1/</url><ticket>0</ticket></rtmp>'
+            '<ms><addr>{0}</addr><port>{1}</port><thread>{2}</thread></ms>'
+            '</getplayerstatus>'
+            .format(addr, port, thread, lvid, start))
+
+
+if __name__ == "__main__":
+    _main()
@@ -2,8 +2,15 @@
 # -*- coding: utf-8 -*-
 """Connect to the comment server."""
 
-from typing import (List, Iterable)
+from typing import (AsyncIterator, Callable, Deque, List, Iterable,
+                    Optional, Set, Union)
+import asyncio
+import collections
+import re
 import socket
+import time
+
+from .cparser import (MAX_FRAME, ChatStreamParser, Comment)
 
 
 class MsgSocket():
@@ -32,7 +39,8 @@ class MsgSocket():
                 addr: str,
                 port: int,
                 thread: int,
-                log: int=20) -> socket.socket:
+                log: int=20,
+                resfrom: Optional[int]=None) -> socket.socket:
         """Connect to comment server.
 
         Connect to server, then send initial data to
@@ -43,16 +51,11 @@ class MsgSocket():
             port: Comment server's port number.
             thread: Comment server's thread number.
             log: Number of past comment(0<= x <=1000).
+            resfrom: Comment number to recieve from, instead of log.
         """
         self.__msgsock.connect((addr, port))
-
-        msgthread = str(thread)
-        resfrom = str(log)
-        initsend = ('<thread thread="{}" version="20061206" res_from="-{}"/>'
-                    .format(msgthread, resfrom))
-        endbyte = b"\x00"
-        self.__msgsock.send(initsend.encode("utf-8"))
-        self.__msgsock.send(endbyte)
+        set_keepalive(self.__msgsock)
+        self.__msgsock.sendall(gen_thread_tag(thread, log, resfrom))
 
         return self.__msgsock
 
@@ -77,7 +80,8 @@ class MsgSocket():
         """Yield comment data.
 
         Yield comment dom data recieved from socket.
-        This works as generator.
+        This works as generator,
+        and stops when the server closed the connection.
 
         Argument:
             None
@@ -85,22 +89,61 @@ class MsgSocket():
         Returns:
             List of comment dom strings.
         """
-        partstr = None
+        framebuf = FrameBuffer()
         while True:
-            rawdata = self.receive()
-            for rawdatum in rawdata:
-                if partstr:
-                    rawdatum = partstr + rawdatum
-                    partstr = None
-
-                if rawdatum.endswith(b"</chat>"):
-                    # TODO: fix FC on Windows with emojis.
-                    yield rawdatum.decode("utf-8", "ignore")
-                # thread tag ends with "/>"
-                elif rawdatum.endswith(b"/>"):
-                    yield rawdatum.decode("utf-8")
-                else:
-                    partstr = rawdatum
+            nbytes = self.__msgsock.recv_into(framebuf.reserve())
+            if nbytes == 0:
+                return
+            framebuf.commit(nbytes)
+            for frame in framebuf.frames():
+                comment = decode_frame(frame)
+                if comment is not None:
+                    yield comment
+
+    def recv_events(self,
+                    keepraw: bool=False,
+                    buffer: int=65536) -> Iterable[Comment]:
+        """Yield parsed chat/thread records.
+
+        Received bytes are fed to ChatStreamParser as they are,
+        without splitting and decoding each frame.
+        This works as generator,
+        and stops when the server closed the connection.
+
+        Argument:
+            keepraw: Keep the decoded frame in Comment.data.
+            buffer: The buffer size for recieving data.
+
+        Returns:
+            Comment records.
+        """
+        for batch in self.recv_batches(keepraw, buffer):
+            yield from batch
+
+    def recv_batches(self,
+                     keepraw: bool=False,
+                     buffer: int=65536) -> Iterable[List[Comment]]:
+        """Yield parsed records per receive.
+
+        The backlog arrives in a few large receives,
+        so it can be handled in a few batches.
+
+        Argument:
+            keepraw: Keep the decoded frame in Comment.data.
+            buffer: The buffer size for recieving data.
+
+        Returns:
+            Lists of Comment records, not empty.
+        """
+        parser = ChatStreamParser(keepraw)
+        rawbuf = bytearray(buffer)
+        while True:
+            nbytes = self.__msgsock.recv_into(rawbuf)
+            if nbytes == 0:
+                return
+            batch = parser.feed(rawbuf, nbytes)
+            if batch:
+                yield batch
 
     def close(self) -> None:
         """Close socket.
@@ -120,3 +163,660 @@ class MsgSocket():
 
     def __exit__(self, extype, exvalue, traceback) -> None:
         self.close()
+
+
+class AsyncMsgSocket():
+    """Asyncio socket handling class.
+
+    The asyncio counterpart of MsgSocket.
+    Many connections can share one event loop.
+    Use with async context to call close surely.
+
+    Attributes:
+        __reader: Stream reader from comment server.
+        __writer: Stream writer to comment server.
+    """
+    def __init__(self) -> None:
+        """Constructor.
+
+        The connection is opened by connect().
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        self.__reader = None  # type: Optional[asyncio.StreamReader]
+        self.__writer = None  # type: Optional[asyncio.StreamWriter]
+
+    async def connect(self,
+                      addr: str,
+                      port: int,
+                      thread: int,
+                      log: int=20,
+                      resfrom: Optional[int]=None) -> None:
+        """Connect to comment server.
+
+        Connect to server, then send initial data to
+        recieve comment.
+
+        Arguments:
+            addr: Comment server's host address.
+            port: Comment server's port number.
+            thread: Comment server's thread number.
+            log: Number of past comment(0<= x <=1000).
+            resfrom: Comment number to recieve from, instead of log.
+
+        Returns:
+            None
+        """
+        self.__reader, self.__writer = await asyncio.open_connection(
+            addr, port)
+        set_keepalive(self.__writer.get_extra_info("socket"))
+        self.__writer.write(gen_thread_tag(thread, log, resfrom))
+        await self.__writer.drain()
+
+    async def receive(self, buffer: int=4096) -> List[bytes]:
+        """Recieve comment data.
+
+        Recieve comment data from stream.
+        Split data with null string.
+
+        Argument:
+            buffer: The buffer size for recieving data.
+
+        Returns:
+            Splitted comment data with null string.
+            Empty list if the server closed the connection.
+        """
+        endbyte = b"\x00"
+
+        rawdata = await self.__reader.read(buffer)
+        if not rawdata:
+            return []
+        return rawdata.split(endbyte)
+
+    async def recv_comments(self) -> AsyncIterator[str]:
+        """Yield comment data.
+
+        Yield comment dom data recieved from stream.
+        This works as async generator,
+        and stops when the server closed the connection.
+
+        Argument:
+            None
+
+        Returns:
+            Async iterator of comment dom strings.
+        """
+        framebuf = FrameBuffer()
+        while True:
+            space = framebuf.reserve()
+            rawdata = await self.__reader.read(len(space))
+            if not rawdata:
+                return
+            space[:len(rawdata)] = rawdata
+            framebuf.commit(len(rawdata))
+            for frame in framebuf.frames():
+                comment = decode_frame(frame)
+                if comment is not None:
+                    yield comment
+
+    async def recv_events(self,
+                          keepraw: bool=False,
+                          buffer: int=65536) -> AsyncIterator[Comment]:
+        """Yield parsed chat/thread records.
+
+        The asyncio counterpart of MsgSocket.recv_events.
+
+        Argument:
+            keepraw: Keep the decoded frame in Comment.data.
+            buffer: The buffer size for recieving data.
+
+        Returns:
+            Async iterator of Comment records.
+        """
+        async for batch in self.recv_batches(keepraw, buffer):
+            for parsed in batch:
+                yield parsed
+
+    async def recv_batches(self,
+                           keepraw: bool=False,
+                           buffer: int=65536) -> AsyncIterator[List[Comment]]:
+        """Yield parsed records per receive.
+
+        The asyncio counterpart of MsgSocket.recv_batches.
+
+        Argument:
+            keepraw: Keep the decoded frame in Comment.data.
+            buffer: The buffer size for recieving data.
+
+        Returns:
+            Async iterator of lists of Comment records, not empty.
+        """
+        parser = ChatStreamParser(keepraw)
+        while True:
+            rawdata = await self.__reader.read(buffer)
+            if not rawdata:
+                return
+            batch = parser.feed(rawdata)
+            if batch:
+                yield batch
+
+    def close(self) -> None:
+        """Close stream.
+
+        This is also called by async with context(__aexit__).
+
+        Arguments:
+            None
+
+        Returns:
+            None
+        """
+        if self.__writer is not None:
+            self.__writer.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, extype, exvalue, traceback) -> None:
+        self.close()
+        if self.__writer is not None:
+            try:
+                await self.__writer.wait_closed()
+            except OSError:
+                pass
+
+
+class FrameBuffer():
+    """Framing buffer for data splitted with null string.
+
+    Receive data into a reusable buffer and find null strings in place,
+    so a frame splitted across several receives is copied only once,
+    when it is yielded.
+    A frame which doesn't fit in the buffer is dropped.
+
+    Attributes:
+        dropped: Number of dropped frames.
+        __buf: Reusable receiving buffer.
+        __view: Memoryview of __buf.
+        __chunk: Minimum free space to receive into.
+        __start: Head of the frame not yielded yet.
+        __scan: Position to find the next null string from.
+        __end: Tail of the received data.
+        __discard: Whether dropping data until the next null string.
+    """
+    def __init__(self, limit: int=MAX_FRAME, chunk: int=4096) -> None:
+        """Constructor.
+
+        Arguments:
+            limit: The buffer size, frames must be shorter than this.
+            chunk: Minimum free space to receive into.
+
+        Returns:
+            None
+        """
+        self.dropped = 0  # type: int
+        self.__buf = bytearray(limit)
+        self.__view = memoryview(self.__buf)
+        self.__chunk = min(chunk, limit)
+        self.__start = 0
+        self.__scan = 0
+        self.__end = 0
+        self.__discard = False
+
+    def reserve(self) -> memoryview:
+        """Get the free space to receive data into.
+
+        The partial frame is moved to the head of the buffer
+        only when the free space is not enough.
+        If the partial frame fills the whole buffer,
+        drop it until the next null string.
+
+        Arguments:
+            None
+
+        Returns:
+            Writable memoryview, pass it to socket.recv_into etc.
+            Call commit() with the received size after writing.
+        """
+        if self.__start == self.__end:
+            self.__start = self.__scan = self.__end = 0
+        elif len(self.__buf) - self.__end < self.__chunk:
+            size = self.__end - self.__start
+            if size == len(self.__buf):
+                if not self.__discard:
+                    self.dropped += 1
+                self.__discard = True
+                self.__start = self.__scan = self.__end = 0
+            elif self.__start > 0:
+                self.__view[:size] = self.__view[self.__start:self.__end]
+                self.__scan -= self.__start
+                self.__start = 0
+                self.__end = size
+
+        return self.__view[self.__end:]
+
+    def commit(self, nbytes: int) -> None:
+        """Mark received bytes as data.
+
+        Arguments:
+            nbytes: Number of bytes written to the reserved space.
+
+        Returns:
+            None
+        """
+        self.__end += nbytes
+
+    def frames(self) -> List[bytes]:
+        """Pop complete frames.
+
+        Each byte is scanned once, empty frames are skipped.
+
+        Arguments:
+            None
+
+        Returns:
+            List of frames without null string.
+            Each frame is a bytearray copied once from the buffer.
+        """
+        buf = self.__buf
+        end = self.__end
+        idx = buf.find(b"\x00", self.__scan, end)
+        if idx < 0:
+            self.__scan = end
+            return []
+
+        frames = []
+        start = self.__start
+        if self.__discard:
+            self.__discard = False
+            start = idx + 1
+            idx = buf.find(b"\x00", start, end)
+        while idx >= 0:
+            if idx > start:
+                frames.append(buf[start:idx])
+            start = idx + 1
+            idx = buf.find(b"\x00", start, end)
+        self.__start = start
+        self.__scan = end
+        return frames
+
+
+class ResumeState():
+    """Track recieved comment numbers to resume.
+
+    Remember the highest comment number,
+    and drop comments already recieved.
+
+    Attributes:
+        lastno: The highest comment number, None if nothing recieved.
+        __seen: Recently recieved comment numbers.
+        __order: __seen in the order of arrival to bound its size.
+    """
+    nopattern = re.compile(r'<chat\s[^>]*?\bno="([0-9]+)"')
+
+    def __init__(self, size: int=4096) -> None:
+        """Constructor.
+
+        Arguments:
+            size: Number of comment numbers to remember.
+
+        Returns:
+            None
+        """
+        self.lastno = None  # type: Optional[int]
+        self.__seen = set()  # type: Set[int]
+        self.__order = collections.deque(
+            maxlen=size)  # type: Deque[int]
+
+    def accept(self, comment: Union[str, Comment]) -> bool:
+        """Check if the comment is not recieved yet.
+
+        Comments without the number(thread tag etc.) are always accepted.
+
+        Arguments:
+            comment: Dom strings or the parsed record of chat data.
+
+        Returns:
+            False if it is a duplicate, otherwise True.
+        """
+        if isinstance(comment, str):
+            match = self.nopattern.match(comment)
+            if match is None:
+                return True
+            commentno = int(match.group(1))
+        elif comment.tag == "chat" and comment.no is not None:
+            commentno = comment.no
+        else:
+            return True
+
+        if commentno in self.__seen:
+            return False
+
+        if len(self.__order) == self.__order.maxlen:
+            self.__seen.discard(self.__order[0])
+        self.__order.append(commentno)
+        self.__seen.add(commentno)
+        if self.lastno is None or commentno > self.lastno:
+            self.lastno = commentno
+        return True
+
+    def resfrom(self) -> Optional[int]:
+        """The comment number to resume from.
+
+        Arguments:
+            None
+
+        Returns:
+            The next number of lastno, None if nothing recieved.
+        """
+        if self.lastno is None:
+            return None
+        return self.lastno + 1
+
+
+class _Supervisor():
+    """Common part of the reconnecting supervisors.
+
+    Attributes:
+        state: Recieved comment numbers.
+        reconnects: Number of reconnections.
+    """
+    def __init__(self,
+                 addr: str,
+                 port: int,
+                 thread: int,
+                 log: int=20,
+                 retries: int=8,
+                 backoff: float=1.0,
+                 maxbackoff: float=60.0,
+                 notify: Optional[Callable[[int, float], None]]=None) -> None:
+        """Constructor.
+
+        Arguments:
+            addr: Comment server's host address.
+            port: Comment server's port number.
+            thread: Comment server's thread number.
+            log: Number of past comment on the first connection.
+            retries: Give up after failing this times in a row.
+            backoff: Seconds to wait before the first retry.
+            maxbackoff: Upper limit of seconds to wait.
+            notify: Called with the attempt and the seconds to wait
+                    before each retry.
+
+        Returns:
+            None
+        """
+        self.state = ResumeState()  # type: ResumeState
+        self.reconnects = 0  # type: int
+        self._addr = addr
+        self._port = port
+        self._thread = thread
+        self._log = log
+        self._retries = retries
+        self._backoff = backoff
+        self._maxbackoff = maxbackoff
+        self._notify = notify
+
+    def _delay(self, attempt: int) -> float:
+        """Seconds to wait before the attempt.
+        """
+        return min(self._backoff * 2 ** (attempt - 1), self._maxbackoff)
+
+    def _next_attempt(self, attempt: int, err: Exception) -> float:
+        """Count the failure, raise if retries are exhausted.
+
+        Arguments:
+            attempt: Failures in a row including this one.
+            err: The cause of the failure.
+
+        Returns:
+            Seconds to wait before reconnecting.
+        """
+        if attempt > self._retries:
+            raise err
+        delay = self._delay(attempt)
+        if self._notify is not None:
+            self._notify(attempt, delay)
+        self.reconnects += 1
+        return delay
+
+    def _fresh(self, received: Union[str, Comment, List[Comment]]) -> tuple:
+        """Drop the already recieved comments.
+
+        Arguments:
+            received: A comment, or a batch of them.
+
+        Returns:
+            Tuple of the comment or the batch without duplicates,
+            None if nothing is left,
+            and whether a chat is included.
+        """
+        if not isinstance(received, list):
+            if self.state.accept(received):
+                return (received, is_chat(received))
+            return (None, is_chat(received))
+
+        batch = [comment for comment in received
+                 if self.state.accept(comment)]
+        haschat = any(is_chat(comment) for comment in received)
+        return (batch or None, haschat)
+
+
+class ReconnectingMsgSocket(_Supervisor):
+    """Reconnecting supervisor of MsgSocket.
+
+    Reconnect with exponential backoff when the connection is lost,
+    and resume from the last recieved comment without duplicates.
+    """
+    def recv_comments(self) -> Iterable[str]:
+        """Yield comment data across reconnections.
+
+        Argument:
+            None
+
+        Returns:
+            Comment dom strings, without duplicates.
+        """
+        return self._supervise(MsgSocket.recv_comments)
+
+    def recv_events(self, keepraw: bool=False) -> Iterable[Comment]:
+        """Yield parsed chat/thread records across reconnections.
+
+        Argument:
+            keepraw: Keep the decoded frame in Comment.data.
+
+        Returns:
+            Comment records, without duplicates.
+        """
+        return self._supervise(lambda msgsock: msgsock.recv_events(keepraw))
+
+    def recv_batches(self,
+                     keepraw: bool=False) -> Iterable[List[Comment]]:
+        """Yield parsed records per receive across reconnections.
+
+        Argument:
+            keepraw: Keep the decoded frame in Comment.data.
+
+        Returns:
+            Lists of Comment records without duplicates, not empty.
+        """
+        return self._supervise(
+            lambda msgsock: msgsock.recv_batches(keepraw))
+
+    def _supervise(self, recv: Callable) -> Iterable:
+        """Reconnect and resume the stream given by recv.
+        """
+        attempt = 0
+        while True:
+            try:
+                with MsgSocket() as msgsock:
+                    msgsock.connect(self._addr,
+                                    self._port,
+                                    self._thread,
+                                    log=self._log,
+                                    resfrom=self.state.resfrom())
+                    for received in recv(msgsock):
+                        fresh, haschat = self._fresh(received)
+                        # The thread tag is sent even if the program ended.
+                        if haschat:
+                            attempt = 0
+                        if fresh is not None:
+                            yield fresh
+                err = ConnectionError(
+                    "connection closed")  # type: Exception
+            except OSError as oserr:
+                err = oserr
+            attempt += 1
+            time.sleep(self._next_attempt(attempt, err))
+
+
+class AsyncReconnectingMsgSocket(_Supervisor):
+    """Reconnecting supervisor of AsyncMsgSocket.
+
+    The asyncio counterpart of ReconnectingMsgSocket.
+    """
+    async def recv_comments(self) -> AsyncIterator[str]:
+        """Yield comment data across reconnections.
+
+        Argument:
+            None
+
+        Returns:
+            Async iterator of comment dom strings, without duplicates.
+        """
+        async for comment in self._supervise(AsyncMsgSocket.recv_comments):
+            yield comment
+
+    async def recv_events(self,
+                          keepraw: bool=False) -> AsyncIterator[Comment]:
+        """Yield parsed chat/thread records across reconnections.
+
+        Argument:
+            keepraw: Keep the decoded frame in Comment.data.
+
+        Returns:
+            Async iterator of Comment records, without duplicates.
+        """
+        async for parsed in self._supervise(
+                lambda msgsock: msgsock.recv_events(keepraw)):
+            yield parsed
+
+    async def recv_batches(
+            self, keepraw: bool=False) -> AsyncIterator[List[Comment]]:
+        """Yield parsed records per receive across reconnections.
+
+        Argument:
+            keepraw: Keep the decoded frame in Comment.data.
+
+        Returns:
+            Async iterator of lists of Comment records
+            without duplicates, not empty.
+        """
+        async for batch in self._supervise(
+                lambda msgsock: msgsock.recv_batches(keepraw)):
+            yield batch
+
+    async def _supervise(self, recv: Callable) -> AsyncIterator:
+        """Reconnect and resume the stream given by recv.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with AsyncMsgSocket() as msgsock:
+                    await msgsock.connect(self._addr,
+                                          self._port,
+                                          self._thread,
+                                          log=self._log,
+                                          resfrom=self.state.resfrom())
+                    async for received in recv(msgsock):
+                        fresh, haschat = self._fresh(received)
+                        # The thread tag is sent even if the program ended.
+                        if haschat:
+                            attempt = 0
+                        if fresh is not None:
+                            yield fresh
+                err = ConnectionError(
+                    "connection closed")  # type: Exception
+            except OSError as oserr:
+                err = oserr
+            attempt += 1
+            await asyncio.sleep(self._next_attempt(attempt, err))
+
+
+def is_chat(comment: Union[str, Comment]) -> bool:
+    """Check if the dom strings or the record is a chat.
+    """
+    if isinstance(comment, str):
+        return comment.startswith("<chat")
+    return comment.tag == "chat"
+
+
+def set_keepalive(sock: Optional[socket.socket]) -> None:
+    """Enable TCP keepalive.
+
+    Detect the dead connection in about 90 seconds
+    where the options are available.
+
+    Arguments:
+        sock: Connected socket.
+
+    Returns:
+        None
+    """
+    if sock is None:
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    options = (("TCP_KEEPIDLE", 60),
+               ("TCP_KEEPINTVL", 10),
+               ("TCP_KEEPCNT", 3))
+    for name, value in options:
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+def gen_thread_tag(thread: int,
+                   log: int,
+                   resfrom: Optional[int]=None) -> bytes:
+    """Generate the initial thread tag.
+
+    The first data sent to comment server,
+    terminated by null string.
+
+    Arguments:
+        thread: Comment server's thread number.
+        log: Number of past comment(0<= x <=1000).
+        resfrom: Comment number to recieve from, instead of log.
+
+    Returns:
+        Encoded thread tag.
+    """
+    if resfrom is None:
+        resfromattr = "-{}".format(log)
+    else:
+        resfromattr = str(resfrom)
+    initsend = ('<thread thread="{}" version="20061206" res_from="{}"/>'
+                .format(thread, resfromattr))
+    return initsend.encode("utf-8") + b"\x00"
+
+
+def decode_frame(rawdatum: bytes) -> Optional[str]:
+    """Decode a frame splitted with null string.
+
+    Arguments:
+        rawdatum: A frame of comment server data.
+
+    Returns:
+        Decoded dom strings.
+        None if it is not complete, so concatinating is needed.
+    """
+    if rawdatum.endswith(b"</chat>"):
+        # TODO: fix FC on Windows with emojis.
+        return rawdatum.decode("utf-8", "ignore")
+    # thread tag ends with "/>"
+    elif rawdatum.endswith(b"/>"):
+        return rawdatum.decode("utf-8")
+    return None
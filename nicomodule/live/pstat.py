@@ -2,10 +2,16 @@
 # -*- coding: utf-8 -*-
 """Parse getplayerstatus.xml."""
 
-from typing import Optional
-from urllib import request
+from typing import (Any, Dict, Iterable, List, Optional, Tuple, Union)
+from concurrent import futures
 from xml.dom import minidom
+import json
 import sys
+import time
+
+from nicomodule.common import (atomicfile,
+                               nhttp,
+                               ratelimit)
 
 
 def _main() -> None:
@@ -34,9 +40,27 @@ def _show_usage() -> None:
     print("Usage: {} getplayerstatus.xml".format(__file__), file=sys.stderr)
 
 
+STATUS_URL = "http://live.nicovideo.jp/api/getplayerstatus"
+# Types of the cached properties of the programs on air.
+_FIELDTYPES = {
+    "lvid": str,
+    "title": str,
+    "start": int,
+    "community": str,
+    "owner": str,
+    "seetno": str,
+    "ticket": str,
+    "addr": str,
+    "port": int,
+    "thread": int
+}
+
+
 def get_live_player_status(session: str, liveid: str) -> str:
     """Retrieve getplayerstatus.xml.
 
+    Exit if the request failed.
+
     Arguments:
         session: Sesseion value of user_session from cookie.
         liveid: Content id, like lv2525, co2525 and ch2525.
@@ -44,18 +68,93 @@ def get_live_player_status(session: str, liveid: str) -> str:
     Returns:
         Text content of getplayerstatus.xml's.
     """
-    baseurl = "http://live.nicovideo.jp/api/getplayerstatus"
-    url = baseurl + "?v={}".format(liveid)
-
-    req = request.Request(url)
-    req.add_header("Cookie", "user_session={}".format(session))
     try:
-        with request.urlopen(req) as resp:
-            pstat = resp.read().decode("utf-8")
+        return fetch_live_player_status(session, liveid)
     except IOError as err:
+        url = STATUS_URL + "?v={}".format(liveid)
         sys.exit("[ERR] HTTP request: {} {}".format(url, err.args))
-    else:
-        return pstat
+
+
+def fetch_live_player_status(session: str,
+                             liveid: str,
+                             limiter: Optional[ratelimit.Limiter]=None
+                             ) -> str:
+    """Retrieve getplayerstatus.xml, raise if failed.
+
+    Arguments:
+        session: Sesseion value of user_session from cookie.
+        liveid: Content id, like lv2525, co2525 and ch2525.
+        limiter: Limit the request by it, the shared one by default.
+
+    Returns:
+        Text content of getplayerstatus.xml's.
+    """
+    (limiter or ratelimit.get_limiter()).acquire("getplayerstatus")
+    url = STATUS_URL + "?v={}".format(liveid)
+    headers = {"Cookie": "user_session={}".format(session)}
+    return nhttp.get_client().get(url, headers).text()
+
+
+def resolve_statuses(session: str,
+                     liveids: Iterable[str],
+                     workers: int=8,
+                     limiter: Optional[ratelimit.Limiter]=None,
+                     cache: Optional["StatusCache"]=None
+                     ) -> Dict[str, Union["LivePlayerStatus", str]]:
+    """Retrieve and parse the statuses concurrently.
+
+    Community/channel ids are resolved to their programs on air
+    by a bounded worker pool,
+    requests are limited to the getplayerstatus budget.
+
+    Arguments:
+        session: Sesseion value of user_session from cookie.
+        liveids: Content ids, like lv2525, co2525 and ch2525.
+        workers: Number of concurrent requests.
+        limiter: Limit the requests by it, the shared one by default.
+        cache: Use and store the statuses on air.
+
+    Returns:
+        Dict by the content id,
+        LivePlayerStatus if it is on air,
+        otherwise the error code like closed and comingsoon,
+        or "error: [detail]" if the request failed.
+    """
+    results = {}  # type: Dict[str, Union[LivePlayerStatus, str]]
+    fetched = []  # type: List[Tuple[str, str, LivePlayerStatus]]
+
+    def resolve(liveid: str) -> Tuple[str, LivePlayerStatus]:
+        pstat = fetch_live_player_status(session, liveid, limiter)
+        return (pstat, LivePlayerStatus(pstat))
+
+    pending = []
+    for liveid in dict.fromkeys(liveids):
+        cached = cache.get(liveid) if cache is not None else None
+        if cached is not None:
+            results[liveid] = cached
+        else:
+            pending.append(liveid)
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        jobs = {executor.submit(resolve, liveid): liveid
+                for liveid in pending}
+        for job in futures.as_completed(jobs):
+            liveid = jobs[job]
+            try:
+                pstat, plystat = job.result()
+            # IOError, xml.parsers.expat.ExpatError, etc...
+            except Exception as err:
+                results[liveid] = "error: {}".format(err)
+                continue
+            if plystat.errcode is not None:
+                results[liveid] = plystat.errcode
+            else:
+                results[liveid] = plystat
+                fetched.append((liveid, pstat, plystat))
+
+    if cache is not None and fetched:
+        cache.put_many(fetched)
+    return results
 
 
 class LivePlayerStatus():
@@ -80,6 +179,31 @@ class LivePlayerStatus():
 
     TODO: Use getter.
     """
+    @classmethod
+    def from_fields(cls, fields: Dict[str, Any]) -> "LivePlayerStatus":
+        """Restore the properties without parsing xml.
+
+        Arguments:
+            fields: Properties made by to_fields.
+
+        Returns:
+            LivePlayerStatus instance.
+        """
+        plystat = cls.__new__(cls)
+        plystat.__dict__.update(fields)
+        return plystat
+
+    def to_fields(self) -> Dict[str, Any]:
+        """Properties to store as json.
+
+        Arguments:
+            None
+
+        Returns:
+            Dict of the properties.
+        """
+        return dict(vars(self))
+
     def __init__(self, pstat: str) -> None:
         """Constructor.
 
@@ -151,5 +275,137 @@ class LivePlayerStatus():
         self.thread = int(msthread)  # type: int
 
 
+def _valid_entry(entry: Any) -> bool:
+    """Check the shape of a cache entry, like edited by hand.
+    """
+    if not isinstance(entry, dict):
+        return False
+    saved = entry.get("saved")
+    fields = entry.get("fields")
+    if (isinstance(saved, bool) or not isinstance(saved, (int, float))
+            or not isinstance(fields, dict)
+            or fields.get("errcode") is not None):
+        return False
+    return all(isinstance(fields.get(key), kind)
+               and not isinstance(fields.get(key), bool)
+               for key, kind in _FIELDTYPES.items())
+
+
+class StatusCache():
+    """On-disk cache of getplayerstatus.xml.
+
+    Keep the raw xml and the parsed properties by content id
+    for a short time, so restarting viewers or
+    attaching several tools to the same program
+    skip the request and parsing.
+    Only programs on air are cached.
+
+    Attributes:
+        ttl: Seconds to keep the status.
+        __cachefile: Path to the json file.
+    """
+    def __init__(self, cachefile: str, ttl: float=120.0) -> None:
+        """Constructor.
+
+        Arguments:
+            cachefile: Path to the json file.
+            ttl: Seconds to keep the status.
+
+        Returns:
+            None
+        """
+        self.ttl = ttl  # type: float
+        self.__cachefile = cachefile
+
+    def get(self, liveid: str) -> Optional[LivePlayerStatus]:
+        """Get the cached status.
+
+        Arguments:
+            liveid: Content id, like lv2525, co2525 and ch2525.
+
+        Returns:
+            LivePlayerStatus, None if not cached or expired.
+        """
+        entry = self.__load().get(liveid)
+        if entry is None or time.time() - entry["saved"] > self.ttl:
+            return None
+        return LivePlayerStatus.from_fields(entry["fields"])
+
+    def put(self,
+            liveid: str,
+            pstat: str,
+            plystat: LivePlayerStatus) -> None:
+        """Cache the status.
+
+        Arguments:
+            liveid: Content id, like lv2525, co2525 and ch2525.
+            pstat: getplayerstatus.xml's text content.
+            plystat: The parsed status of pstat.
+
+        Returns:
+            None
+        """
+        self.put_many([(liveid, pstat, plystat)])
+
+    def put_many(self,
+                 statuses: List[Tuple[str, str, LivePlayerStatus]]) -> None:
+        """Cache the statuses with one write.
+
+        Arguments:
+            statuses: Tuples of the arguments of put.
+
+        Returns:
+            None
+        """
+        now = time.time()
+        entries = {key: entry for key, entry in self.__load().items()
+                   if now - entry["saved"] <= self.ttl}
+        for liveid, pstat, plystat in statuses:
+            if plystat.errcode is not None:
+                continue
+            entries[liveid] = {
+                "saved": now,
+                "xml": pstat,
+                "fields": plystat.to_fields()
+            }
+        self.__save(entries)
+
+    def invalidate(self, liveid: str) -> None:
+        """Drop the status, like the connection failed with it.
+
+        Arguments:
+            liveid: Content id, like lv2525, co2525 and ch2525.
+
+        Returns:
+            None
+        """
+        entries = self.__load()
+        if entries.pop(liveid, None) is not None:
+            self.__save(entries)
+
+    def __load(self) -> Dict[str, Dict[str, Any]]:
+        """The valid entries, the others are dropped by the next save.
+        """
+        try:
+            with open(self.__cachefile, "r") as cacheopen:
+                entries = json.load(cacheopen)
+        except (IOError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return {key: entry for key, entry in entries.items()
+                if _valid_entry(entry)}
+
+    def __save(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        """Replace the json file atomically.
+        """
+        # Caching is optional, ignore the failure.
+        try:
+            with atomicfile.replace(self.__cachefile) as cacheopen:
+                json.dump(entries, cacheopen)
+        except IOError:
+            pass
+
+
 if __name__ == "__main__":
     _main()
@@ -3,11 +3,37 @@
 """Unittest script."""
 # python3 -m unittest tests/test.py
 
+import asyncio
+import contextlib
+import http.cookiejar
+import http.server
+import importlib.util
+import io
+import json
 import os
+import re
+import tempfile
+import threading
+import time
 import unittest
+import urllib.error
 
+import nicomodule.common.atomicfile as atomicfile
 import nicomodule.common.nicoid as nicoid
 import nicomodule.common.genfilter as genfilter
+import nicomodule.common.nhttp as nhttp
+import nicomodule.common.namestore as namestore
+import nicomodule.common.nickname as nickname
+import nicomodule.common.ratelimit as ratelimit
+import nicomodule.app.cview as cview
+import nicomodule.live.niconnect as niconnect
+import nicomodule.live.cserver as cserver
+import nicomodule.live.cparser as cparser
+import nicomodule.live.pstat as pstat
+
+_spec = importlib.util.spec_from_file_location("ncvpy", "ncv-py.py")
+ncvpy = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ncvpy)
 
 
 class TestGrepUrl(unittest.TestCase):
@@ -99,9 +125,889 @@ class TestFilter(unittest.TestCase):
         for text in self.falselist:
             self.assertFalse((self.filter.ismatch(text)))
 
+    def test_match_rule(self):
+        self.assertEqual(self.filter.match_rule("/hb ifseetno 0"),
+                         "^/hb ifseetno [0-9]+$")
+        self.assertEqual(self.filter.match_rule("0123"), "^[0-9]+$")
+        self.assertEqual(self.filter.match_rule("'"), "'")
+        self.assertIsNone(self.filter.match_rule("notmatch"))
+
+    def test_verdict_cache(self):
+        filepath = os.path.join("tests", "filter", "mute-example.txt")
+        mutefilter = genfilter.MatchFilter(filepath, cachesize=2)
+        for text in ("0123", "0123", "notmatch", "0123", "x.y", "notmatch"):
+            mutefilter.ismatch(text)
+        self.assertEqual((mutefilter.cache.hits, mutefilter.cache.misses),
+                         (2, 4))
+        self.assertEqual(len(mutefilter.cache), 2)
+        self.assertFalse(mutefilter.ismatch("０１２３ "))
+        mutefilter = genfilter.MatchFilter(filepath, normalize=True)
+        self.assertTrue(mutefilter.ismatch("０１２３"))
+
+    def test_reload(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, "mute.txt")
+            with open(filepath, "w") as fopen:
+                fopen.write("^abc\n")
+            mutefilter = genfilter.MatchFilter(filepath)
+            self.assertTrue(mutefilter.ismatch("abcd"))
+            self.assertFalse(mutefilter.changed())
+            with open(filepath, "w") as fopen:
+                fopen.write("^xyz\nfoo\n")
+            self.assertTrue(mutefilter.changed())
+            self.assertFalse(mutefilter.changed())
+            mutefilter.swap_rules(genfilter.compile_rules(filepath))
+            self.assertFalse(mutefilter.ismatch("abcd"))
+            self.assertTrue(mutefilter.ismatch("xyz"))
+            os.remove(filepath)
+            self.assertFalse(mutefilter.changed())
+
+    def test_compiled_cache(self):
+        texts = ["abc", "/cmd 12", "12", "(invalid", "qq", "UP", "none"]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, "mute.txt")
+            cachefile = os.path.join(tmpdir, "mute.cache")
+            with open(filepath, "w") as fopen:
+                fopen.write("abc\n^/cmd [0-9]+$\n[0-9]{3}\n(invalid\n"
+                            "(q)\\1\n(?i)up\n")
+            cold = genfilter.compile_rules(filepath, cachefile)
+            self.assertTrue(os.path.exists(cachefile))
+            warm = genfilter.compile_rules(filepath, cachefile)
+            self.assertEqual(sorted(warm.rules), sorted(cold.rules))
+            self.assertEqual(warm.rejected, ["(invalid"])
+            for text in texts:
+                self.assertEqual(warm.search(text), cold.search(text), text)
+            with open(filepath, "w") as fopen:
+                fopen.write("none\n")
+            changed = genfilter.compile_rules(filepath, cachefile)
+            self.assertEqual(changed.rules, ["none"])
+            # A broken cache is compiled again.
+            with open(cachefile, "w") as fopen:
+                fopen.write("{")
+            self.assertEqual(
+                genfilter.compile_rules(filepath, cachefile).rules, ["none"])
+            with open(cachefile, "r") as fopen:
+                cached = json.load(fopen)
+            for state in ({}, {"words": 1}, dict(cached["matcher"],
+                                                 combined="(")):
+                with open(cachefile, "w") as fopen:
+                    json.dump({"key": cached["key"], "matcher": state},
+                              fopen)
+                self.assertEqual(genfilter.compile_rules(
+                    filepath, cachefile).rules, ["none"])
+                with open(cachefile, "r") as fopen:
+                    self.assertEqual(json.load(fopen), cached)
+
+    def test_user_filter(self):
+        def chat(userid, premium=0, anonymity=False, locale="ja-jp",
+                 score=0):
+            return cparser.Comment("chat", 1, 0, userid, premium,
+                                   anonymity, locale, score, "text")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, "mute-user.txt")
+            userfilter = genfilter.UserFilter(filepath)
+            self.assertEqual(len(userfilter), 0)
+            self.assertFalse(userfilter.ismatch(chat("12345")))
+            with open(filepath, "w") as fopen:
+                fopen.write("# troll\n12345\nabcdEFG\npremium:7\n"
+                            "locale:en-us\nscore:-5000\nscore:-1000\n"
+                            "anonymity:yes\nbad:1\n")
+            self.assertTrue(userfilter.changed())
+            self.assertEqual(userfilter.reload(), 5)
+            self.assertEqual(userfilter.rejected,
+                             ["anonymity:yes", "bad:1"])
+            self.assertTrue(userfilter.ismatch(chat("12345")))
+            self.assertTrue(userfilter.ismatch(chat("abcdEFG", 0, True)))
+            self.assertTrue(userfilter.ismatch(chat("1", premium=7)))
+            self.assertTrue(userfilter.ismatch(chat("1", locale="en-us")))
+            self.assertTrue(userfilter.ismatch(chat("1", score=-1000)))
+            self.assertFalse(userfilter.ismatch(chat("1", score=-999)))
+            self.assertFalse(userfilter.ismatch(chat("1", 1, True)))
+
+    def test_flood_filter(self):
+        def chat(date, userid, content):
+            return cparser.Comment("chat", 1, date, userid, 0, True,
+                                   "ja-jp", 0, content)
+
+        flood = genfilter.FloodFilter(window=10, textlimit=3, userlimit=4,
+                                      mutetime=30, maxkeys=100)
+        raid = ["spam spam spam", "ＳＰＡＭ　ｓｐａｍ spam!!", "spamspam spaaam",
+                "spam spam spam", "spam spam spam"]
+        verdicts = [flood.ismatch(chat(0, str(num), text))
+                    for num, text in enumerate(raid)]
+        self.assertEqual(verdicts, [False, False, True, True, True])
+        # Short texts and slow posts are not floods.
+        self.assertFalse(any(flood.ismatch(chat(num, str(num), "ｗｗｗ"))
+                             for num in range(10)))
+        self.assertFalse(any(flood.ismatch(chat(num * 5, "slow", str(num)))
+                             for num in range(10)))
+        verdicts = [flood.ismatch(chat(100, "troll", str(num)))
+                    for num in range(6)]
+        self.assertEqual(verdicts, [False] * 3 + [True] * 3)
+        self.assertEqual(flood.suppressed, 6)
+        self.assertEqual(flood.expire(100),
+                         ["3 suppressed (text: spamspam spaaam)"])
+        self.assertEqual(flood.expire(200), ["3 suppressed (user: troll)"])
+        self.assertFalse(flood.ismatch(chat(200, "troll", "again")))
+
+        # Mutes are bounded too, the dropped ones are summarized.
+        flood = genfilter.FloodFilter(window=10, textlimit=2, userlimit=2,
+                                      mutetime=30, maxkeys=2)
+        for num in range(5):
+            for _ in range(2):
+                flood.ismatch(chat(0, "u{0}".format(num), str(num)))
+        self.assertEqual(flood.expire(0), ["1 suppressed (user: u{0})"
+                                           .format(_) for _ in range(3)])
+        self.assertEqual(len(flood.expire(100)), 2)
+        text = "this is a long raid message"
+        for num in range(2):
+            flood.ismatch(chat(200, str(num), text))
+        self.assertEqual(flood.expire(300), ["1 suppressed (text: {0}...)"
+                                             .format(text[:20])])
+
+    def test_profile(self):
+        filepath = os.path.join("tests", "filter", "mute-example.txt")
+        mutefilter = genfilter.MatchFilter(filepath, profile=True)
+        for text in ("0123", "0123", "d.ot", "notmatch"):
+            mutefilter.ismatch(text)
+        profile = mutefilter.profile
+        self.assertEqual(profile.texts, 4)
+        self.assertEqual(len(profile.stats), 6)
+        self.assertEqual(profile.stats["^[0-9]+$"].hits, 2)
+        self.assertEqual(profile.stats[r"\."].checks, 4)
+        self.assertEqual(len(mutefilter.cache), 0)
+        report = profile.report(limit=3)
+        self.assertIn("Never matched: 4 rules", report)
+        self.assertIn("  ^text$", report)
+
+    def test_matcher_same_as_search(self):
+        rules = ["abc", "ab", "a.c", r"x\.y", "^/cmd [0-9]+$", "^/cmd",
+                 "^/c(?:a|b)", "^a|zz", r"(q)\1", "(?i)up", "[0-9]{3}"]
+        regexes = genfilter.gen_reg_set(rules)
+        matcher = genfilter.RuleMatcher(regexes)
+        self.assertEqual(len(matcher), len(rules))
+        texts = ["abc", "xab", "a-c", "x.y", "xxy", "/cmd 12", "/cm",
+                 "/cb", "zzz", "bza", "qq", "UP", "12", "123", ""]
+        for text in texts:
+            rule = matcher.search(text)
+            expect = any(_.search(text) for _ in regexes)
+            self.assertEqual(rule is not None, expect, text)
+            if rule is not None:
+                self.assertTrue(re.search(rule, text), text)
+
     def tearDown(self):
         pass
 
 
+class TestAsyncMsgSocket(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+        self.frames = [
+            b'<thread resultcode="0" thread="1"/>',
+            b'<chat no="1" date="0" user_id="a">\xe3\x81\x82</chat>',
+            b'<chat no="2" date="0" user_id="b">text</chat>'
+        ]
+
+    async def serve(self, reader, writer):
+        self.received.append(await reader.readuntil(b"\x00"))
+        payload = b"\x00".join(self.frames) + b"\x00"
+        # Send fragmented data.
+        for idx in range(0, len(payload), 7):
+            writer.write(payload[idx:idx + 7])
+            await writer.drain()
+        writer.close()
+
+    async def collect(self, method="recv_comments"):
+        server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        comments = []
+        async with niconnect.AsyncMsgSocket() as msgsock:
+            await msgsock.connect("127.0.0.1", port, 1, log=10)
+            async for comment in getattr(msgsock, method)():
+                comments.append(comment)
+        server.close()
+        await server.wait_closed()
+        return comments
+
+    def test_recv_comments(self):
+        comments = asyncio.run(self.collect())
+        self.assertEqual(
+            self.received,
+            [b'<thread thread="1" version="20061206" res_from="-10"/>\x00'])
+        self.assertEqual(comments,
+                         [_.decode("utf-8") for _ in self.frames])
+
+    def test_recv_batches(self):
+        batches = asyncio.run(self.collect("recv_batches"))
+        self.assertTrue(all(batches))
+        parsed = [comment for batch in batches for comment in batch]
+        self.assertEqual(parsed, cparser.parse_comments(
+            [_.decode("utf-8") for _ in self.frames]))
+
+
+class TestReconnect(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+
+    def chat(self, num):
+        return '<chat no="{0}" date="0" user_id="a">{0}</chat>'.format(num)
+
+    async def serve(self, reader, writer):
+        self.received.append(await reader.readuntil(b"\x00"))
+        if len(self.received) == 1:
+            numbers = (1, 2, 3)
+        else:
+            # Duplicate comment after resuming.
+            numbers = (3, 4)
+        frames = ['<thread thread="1"/>'] + [self.chat(_) for _ in numbers]
+        writer.write("\x00".join(frames).encode("utf-8") + b"\x00")
+        await writer.drain()
+        writer.close()
+
+    async def collect(self):
+        server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        msgsock = niconnect.AsyncReconnectingMsgSocket(
+            "127.0.0.1", port, 1, log=5, backoff=0.01)
+        comments = []
+        async for comment in msgsock.recv_comments():
+            if comment.startswith("<chat"):
+                comments.append(comment)
+            if len(comments) == 4:
+                break
+        server.close()
+        await server.wait_closed()
+        return (comments, msgsock)
+
+    def test_resume(self):
+        comments, msgsock = asyncio.run(self.collect())
+        self.assertEqual(comments, [self.chat(_) for _ in (1, 2, 3, 4)])
+        self.assertIn(b'res_from="-5"', self.received[0])
+        self.assertIn(b'res_from="4"', self.received[1])
+        self.assertEqual(msgsock.reconnects, 1)
+        self.assertEqual(msgsock.state.lastno, 4)
+
+    def test_bounded_seen(self):
+        state = niconnect.ResumeState(size=2)
+        for num in (1, 2, 3):
+            self.assertTrue(state.accept(self.chat(num)))
+        self.assertFalse(state.accept(self.chat(3)))
+        # Forgotten by the bound.
+        self.assertTrue(state.accept(self.chat(1)))
+        self.assertEqual(state.resfrom(), 4)
+
+
+class TestParser(unittest.TestCase):
+    def parse_both(self, dom):
+        results = []
+        for func in (cparser.parse_comment, cparser._parse_dom):
+            try:
+                results.append(func(dom))
+            except Exception as err:
+                results.append(type(err))
+        return results
+
+    def test_same_as_dom(self):
+        frames = [
+            '<chat no="1" date="2" user_id="a" premium="3">text</chat>',
+            '<chat date="2" user_id="a" anonymity="1">&lt;&amp;&quot;</chat>',
+            '<chat date="2" user_id="a&amp;b" mail="184">\U0001F600</chat>',
+            '<chat date="2" user_id="a" mail="x>y">z</chat>',
+            '<chat date="2" user_id="a" date="3">duplicated</chat>',
+            '<chat date="2" user_id="a">&#65;&bogus;</chat>',
+            '<chat date="2" user_id="a">crlf\r\n</chat>',
+            '<chat date="2" user_id="a" mail="\t">tab</chat>',
+            '<chat date="2" user_id="a">]]></chat>',
+            '<chat date="2" user_id="a">\x01</chat>',
+            '<chat date="2"user_id="a">nospace</chat>',
+            '<chat date="2" user_id="a"></chat>',
+            '<chat date="2">no user_id</chat>',
+            '<chat date="2" user_id="a">partial',
+            '<thread resultcode="0" thread="1"/>'
+        ]
+        for dom in frames:
+            fast, dom = self.parse_both(dom)
+            self.assertEqual(fast, dom)
+
+    def test_comment_record(self):
+        parsed = cparser.parse_comment(
+            '<chat no="5" date="1500000000" user_id="abc" '
+            'anonymity="1" premium="3">/disconnect</chat>')
+        self.assertEqual(parsed.no, 5)
+        self.assertEqual(parsed.date, 1500000000)
+        self.assertEqual(parsed.premium, 3)
+        self.assertIs(parsed.anonymity, True)
+        self.assertEqual(parsed["time"], "1500000000")
+        self.assertEqual(parsed["anonymity"], "1")
+        self.assertNotIn("nickname", parsed)
+        parsed["nickname"] = "name"
+        self.assertEqual(parsed.nickname, "name")
+        self.assertEqual(len(parsed), 10)
+        with self.assertRaises(AttributeError):
+            parsed.extra = "x"
+
+    def test_stream_split(self):
+        frames = ['<thread resultcode="0" thread="1"/>',
+                  '<chat no="1" date="2" user_id="a">絵文字\U0001F600</chat>',
+                  '<chat date="3" user_id="b" anonymity="1">&amp;あ</chat>']
+        stream = "\x00".join(frames).encode("utf-8") + b"\x00"
+        parser = cparser.ChatStreamParser(keepraw=True)
+        events = []
+        # Split every multibyte character across feeds.
+        for idx in range(len(stream)):
+            events.extend(parser.feed(stream[idx:idx + 1]))
+        self.assertEqual([ev.tag for ev in events],
+                         ["thread", "chat", "chat"])
+        self.assertEqual(events[1:], [cparser.parse_comment(frames[1]),
+                                      cparser.parse_comment(frames[2])])
+        self.assertEqual([ev.data for ev in events], frames)
+        self.assertEqual(parser.errors, 0)
+
+    def test_stream_resync(self):
+        parser = cparser.ChatStreamParser()
+        events = parser.feed(b'<chat date="1" user_id="a">truncated\x00'
+                             b'<chat <bad/>\x00'
+                             b'<chat date="2" user_id="b">ok</chat>\x00')
+        self.assertEqual([ev.content for ev in events], ["ok"])
+        self.assertEqual(parser.errors, 2)
+
+    def test_stream_overflow(self):
+        parser = cparser.ChatStreamParser(keepraw=True, limit=64)
+        events = parser.feed(b'<chat date="1" user_id="a">short</chat>\x00'
+                             b'<chat date="2" user_id="b">')
+        for _ in range(100):
+            events.extend(parser.feed(b"x" * 16))
+        events.extend(parser.feed(b'</chat>\x00'
+                                  b'<chat date="3" user_id="c">next</chat>'
+                                  b'\x00'))
+        self.assertEqual([ev.content for ev in events], ["short", "next"])
+        self.assertEqual(parser.errors, 1)
+
+
+class TestCommentServer(unittest.TestCase):
+    def test_stream(self):
+        conf = cserver.StreamConfig(count=500, backlog=100,
+                                    fragment=5, multibyte=1.0)
+        with cserver.CommentServer(conf) as server:
+            addr, port = server.address
+            plystat = pstat.LivePlayerStatus(
+                cserver.gen_player_status(addr, port, conf.thread))
+            comments = []
+            with niconnect.MsgSocket() as msgsock:
+                msgsock.connect(plystat.addr, plystat.port,
+                                plystat.thread, log=10)
+                for comment in msgsock.recv_comments():
+                    comments.append(comment)
+                    if "/disconnect" in comment:
+                        break
+            report = server.wait_report(timeout=5)
+
+        # thread, backlog, live comments and /disconnect.
+        self.assertEqual(len(comments), 1 + 10 + 500 + 1)
+        self.assertEqual(report.comments, 10 + 500 + 1)
+        self.assertTrue(all("\ufffd" not in _ for _ in comments))
+
+
+class TestWatchRooms(unittest.TestCase):
+    def test_two_rooms(self):
+        confs = [cserver.StreamConfig(count=count, rate=500.0, thread=num,
+                                      backlog=0,
+                                      anonymous=1.0)
+                 for num, count in ((1, 30), (2, 60))]
+        with cserver.CommentServer(confs[0]) as first, \
+                cserver.CommentServer(confs[1]) as second, \
+                tempfile.TemporaryDirectory() as tmpdir:
+            rooms = []
+            for lvid, server, conf in (("lv1", first, confs[0]),
+                                       ("lv2", second, confs[1])):
+                addr, port = server.address
+                plystat = pstat.LivePlayerStatus(cserver.gen_player_status(
+                    addr, port, conf.thread, lvid))
+                rooms.append(ncvpy.Room(lvid, plystat, None,
+                                        "[{0}] ".format(lvid)))
+            nameMaps = {
+                anonymity: namestore.NameMap(namestore.JSONNameFile(
+                    os.path.join(tmpdir, anonymity + ".txt")))
+                for anonymity in ("0", "1")
+            }
+            resolver = nickname.NameResolver(lambda uid, name: None,
+                                             resolve=lambda uid: uid)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                asyncio.run(asyncio.wait_for(ncvpy.watch_rooms(
+                    rooms, 0, cview.Config(), nameMaps, resolver,
+                    None, None, pstat.StatusCache(
+                        os.path.join(tmpdir, "status.json"))), 10))
+            resolver.close()
+            for namemap in nameMaps.values():
+                namemap.close()
+
+        lines = output.getvalue().splitlines()
+        for lvid, conf in (("lv1", confs[0]), ("lv2", confs[1])):
+            prefix = "[{0}] ".format(lvid)
+            roomlines = [_ for _ in lines if prefix in _]
+            # Each room ends by its own /disconnect.
+            self.assertIn("/disconnect", roomlines[-2])
+            self.assertEqual(roomlines[-1], prefix + "Program ended.")
+            self.assertEqual(len(roomlines), conf.count + 2)
+        self.assertEqual(len(lines), 30 + 60 + 4)
+
+
+class TestFrameBuffer(unittest.TestCase):
+    def feed(self, framebuf, data, step):
+        frames = []
+        idx = 0
+        while idx < len(data):
+            space = framebuf.reserve()
+            piece = data[idx:idx + min(step, len(space))]
+            space[:len(piece)] = piece
+            framebuf.commit(len(piece))
+            frames.extend(framebuf.frames())
+            idx += len(piece)
+        return frames
+
+    def test_fragmented(self):
+        expected = [b"<a>" + bytes([65 + _]) * _ + b"</a>" for _ in range(40)]
+        data = b"\x00".join(expected) + b"\x00\x00"
+        for step in (1, 3, 16, 1000):
+            framebuf = niconnect.FrameBuffer(limit=64, chunk=8)
+            self.assertEqual(self.feed(framebuf, data, step), expected)
+            self.assertEqual(framebuf.dropped, 0)
+
+    def test_overflow(self):
+        data = b"short\x00" + b"x" * 100 + b"\x00next\x00"
+        framebuf = niconnect.FrameBuffer(limit=32, chunk=8)
+        self.assertEqual(self.feed(framebuf, data, 8), [b"short", b"next"])
+        self.assertEqual(framebuf.dropped, 1)
+
+
+class TestAtomicFile(unittest.TestCase):
+    def test_replace(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "nickname-id.txt")
+            with open(path, "w") as fopen:
+                fopen.write("old")
+            os.chmod(path, 0o640)
+            with atomicfile.replace(path) as fopen:
+                fopen.write("new")
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+            with self.assertRaises(ValueError):
+                with atomicfile.replace(path) as fopen:
+                    fopen.write("broken")
+                    raise ValueError()
+            with open(path, "r") as fopen:
+                self.assertEqual(fopen.read(), "new")
+            self.assertEqual(os.listdir(tmpdir), ["nickname-id.txt"])
+
+
+class TestStatusCache(unittest.TestCase):
+    def test_cache(self):
+        statusxml = cserver.gen_player_status("127.0.0.1", 2525, 10,
+                                              lvid="lv10")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cachefile = os.path.join(tmpdir, "playerstatus.json")
+            cache = pstat.StatusCache(cachefile, ttl=60)
+            self.assertIsNone(cache.get("lv10"))
+            cache.put("lv10", statusxml, pstat.LivePlayerStatus(statusxml))
+            cached = pstat.StatusCache(cachefile, ttl=60).get("lv10")
+            self.assertEqual((cached.addr, cached.port, cached.thread),
+                             ("127.0.0.1", 2525, 10))
+            self.assertEqual(cached.lvid, "lv10")
+            self.assertIsNone(pstat.StatusCache(cachefile, ttl=-1)
+                              .get("lv10"))
+            cache.invalidate("lv10")
+            self.assertIsNone(cache.get("lv10"))
+
+            # Broken entries are misses, dropped by the next save.
+            cache.put("lv10", statusxml, pstat.LivePlayerStatus(statusxml))
+            with open(cachefile, "r") as cacheopen:
+                entries = json.load(cacheopen)
+            entries["lv1"] = {"saved": "now"}
+            entries["lv2"] = dict(entries["lv10"], fields={"port": "x"})
+            entries["lv3"] = []
+            with open(cachefile, "w") as cacheopen:
+                json.dump(entries, cacheopen)
+            for liveid in ("lv1", "lv2", "lv3"):
+                self.assertIsNone(cache.get(liveid))
+            self.assertEqual(cache.get("lv10").port, 2525)
+            cache.invalidate("lv10")
+            with open(cachefile, "r") as cacheopen:
+                self.assertEqual(json.load(cacheopen), {})
+
+    def test_resolve_statuses(self):
+        class Handler(_Handler):
+            def do_GET(self):
+                liveid = self.path.split("v=")[-1]
+                if liveid.startswith("co"):
+                    body = cserver.gen_player_status("127.0.0.1", 2525, 10,
+                                                     lvid="lv" + liveid[2:])
+                else:
+                    body = ('<getplayerstatus status="fail"><error>'
+                            '<code>closed</code></error></getplayerstatus>')
+                body = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        orig = pstat.STATUS_URL
+        pstat.STATUS_URL = "http://127.0.0.1:{0}/api".format(
+            server.server_port)
+        try:
+            ids = ["co{0}".format(_) for _ in range(20)] + ["ch1", "co1"]
+            limiter = ratelimit.Limiter({"getplayerstatus": (0, 0)})
+            results = pstat.resolve_statuses("session", ids, limiter=limiter)
+        finally:
+            pstat.STATUS_URL = orig
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(len(results), 21)
+        self.assertEqual(results["co3"].lvid, "lv3")
+        self.assertEqual(results["ch1"], "closed")
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_bucket(self):
+        bucket = ratelimit.TokenBucket(50.0, burst=3)
+        start = time.monotonic()
+        waits = [bucket.acquire() for _ in range(6)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertGreater(waits[3], 0.0)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual((bucket.stats.acquired, bucket.stats.waited), (6, 3))
+        self.assertEqual(bucket.stats.waiting, 0)
+
+    def test_limiter(self):
+        limiter = ratelimit.Limiter({"seiga": (0, 0)})
+        for _ in range(100):
+            self.assertEqual(limiter.acquire("seiga"), 0.0)
+        self.assertEqual(limiter.bucket("other").rate,
+                         ratelimit.DEFAULT_BUDGET[0])
+        limiter.configure("seiga", 5.0, 2)
+        self.assertEqual(limiter.bucket("seiga").burst, 2)
+        self.assertIn("seiga: 0 requests", str(limiter))
+
+
+class TestNicknameStore(unittest.TestCase):
+    def test_import_export(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            jsonpath = os.path.join(tmpdir, "nickname-anon.txt")
+            with open(jsonpath, "w") as jsonf:
+                jsonf.write('{"a": {"name": "x", "time": 1, "fixed": 1}}')
+            with namestore.NicknameStore(
+                    os.path.join(tmpdir, "nickname.sqlite3")) as store:
+                self.assertEqual(store.import_json("anon", jsonpath), 1)
+                namemap = store.view("anon")
+                self.assertEqual(namemap["a"]["fixed"], 1)
+                self.assertNotIn("a", store.view("id"))
+                namemap["b"] = {"name": "y", "time": 2, "fixed": 0}
+                self.assertEqual(len(namemap), 2)
+                store.export_json("anon", jsonpath)
+            with open(jsonpath, "r") as jsonf:
+                self.assertEqual(list(json.load(jsonf)), ["a", "b"])
+
+    def test_name_handle(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conf = cview.Config()
+            conf.nickNameDb = os.path.join(tmpdir, "nickname.sqlite3")
+            with namestore.NicknameStore(conf.nickNameDb) as store:
+                namemap = store.view("anon")
+                parsed = cparser.parse_comment(
+                    '<chat date="5" user_id="c" anonymity="1">hi@name</chat>')
+                self.assertTrue(cview.name_handle(parsed, conf, namemap))
+                self.assertEqual(parsed.nickname, "name")
+                self.assertEqual(namemap["c"],
+                                 {"name": "name", "time": 5, "fixed": 0})
+
+    def test_write_behind(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            jsonpath = os.path.join(tmpdir, "nickname-id.txt")
+            namemap = namestore.NameMap(namestore.JSONNameFile(jsonpath))
+            for uid in ("a", "b", "a"):
+                namemap[uid] = {"name": uid, "time": 0, "fixed": 0}
+            self.assertFalse(os.path.exists(jsonpath))
+            self.assertEqual(namemap.dirty, 2)
+            namemap.close()
+            self.assertEqual(namemap.flushes, 1)
+            self.assertEqual(sorted(namestore.JSONNameFile(jsonpath).load()),
+                             ["a", "b"])
+
+            store = namestore.NicknameStore(
+                os.path.join(tmpdir, "nickname.sqlite3"))
+            namemap = namestore.NameMap(store.view("id"))
+            namemap["c"] = {"name": "c", "time": 0, "fixed": 0}
+            self.assertIsNone(store.get("id", "c"))
+            namemap.flush()
+            self.assertEqual(store.get("id", "c")["name"], "c")
+            del namemap["c"]
+            namemap.close()
+
+    def test_close_shared_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conf = cview.Config()
+            conf.nickNameId = os.path.join(tmpdir, "nickname-id.txt")
+            conf.nickNameAnon = os.path.join(tmpdir, "nickname-anon.txt")
+            conf.nickNameDb = os.path.join(tmpdir, "nickname.sqlite3")
+            namemaps = cview.open_name_maps(conf)
+            namemaps["0"]["1234"] = {"name": "id", "time": 0, "fixed": 0}
+            namemaps["1"]["abcd"] = {"name": "anon", "time": 0, "fixed": 0}
+            cview.close_name_maps(namemaps, conf)
+            with namestore.NicknameStore(conf.nickNameDb) as store:
+                self.assertEqual(store.get("id", "1234")["name"], "id")
+                self.assertEqual(store.get("anon", "abcd")["name"], "anon")
+
+    def test_json_edit_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conf = cview.Config()
+            conf.nickNameId = os.path.join(tmpdir, "nickname-id.txt")
+            conf.nickNameAnon = os.path.join(tmpdir, "nickname-anon.txt")
+            conf.nickNameDb = os.path.join(tmpdir, "nickname.sqlite3")
+            # Reloaded by the test, not by the timer.
+            conf.reloadInterval = 60.0
+            with open(conf.nickNameId, "w") as jsonf:
+                json.dump({"a": {"name": "a", "time": 0, "fixed": 0},
+                           "b": {"name": "b", "time": 0, "fixed": 0}}, jsonf)
+            namemaps = cview.open_name_maps(conf)
+            namemap = namemaps["0"]
+            self.assertFalse(namemap.reload())
+            # Renamed by the viewer, the file is not updated.
+            namemap["a"] = {"name": "new", "time": 1, "fixed": 0}
+            namemap.flush()
+            with open(conf.nickNameId, "w") as jsonf:
+                json.dump({"a": {"name": "a", "time": 0, "fixed": 0},
+                           "b": {"name": "b", "time": 0, "fixed": 1}}, jsonf)
+            os.utime(conf.nickNameId, ns=(0, 0))
+            self.assertTrue(namemap.reload())
+            self.assertEqual(namemap["b"]["fixed"], 1)
+            self.assertEqual(namemap["a"]["name"], "new")
+            cview.close_name_maps(namemaps, conf)
+            with namestore.NicknameStore(conf.nickNameDb) as store:
+                self.assertEqual(store.get("id", "b")["fixed"], 1)
+
+    def test_reload(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            jsonpath = os.path.join(tmpdir, "nickname-id.txt")
+            namefile = namestore.JSONNameFile(jsonpath)
+            namefile.write({"a": {"name": "a", "time": 0, "fixed": 0},
+                            "b": {"name": "b", "time": 0, "fixed": 0}}, [])
+            namemap = namestore.NameMap(namefile)
+            self.assertFalse(namemap.reload())
+            namemap["c"] = {"name": "c", "time": 0, "fixed": 0}
+            with open(jsonpath, "w") as jsonf:
+                jsonf.write('{"a": {"name": "x", "time": 0, "fixed": 1}}')
+            self.assertTrue(namemap.reload())
+            self.assertEqual(sorted(namemap), ["a", "c"])
+            self.assertEqual(namemap["a"]["fixed"], 1)
+            namemap.close()
+            self.assertFalse(namefile.changed())
+
+            store = namestore.NicknameStore(
+                os.path.join(tmpdir, "nickname.sqlite3"))
+            namemap = namestore.NameMap(store.view("id"))
+            namemap["d"] = {"name": "d", "time": 0, "fixed": 0}
+            namemap.flush()
+            self.assertFalse(namemap.reload())
+            with namestore.NicknameStore(
+                    os.path.join(tmpdir, "nickname.sqlite3")) as other:
+                other.import_json("id", jsonpath)
+            self.assertTrue(namemap.reload())
+            self.assertEqual(sorted(namemap), ["a", "c", "d"])
+            namemap.close()
+
+
+class TestNameResolver(unittest.TestCase):
+    def test_merge(self):
+        release = threading.Event()
+        calls = []
+
+        def resolve(uid):
+            calls.append(uid)
+            release.wait(5)
+            if uid == "bad":
+                raise IOError(uid)
+            return "name-" + uid
+
+        namemap = {}
+        resolver = nickname.NameResolver(
+            lambda uid, name: namemap.__setitem__(uid, name),
+            workers=1, maxpending=2, resolve=resolve)
+        self.assertTrue(resolver.request("a"))
+        self.assertTrue(resolver.request("a"))
+        self.assertTrue(resolver.request("bad"))
+        self.assertFalse(resolver.request("c"))
+        self.assertEqual(resolver.pending, 2)
+        release.set()
+        for _ in range(100):
+            if not resolver.pending:
+                break
+            time.sleep(0.05)
+        resolver.close()
+        self.assertEqual(calls, ["a", "bad"])
+        self.assertEqual(namemap, {"a": "name-a"})
+        self.assertEqual((resolver.resolved, resolver.dropped), (1, 1))
+        self.assertEqual(resolver.pending, 0)
+
+    def test_cache(self):
+        calls = []
+
+        def resolve(uid):
+            calls.append(uid)
+            if uid == "bad":
+                raise LookupError(uid)
+            if uid == "flaky":
+                raise IOError(uid)
+            return "name-" + uid
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cachefile = os.path.join(tmpdir, "namecache.json")
+            names = {}
+            cache = nickname.NameCache(cachefile, maxsize=2)
+            resolver = nickname.NameResolver(names.__setitem__,
+                                             resolve=resolve, cache=cache)
+            cache.start(0.01)
+            for uid in ("a", "bad", "flaky"):
+                resolver.request(uid)
+            for _ in range(100):
+                if not resolver.pending and os.path.exists(cachefile):
+                    break
+                time.sleep(0.05)
+            # Saved by the timer before close.
+            self.assertTrue(os.path.exists(cachefile))
+            self.assertFalse(resolver.request("a"))
+            self.assertFalse(resolver.request("bad"))
+            # Network errors are not cached.
+            self.assertTrue(resolver.request("flaky"))
+            resolver.close()
+            self.assertEqual(sorted(calls[:3]), ["a", "bad", "flaky"])
+            self.assertEqual(names, {"a": "name-a"})
+            self.assertEqual(resolver.cached, 2)
+
+            cache = nickname.NameCache(cachefile, negttl=0.0, maxsize=2)
+            self.assertEqual(cache.get("a"), (True, "name-a"))
+            time.sleep(0.01)
+            self.assertEqual(cache.get("bad"), (False, None))
+            cache.put("b", "x")
+            cache.put("c", "y")
+            self.assertEqual(cache.get("a"), (False, None))
+            self.assertEqual(len(cache), 2)
+
+            # A failed save is retried without another change.
+            cachefile = os.path.join(tmpdir, "later", "namecache.json")
+            cache = nickname.NameCache(cachefile)
+            cache.put("a", "x")
+            cache.save()
+            self.assertFalse(os.path.exists(cachefile))
+            os.mkdir(os.path.dirname(cachefile))
+            cache.save()
+            self.assertEqual(nickname.NameCache(cachefile).get("a"),
+                             (True, "x"))
+
+    def test_prefetch(self):
+        release = threading.Event()
+        calls = []
+
+        def resolve(uid):
+            calls.append(uid)
+            release.wait(5)
+            return uid
+
+        frames = ['<chat date="1" user_id="{0}" anonymity="{1}">x</chat>'
+                  .format(uid, anon) for uid, anon in
+                  (("a", 0), ("b", 1), ("c", 0), ("a", 0), ("d", 0))]
+        comments = [cparser.parse_comment(_) for _ in frames]
+        resolver = nickname.NameResolver(lambda uid, name: None,
+                                         workers=1, resolve=resolve)
+        self.assertEqual(
+            cview.prefetch_names(comments, {"d": {}}, resolver), 2)
+        self.assertEqual(resolver.pending, 2)
+        release.set()
+        for _ in range(100):
+            if not resolver.pending:
+                break
+            time.sleep(0.05)
+        resolver.close()
+        self.assertEqual(calls, ["a", "c"])
+
+    def test_placeholder(self):
+        namemap = {}
+        resolver = nickname.NameResolver(lambda uid, name: None,
+                                         resolve=lambda uid: uid)
+        self.assertEqual(cview.assign_nickname("a", False, namemap, resolver),
+                         ("a", False))
+        resolver.close()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    posts = 0
+
+    def do_GET(self):
+        if self.path == "/login":
+            self.send_response(302)
+            self.send_header("Location", "/home")
+            self.send_header("Set-Cookie", "user_session=abc; Path=/")
+            body = b""
+        elif self.path == "/missing":
+            self.send_response(404)
+            body = b"not found"
+        else:
+            self.send_response(200)
+            body = self.headers.get("Cookie", "none").encode("utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        _Handler.posts += 1
+        # Drop the kept-alive connection after reading the request.
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPClient(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                      _Handler)
+        self.base = "http://127.0.0.1:{0}".format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.client = nhttp.HTTPClient(backoff=0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keepalive(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get(self.base + "/").body, b"none")
+        self.assertEqual(self.client.stats.connects, 1)
+        self.assertEqual(self.client.stats.reused, 4)
+
+    def test_post_not_resent(self):
+        self.client.get(self.base + "/")
+        _Handler.posts = 0
+        with self.assertRaises(OSError):
+            self.client.post(self.base + "/drop", {"a": "1"})
+        self.assertEqual(_Handler.posts, 1)
+
+    def test_redirect_cookie(self):
+        jar = http.cookiejar.CookieJar()
+        resp = self.client.get(self.base + "/login", cookiejar=jar)
+        self.assertEqual(resp.url, self.base + "/home")
+        self.assertEqual(resp.body, b"user_session=abc")
+
+    def test_http_error(self):
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            self.client.get(self.base + "/missing")
+        self.assertEqual(ctx.exception.code, 404)
+
+
 if __name__ == "__main__":
     unittest.main()